@@ -1,12 +1,84 @@
+import contextvars
+import os
 import re
-from flask import Flask, render_template, request, redirect, url_for
-from services.wiki_client import WikiAgent
-from services.spotify import SpotifyHandler
+import time
+from concurrent.futures import ThreadPoolExecutor
+from flask import Flask, Response, g, render_template, stream_template, request, redirect, url_for, jsonify
+from flask import before_render_template, template_rendered
+from services import deadline, metrics
+from services.image_proxy import sized_url
+from services.models import TrackDetails
+from services.runtime import Services, window_args
+from services.runtime import TRACK_PAGE_DEADLINE, REQUEST_DEADLINE, ENDPOINT_DEADLINES, DEFAULT_TRACK_IMAGE
 
 app = Flask(__name__)
-agent = WikiAgent()
+# Cache, client e lavori in background (vedi services/runtime.py); i nomi a livello
+# di modulo restano per le route e per bench.run
+shared = Services.from_env()
+agent, sp_handler, prewarmer = shared.agent, shared.sp_handler, shared.prewarmer
+page_cache, images, insights = shared.page_cache, shared.images, shared.insights
+app.add_template_filter(images.thumb, 'thumb')
 
-sp_handler = SpotifyHandler(client_id="aa75bf8321234d9493c0e84adfe3d20e", client_secret="b3c8ac21c6f944e7975d33275678ab3c")
+# Pool condiviso per le chiamate a Wikidata eseguite in parallelo dalle route
+executor = ThreadPoolExecutor(max_workers=int(os.environ.get('UPSTREAM_WORKERS', 16)))
+
+
+def _result_or(future, deadline, default):
+    """Attende il future fino alla deadline; in caso di timeout o errore restituisce `default`."""
+    try:
+        return future.result(timeout=max(0, deadline - time.monotonic()))
+    except Exception as e:
+        print(f"⏱️ Chiamata Wikidata scartata ({type(e).__name__}): {e}")
+        return default
+
+
+def _submit(fn, *args):
+    """executor.submit nel contesto della richiesta: le chiamate finiscono nel log della richiesta."""
+    return executor.submit(contextvars.copy_context().run, fn, *args)
+
+
+# --- Metriche e profilazione ------------------------------------------------
+
+metrics.REGISTRY.register_collector(shared.metrics)
+
+
+@app.before_request
+def _start_request_timer():
+    # X-Profile: 1 profila la richiesta con cProfile (solo con PROFILE_REQUESTS=1)
+    profile = metrics.profiling_enabled() and request.headers.get('X-Profile') == '1'
+    g.request_timer = metrics.RequestTimer(profile=profile)
+    deadline.start(ENDPOINT_DEADLINES.get(request.endpoint, REQUEST_DEADLINE))
+
+@app.teardown_request
+def _clear_deadline(exc):
+    deadline.clear()
+
+@app.after_request
+def _record_request(response):
+    # Per le risposte in streaming (/playlist) la durata è il tempo fino all'inizio dello stream
+    timer = g.pop('request_timer', None)
+    if timer is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        # calculate_content_length() bufferizzerebbe le risposte in streaming
+        size = None if response.is_streamed else response.calculate_content_length()
+        profile_file = timer.finish(route, request.method, response.status_code, size=size, path=request.path)
+        if profile_file:
+            response.headers['X-Profile-File'] = profile_file
+    return response
+
+@before_render_template.connect_via(app)
+def _start_render_timer(sender, template, context, **extra):
+    g.render_started = time.perf_counter()
+
+@template_rendered.connect_via(app)
+def _record_render(sender, template, context, **extra):
+    started = g.pop('render_started', None)
+    if started is not None:
+        metrics.observe_render(template.name, time.perf_counter() - started)
+
+@app.route('/metrics')
+def metrics_export():
+    return Response(metrics.REGISTRY.render(), mimetype='text/plain; version=0.0.4')
 
 @app.route('/')
 def home():
@@ -16,8 +88,62 @@ def home():
 def load():
     playlist_url = request.form.get('playlist_url', '').strip()
     pid = sp_handler.extract_id_from_url(playlist_url)
-    tracks, is_demo = sp_handler.get_playlist_tracks(pid)
-    return render_template('playlist.html', tracks=tracks, pid=pid, demo=is_demo)
+    resolve = bool(request.form.get('resolve'))
+    if request.form.get('view') == 'virtual':
+        # Vista a scorrimento: la pagina è leggera e i brani arrivano dall'API a finestre
+        return redirect(url_for('playlist_view', pid=pid, resolve=1 if resolve else None), code=303)
+    pages, is_demo = sp_handler.iter_playlist_pages(pid)
+
+    def tracks():
+        for page in pages:
+            # Modalità pre-risoluzione: i brani di ogni pagina risolti su Wikidata in poche
+            # query batch, così la pagina linka direttamente /track senza passare da /resolve_track
+            if resolve:
+                with deadline.budget(REQUEST_DEADLINE):
+                    _attach_resolution(page)
+            if prewarmer is not None:
+                prewarmer.enqueue_tracks(page)
+            yield from page
+
+    # Risposta in streaming: le prime righe arrivano al browser dopo la prima pagina Spotify
+    return stream_template('playlist.html', tracks=tracks(), pid=pid, demo=is_demo)
+
+
+@app.route('/playlist/<pid>')
+def playlist_view(pid):
+    return render_template('playlist_virtual.html', pid=pid, resolve=bool(request.args.get('resolve')))
+
+@app.route('/api/playlist/<pid>')
+def playlist_api(pid):
+    if not pid.isalnum():
+        return jsonify({'error': 'ID playlist non valido'}), 400
+    offset, limit = window_args(request.args)
+    resolve = bool(request.args.get('resolve'))
+    window = sp_handler.playlist_window(pid, offset, limit, request.args.get('snapshot'))
+    if resolve and window[0]:
+        _attach_resolution(window[0])
+    if prewarmer is not None:
+        prewarmer.enqueue_tracks(window[0])
+    return jsonify(shared.playlist_payload(pid, offset, limit, window, resolve))
+
+
+@app.route('/playlist/<pid>/insights')
+def playlist_insights_view(pid):
+    return render_template('insights.html', pid=pid)
+
+@app.route('/api/playlist/<pid>/insights')
+def playlist_insights_api(pid):
+    if not pid.isalnum():
+        return jsonify({'error': 'ID playlist non valido'}), 400
+    return jsonify(dict(insights.get(pid), playlist=pid))
+
+
+def _attach_resolution(tracks):
+    resolved = agent.resolve_tracks_batch([(t.title, t.artist) for t in tracks])
+    for track, res in zip(tracks, resolved):
+        if res is not None:
+            track.wikidata_id, track.wikidata_artist_id = res
+            track.resolved = True
 
 @app.route('/resolve_track')
 def resolve_track():
@@ -46,6 +172,10 @@ def resolve_track():
 
 @app.route('/track')
 def track_detail():
+    key, page = page_cache.lookup('track', request.args)
+    if page is not None:
+        return page_cache.respond(page, request, Response)
+
     wikidata_id = request.args.get('id')
     wikidata_artist_id = request.args.get('artist_id') 
 
@@ -54,27 +184,34 @@ def track_detail():
     album = request.args.get('album', '')
     spotify_image = request.args.get('image', '')
     
-    wiki_data = {
-        'found': False, 
-        'artisti_list': [{'name': artist, 'url': None}],
-        'recommendations': [] 
-    }
+    wiki_data = TrackDetails.not_found(artist)
+    partial = False
 
     if wikidata_id:
-  
-        details = agent.get_track_details(wikidata_id)
-        
-        if details['found']:
-            wiki_data = details 
-            recs = agent.get_recommendations(wikidata_id, wikidata_artist_id)
-            wiki_data['recommendations'] = recs
+        # Dettagli, consigliati e artista principale arrivano da una sola query (get_track_bundle);
+        # l'artista finisce in cache per il click successivo su /artista
+        bundle_future = _submit(agent.get_track_bundle, wikidata_id, wikidata_artist_id)
+        bundle = _result_or(bundle_future, time.monotonic() + TRACK_PAGE_DEADLINE, None)
+
+        if bundle is not None and bundle['track'].found:
+            wiki_data = bundle['track']
+            wiki_data.recommendations = bundle['recommendations']
+            partial = bundle['partial']
+            # Gli altri interpreti non sono nel bundle: prefetch senza bloccare la pagina
+            for a in wiki_data.artisti_list:
+                if a.url and a.url != wikidata_artist_id:
+                    _submit(agent.get_artist_details, a.url)
 
     if spotify_image:
-        wiki_data['image'] = spotify_image
-    elif not wiki_data.get('image'):
-        wiki_data['image'] = 'https://img.pixers.pics/pho_wat(s3:700/FO/62/54/28/58/700_FO62542858_dc0c3c4b646ab8a8a389c58f8af73ed9.jpg,700,688,cms:2018/10/5bd1b6b8d04b8_220x50-watermark.png,over,480,638,jpg)/adesivi-disco-di-vinile-isolato-su-sfondo-bianco.jpg'
+        wiki_data.image = spotify_image
+    elif not wiki_data.image:
+        wiki_data.image = DEFAULT_TRACK_IMAGE
 
-    return render_template('track.html', title=title, artist=artist, album=album, wiki=wiki_data)
+    html = render_template('track.html', title=title, artist=artist, album=album, wiki=wiki_data)
+    # Pagina parziale (Wikidata oltre la deadline o in errore, anche solo per i consigliati):
+    # servita ma non salvata
+    page = page_cache.store(key, html, cacheable=not wikidata_id or (wiki_data.found and not partial))
+    return page_cache.respond(page, request, Response)
 
 
 @app.route('/artista')
@@ -83,13 +220,38 @@ def artist_detail():
     
     if not artist_url:
         return "URL Artista mancante", 400
-    artist_data = agent.get_artist_details(artist_url)
-    
-    if not artist_data['found']:
-        return "Artista non trovato su Wikidata", 404
-        
-    return render_template('artista.html', artist=artist_data)
+    key, page = page_cache.lookup('artista', request.args)
+    if page is None:
+        artist_data = agent.get_artist_details(artist_url)
+
+        if not artist_data['found']:
+            return "Artista non trovato su Wikidata", 404
+
+        page = page_cache.store(key, render_template('artista.html', artist=artist_data))
+    return page_cache.respond(page, request, Response)
+
+@app.route('/img')
+def image_proxy():
+    src = request.args.get('src', '')
+    if not images.allowed(src):
+        return "Sorgente immagine non consentita", 400
+    width = request.args.get('w', 360, type=int)
+    if not images.enabled:
+        # IMAGE_PROXY=0: niente download, nemmeno per i link /img già nelle pagine in cache
+        return redirect(sized_url(src, width))
+    image = images.get(src, width)
+    if image is None:
+        # Download fallito: il browser prova direttamente la sorgente
+        return redirect(src)
+    return images.respond(image, request, Response)
+
+@app.route('/status/prewarm')
+def prewarm_status():
+    if prewarmer is None:
+        return jsonify({'enabled': False})
+    return jsonify(dict(prewarmer.status(), enabled=True))
 
 if __name__ == '__main__':
+    # Server di sviluppo; in produzione l'app gira su Hypercorn (vedi asgi.py)
     print("Avvio del server di Integrazione Applicativa...")
-    app.run(host='0.0.0.0', port=5001, debug=True)
\ No newline at end of file
+    app.run(host='0.0.0.0', port=5001, debug=os.environ.get('FLASK_DEBUG', '1') == '1')
@@ -0,0 +1,232 @@
+"""
+Modalità di servizio ASGI (Quart + Hypercorn).
+
+Stesse route e stessi template di app.py, ma le chiamate a Wikidata e Spotify
+sono non bloccanti: mentre una richiesta aspetta la rete, lo stesso worker ne
+serve altre, senza occupare un thread per ogni richiesta in attesa.
+
+Avvio: hypercorn -c hypercorn.toml asgi:app
+"""
+import asyncio
+import time
+from quart import Quart, Response, g, render_template, stream_template, request, redirect, url_for, jsonify
+from services import deadline, metrics
+from services.image_proxy import sized_url
+from services.models import TrackDetails
+from services.runtime import Services, window_args
+from services.runtime import TRACK_PAGE_DEADLINE, REQUEST_DEADLINE, ENDPOINT_DEADLINES, DEFAULT_TRACK_IMAGE
+
+app = Quart(__name__)
+# Stessi servizi della versione WSGI (services/runtime.py), senza importare app.py
+shared = Services.from_env()
+agent, sp_handler, prewarmer = shared.agent, shared.sp_handler, shared.prewarmer
+page_cache, images, insights = shared.page_cache, shared.images, shared.insights
+app.add_template_filter(images.thumb, 'thumb')
+metrics.REGISTRY.register_collector(shared.metrics)
+
+# Riferimenti ai task di prefetch, altrimenti il garbage collector potrebbe interromperli
+_background_tasks = set()
+
+
+async def _result_or(awaitable, deadline, default):
+    """Attende fino alla deadline; in caso di timeout o errore restituisce `default`."""
+    try:
+        return await asyncio.wait_for(awaitable, max(0, deadline - time.monotonic()))
+    except Exception as e:
+        print(f"⏱️ Chiamata Wikidata scartata ({type(e).__name__}): {e}")
+        return default
+
+
+def _spawn(coro):
+    task = asyncio.get_running_loop().create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+
+@app.after_serving
+async def _close_clients():
+    # I client httpx vivono quanto il loop del worker: chiusi qui, non abbandonati
+    await shared.aclose()
+
+
+# Stesse metriche della versione WSGI (registro condiviso); niente X-Profile:
+# con l'event loop un profilo cProfile mescolerebbe le richieste concorrenti
+@app.before_request
+async def _start_request_timer():
+    g.request_timer = metrics.RequestTimer()
+    # La scadenza vive nel contesto del task della richiesta: la ereditano gather e i task figli
+    deadline.start(ENDPOINT_DEADLINES.get(request.endpoint, REQUEST_DEADLINE))
+
+@app.after_request
+async def _record_request(response):
+    timer = g.pop('request_timer', None)
+    if timer is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        timer.finish(route, request.method, response.status_code,
+                     size=response.content_length, path=request.path)
+    return response
+
+@app.route('/metrics')
+async def metrics_export():
+    return Response(metrics.REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/')
+async def home():
+    return await render_template('index.html', error=None)
+
+@app.route('/playlist', methods=['POST'])
+async def load():
+    form = await request.form
+    playlist_url = form.get('playlist_url', '').strip()
+    pid = sp_handler.extract_id_from_url(playlist_url)
+    resolve = bool(form.get('resolve'))
+    if form.get('view') == 'virtual':
+        return redirect(url_for('playlist_view', pid=pid, resolve=1 if resolve else None), code=303)
+    pages, is_demo = await sp_handler.aiter_playlist_pages(pid)
+
+    async def tracks():
+        async for page in pages:
+            if resolve:
+                with deadline.budget(REQUEST_DEADLINE):
+                    await _attach_resolution(page)
+            if prewarmer is not None:
+                prewarmer.enqueue_tracks(page)
+            for track in page:
+                yield track
+
+    return await stream_template('playlist.html', tracks=tracks(), pid=pid, demo=is_demo)
+
+
+@app.route('/playlist/<pid>')
+async def playlist_view(pid):
+    return await render_template('playlist_virtual.html', pid=pid, resolve=bool(request.args.get('resolve')))
+
+@app.route('/api/playlist/<pid>')
+async def playlist_api(pid):
+    if not pid.isalnum():
+        return jsonify({'error': 'ID playlist non valido'}), 400
+    offset, limit = window_args(request.args)
+    resolve = bool(request.args.get('resolve'))
+    window = await sp_handler.aplaylist_window(pid, offset, limit, request.args.get('snapshot'))
+    if resolve and window[0]:
+        await _attach_resolution(window[0])
+    if prewarmer is not None:
+        prewarmer.enqueue_tracks(window[0])
+    return jsonify(shared.playlist_payload(pid, offset, limit, window, resolve))
+
+@app.route('/playlist/<pid>/insights')
+async def playlist_insights_view(pid):
+    return await render_template('insights.html', pid=pid)
+
+@app.route('/api/playlist/<pid>/insights')
+async def playlist_insights_api(pid):
+    if not pid.isalnum():
+        return jsonify({'error': 'ID playlist non valido'}), 400
+    return jsonify(dict(await insights.aget(pid), playlist=pid))
+
+
+async def _attach_resolution(tracks):
+    resolved = await agent.aresolve_tracks_batch([(t.title, t.artist) for t in tracks])
+    for track, res in zip(tracks, resolved):
+        if res is not None:
+            track.wikidata_id, track.wikidata_artist_id = res
+            track.resolved = True
+
+@app.route('/resolve_track')
+async def resolve_track():
+    title = request.args.get('title')
+    artist = request.args.get('artist')
+    album = request.args.get('album', '')
+    img = request.args.get('image', '')
+    track_url, artist_url = await agent.aget_track_url(title, artist)
+
+    if track_url:
+        return redirect(url_for('track_detail',
+                                id=track_url,
+                                artist_id=artist_url,
+                                title=title,
+                                artist=artist,
+                                album=album,
+                                image=img))
+    return redirect(url_for('track_detail',
+                            found='false',
+                            title=title,
+                            artist=artist,
+                            album=album,
+                            image=img))
+
+@app.route('/track')
+async def track_detail():
+    key, page = page_cache.lookup('track', request.args)
+    if page is not None:
+        return page_cache.respond(page, request, Response)
+
+    wikidata_id = request.args.get('id')
+    wikidata_artist_id = request.args.get('artist_id')
+
+    title = request.args.get('title', 'Sconosciuto')
+    artist = request.args.get('artist', 'Sconosciuto')
+    album = request.args.get('album', '')
+    spotify_image = request.args.get('image', '')
+
+    wiki_data = TrackDetails.not_found(artist)
+    partial = False
+
+    if wikidata_id:
+        # Una sola query per dettagli, consigliati e artista principale, come nella versione WSGI
+        bundle = await _result_or(agent.aget_track_bundle(wikidata_id, wikidata_artist_id),
+                                  time.monotonic() + TRACK_PAGE_DEADLINE, None)
+
+        if bundle is not None and bundle['track'].found:
+            wiki_data = bundle['track']
+            wiki_data.recommendations = bundle['recommendations']
+            partial = bundle['partial']
+            for a in wiki_data.artisti_list:
+                if a.url and a.url != wikidata_artist_id:
+                    _spawn(agent.aget_artist_details(a.url))
+
+    if spotify_image:
+        wiki_data.image = spotify_image
+    elif not wiki_data.image:
+        wiki_data.image = DEFAULT_TRACK_IMAGE
+
+    html = await render_template('track.html', title=title, artist=artist, album=album, wiki=wiki_data)
+    page = page_cache.store(key, html, cacheable=not wikidata_id or (wiki_data.found and not partial))
+    return page_cache.respond(page, request, Response)
+
+
+@app.route('/artista')
+async def artist_detail():
+    artist_url = request.args.get('url')
+
+    if not artist_url:
+        return "URL Artista mancante", 400
+    key, page = page_cache.lookup('artista', request.args)
+    if page is None:
+        artist_data = await agent.aget_artist_details(artist_url)
+
+        if not artist_data['found']:
+            return "Artista non trovato su Wikidata", 404
+
+        page = page_cache.store(key, await render_template('artista.html', artist=artist_data))
+    return page_cache.respond(page, request, Response)
+
+@app.route('/img')
+async def image_proxy():
+    src = request.args.get('src', '')
+    if not images.allowed(src):
+        return "Sorgente immagine non consentita", 400
+    width = request.args.get('w', 360, type=int)
+    if not images.enabled:
+        return redirect(sized_url(src, width))
+    # Cache su disco e download sincroni: fuori dall'event loop
+    image = await asyncio.to_thread(images.get, src, width)
+    if image is None:
+        return redirect(src)
+    return images.respond(image, request, Response)
+
+@app.route('/status/prewarm')
+async def prewarm_status():
+    if prewarmer is None:
+        return jsonify({'enabled': False})
+    return jsonify(dict(prewarmer.status(), enabled=True))
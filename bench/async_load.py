@@ -0,0 +1,134 @@
+"""
+Prova di carico: throughput sostenuto di /track con Wikidata lento.
+
+Avvia lo stub degli upstream (bench/stub_server.py) con Wikidata a `--latency` secondi,
+poi l'app in modalità ASGI (Hypercorn) o WSGI (server threaded di Werkzeug)
+puntata sullo stub, e la bombarda con `--concurrency` client per `--duration`
+secondi. Ogni richiesta usa un'entità diversa, quindi la cache non aiuta.
+
+    python -m bench.async_load --mode asgi --concurrency 200 --duration 20
+    python -m bench.async_load --mode wsgi --concurrency 200 --duration 20
+"""
+import argparse
+import asyncio
+import itertools
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import httpx
+
+from bench.report import summarize
+from bench.stub_server import StubUpstream
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def start_app(mode, port, stub_url, workers, pool_size):
+    env = dict(os.environ,
+               WIKIDATA_SPARQL_URL=stub_url,
+               WIKIDATA_RATE='0',
+               WIKIDATA_POOL_SIZE=str(pool_size),
+               PREWARM_WORKERS='0',
+               TRACK_PAGE_DEADLINE='60',
+               PYTHONUNBUFFERED='1')
+    if mode == 'asgi':
+        cmd = [sys.executable, '-m', 'hypercorn', 'asgi:app', '--bind', f'127.0.0.1:{port}',
+               '--workers', str(workers)]
+    else:
+        cmd = [sys.executable, '-c',
+               f"from app import app; app.run(host='127.0.0.1', port={port}, threaded=True, debug=False)"]
+    return subprocess.Popen(cmd, cwd=PROJECT_ROOT, env=env, stdin=subprocess.DEVNULL,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+async def wait_ready(base_url, timeout=60):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            try:
+                await client.get(base_url + '/status/prewarm')
+                return
+            except httpx.TransportError:
+                await asyncio.sleep(0.2)
+    raise RuntimeError(f"Server non pronto su {base_url}")
+
+
+async def run_load(base_url, concurrency, duration):
+    counter = itertools.count(1000)
+    latencies = []
+    errors = 0
+    stop_at = time.monotonic() + duration
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=120) as client:
+        async def user():
+            nonlocal errors
+            while time.monotonic() < stop_at:
+                n = next(counter)
+                start = time.monotonic()
+                try:
+                    r = await client.get('/track', params={
+                        'id': f'http://www.wikidata.org/entity/Q{n}',
+                        'artist_id': 'http://www.wikidata.org/entity/Q1',
+                        'title': f'Song {n}', 'artist': 'Stub Artist',
+                    })
+                    if r.status_code != 200:
+                        errors += 1
+                        continue
+                except httpx.HTTPError:
+                    errors += 1
+                    continue
+                latencies.append(time.monotonic() - start)
+
+        started = time.monotonic()
+        await asyncio.gather(*(user() for _ in range(concurrency)))
+        elapsed = time.monotonic() - started
+
+    return latencies, errors, elapsed
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mode', choices=['asgi', 'wsgi'], default='asgi')
+    parser.add_argument('--concurrency', type=int, default=200)
+    parser.add_argument('--duration', type=float, default=20)
+    parser.add_argument('--latency', type=float, default=2.0, help="latenza simulata di Wikidata (s)")
+    parser.add_argument('--workers', type=int, default=1, help="worker Hypercorn (solo asgi)")
+    args = parser.parse_args()
+
+    stub = StubUpstream(latency=args.latency)
+    stub_url = stub.start()
+    app_port = _free_port()
+    # Il pool verso lo stub non deve essere il collo di bottiglia
+    proc = start_app(args.mode, app_port, f'{stub_url}/sparql', args.workers,
+                     pool_size=args.concurrency * 2)
+    base_url = f'http://127.0.0.1:{app_port}'
+    try:
+        asyncio.run(wait_ready(base_url))
+        latencies, errors, elapsed = asyncio.run(run_load(base_url, args.concurrency, args.duration))
+    finally:
+        proc.terminate()
+        proc.wait(timeout=10)
+        stub.stop()
+
+    summary = summarize(latencies, elapsed=elapsed, errors=errors)
+    print(f"Modalità {args.mode}: {args.concurrency} client, Wikidata a {args.latency}s")
+    print(f"  richieste ok: {summary['requests']}  errori: {errors}  durata: {elapsed:.1f}s")
+    print(f"  throughput:   {summary['throughput_rps']:.1f} req/s")
+    if latencies:
+        print(f"  latenza p50:  {summary['p50_ms'] / 1000:.2f}s  "
+              f"p95: {summary['p95_ms'] / 1000:.2f}s  p99: {summary['p99_ms'] / 1000:.2f}s")
+    print(f"  chiamate allo stub: {stub.stats()}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""Statistiche, tabella dei risultati e baseline salvate dei benchmark."""
+import json
+import os
+
+BASELINES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines')
+
+
+def percentile(ordered, q):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+def summarize(latencies, elapsed=None, errors=0):
+    """Latenze in secondi -> p50/p95/p99 in ms ed eventuale throughput."""
+    ordered = sorted(latencies)
+    summary = {'requests': len(ordered), 'errors': errors}
+    if ordered:
+        summary.update({
+            'mean_ms': round(sum(ordered) / len(ordered) * 1000, 2),
+            'p50_ms': round(percentile(ordered, 0.50) * 1000, 2),
+            'p95_ms': round(percentile(ordered, 0.95) * 1000, 2),
+            'p99_ms': round(percentile(ordered, 0.99) * 1000, 2),
+        })
+    if elapsed:
+        summary['throughput_rps'] = round(len(ordered) / elapsed, 2)
+    return summary
+
+
+def print_table(results):
+    header = f"{'route':<15}{'fase':<8}{'req':>6}{'err':>5}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'req/s':>9}  upstream/req"
+    print(header)
+    print('-' * len(header))
+    for route, phases in results['routes'].items():
+        for phase, s in phases.items():
+            upstream = ', '.join(f"{k}={v}" for k, v in sorted(s.get('upstream_per_request', {}).items()))
+            print(f"{route:<15}{phase:<8}{s['requests']:>6}{s['errors']:>5}"
+                  f"{s.get('p50_ms', 0):>10.1f}{s.get('p95_ms', 0):>10.1f}{s.get('p99_ms', 0):>10.1f}"
+                  f"{s.get('throughput_rps', 0):>9.1f}  {upstream or '-'}")
+
+
+def save_baseline(name, results):
+    os.makedirs(BASELINES_DIR, exist_ok=True)
+    path = os.path.join(BASELINES_DIR, f"{name}.json")
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+    return path
+
+
+def load_baseline(name):
+    with open(os.path.join(BASELINES_DIR, f"{name}.json"), encoding='utf-8') as f:
+        return json.load(f)
+
+
+def compare(results, baseline, tolerance=0.2):
+    """
+    Regressioni rispetto alla baseline: p95 oltre la tolleranza, throughput
+    sotto la tolleranza o più chiamate a monte per richiesta.
+    """
+    regressions = []
+    for route, phases in results['routes'].items():
+        for phase, current in phases.items():
+            base = baseline.get('routes', {}).get(route, {}).get(phase)
+            if not base:
+                continue
+            label = f"{route}/{phase}"
+            if 'p95_ms' in base and current.get('p95_ms', 0) > base['p95_ms'] * (1 + tolerance):
+                regressions.append(f"{label}: p95 {base['p95_ms']} -> {current['p95_ms']} ms")
+            if 'throughput_rps' in base and current.get('throughput_rps', 0) < base['throughput_rps'] * (1 - tolerance):
+                regressions.append(f"{label}: throughput {base['throughput_rps']} -> {current['throughput_rps']} req/s")
+            base_calls = sum(base.get('upstream_per_request', {}).values())
+            calls = sum(current.get('upstream_per_request', {}).values())
+            if calls > base_calls * (1 + tolerance) + 0.01:
+                regressions.append(f"{label}: chiamate a monte per richiesta {base_calls:.2f} -> {calls:.2f}")
+    return regressions
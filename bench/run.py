@@ -0,0 +1,273 @@
+"""
+Benchmark delle route dell'app con upstream registrati.
+
+Avvia lo stub di Spotify e Wikidata (bench/stub_server.py), punta l'app Flask
+su di esso e misura /playlist, /resolve_track, /track e /artista in due fasi:
+  - client: richieste sequenziali con il test client di Flask
+  - load:   client concorrenti via HTTP sul server threaded di Werkzeug
+Per ogni route riporta p50/p95/p99, throughput e chiamate a monte per richiesta.
+
+    python -m bench.run --latency 0.2 --save-baseline main
+    python -m bench.run --latency 0.2 --compare main      # exit 1 se ci sono regressioni
+    python -m bench.run --cold --routes track,artista --concurrency 0
+"""
+import argparse
+import itertools
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from bench.report import compare, load_baseline, print_table, save_baseline, summarize
+from bench.stub_server import StubUpstream
+
+ENTITY = "http://www.wikidata.org/entity/"
+ROUTES = ('playlist', 'playlist_api', 'insights', 'resolve_track', 'track', 'artista')
+
+
+class _StaticToken:
+    """Auth manager minimo per spotipy: lo stub non verifica il token."""
+
+    def get_access_token(self, as_dict=False):
+        return 'bench-token'
+
+
+def _configure_env(stub_url, snapshot_dir):
+    os.environ.update({
+        'WIKIDATA_SPARQL_URL': stub_url + '/sparql',
+        'WIKIDATA_RATE': '0',
+        'SPOTIFY_API_URL': stub_url + '/v1',
+        'SPOTIFY_SNAPSHOT_DIR': snapshot_dir,
+        'PREWARM_WORKERS': '0',
+        'WIKI_BACKEND': 'remote',
+    })
+
+
+def _load_app(stub_url):
+    import spotipy
+    import app as app_module
+
+    handler = app_module.sp_handler
+    handler.sp = spotipy.Spotify(auth_manager=_StaticToken())
+    handler.sp.prefix = stub_url + '/v1/'
+    handler.active = True
+    return app_module
+
+
+def _requests(stub):
+    """Generatori infiniti di richieste (metodo, path, parametri) per ogni route."""
+    playlist = stub.playlist
+    tracks = [i['track'] for i in stub.items
+              if i['track'].get('id') and i['track'].get('type') == 'track' and not i['track'].get('is_local')]
+    counter = itertools.count()
+
+    def playlist_requests():
+        url = f"https://open.spotify.com/playlist/{playlist['playlist_id']}"
+        while True:
+            yield 'POST', '/playlist', {'playlist_url': url}
+
+    def playlist_api_requests():
+        # Scorrimento della vista virtualizzata: finestre successive da 100 brani
+        for n in itertools.count():
+            yield 'GET', f"/api/playlist/{playlist['playlist_id']}", {'offset': (n * 100) % len(tracks), 'limit': 100}
+
+    def insights_requests():
+        while True:
+            yield 'GET', f"/api/playlist/{playlist['playlist_id']}/insights", {}
+
+    def resolve_requests():
+        for n in counter:
+            t = tracks[n % len(tracks)]
+            yield 'GET', '/resolve_track', {'title': t['name'], 'artist': t['artists'][0]['name'],
+                                            'album': t['album']['name']}
+
+    def track_requests():
+        for n in itertools.count():
+            t = tracks[n % len(tracks)]
+            yield 'GET', '/track', {'id': f"{ENTITY}Q{1000 + n % len(tracks)}", 'artist_id': f"{ENTITY}Q15862",
+                                    'title': t['name'], 'artist': t['artists'][0]['name']}
+
+    def artist_requests():
+        for n in itertools.count():
+            yield 'GET', '/artista', {'url': f"{ENTITY}Q{15862 + n % 20}"}
+
+    return {'playlist': playlist_requests(), 'playlist_api': playlist_api_requests(),
+            'insights': insights_requests(),
+            'resolve_track': resolve_requests(),
+            'track': track_requests(), 'artista': artist_requests()}
+
+
+def _reset_caches(app_module, snapshot_dir):
+    from services.cache import TieredCache
+    from services.page_cache import PageCache
+    from services.wiki_client import CACHE_TTLS
+
+    app_module.agent.cache = TieredCache(ttls=CACHE_TTLS)
+    app_module.page_cache = app_module.shared.page_cache = PageCache.from_env()
+    for name in os.listdir(snapshot_dir):
+        os.remove(os.path.join(snapshot_dir, name))
+
+
+def _per_request(before, after, count):
+    if not count:
+        return {}
+    delta = {k: after.get(k, 0) - before.get(k, 0) for k in after}
+    return {k: round(v / count, 2) for k, v in delta.items() if v}
+
+
+def run_client_phase(app_module, stub, route, requests_iter, iterations, cold, snapshot_dir):
+    client = app_module.app.test_client()
+    latencies, errors = [], 0
+    before = stub.stats()
+    for _ in range(iterations):
+        if cold:
+            _reset_caches(app_module, snapshot_dir)
+        method, path, params = next(requests_iter)
+        start = time.perf_counter()
+        if method == 'POST':
+            r = client.post(path, data=params)
+        else:
+            r = client.get(path, query_string=params)
+        r.get_data()
+        elapsed = time.perf_counter() - start
+        if r.status_code >= 400:
+            errors += 1
+        else:
+            latencies.append(elapsed)
+    summary = summarize(latencies, errors=errors)
+    summary['upstream_per_request'] = _per_request(before, stub.stats(), iterations)
+    return summary
+
+
+def run_load_phase(base_url, stub, requests_iter, concurrency, duration):
+    lock = threading.Lock()
+    latencies, errors = [], [0]
+    stop_at = time.monotonic() + duration
+
+    def next_request():
+        with lock:
+            return next(requests_iter)
+
+    def user():
+        session = requests.Session()
+        while time.monotonic() < stop_at:
+            method, path, params = next_request()
+            start = time.perf_counter()
+            try:
+                if method == 'POST':
+                    r = session.post(base_url + path, data=params, timeout=120)
+                else:
+                    r = session.get(base_url + path, params=params, timeout=120, allow_redirects=False)
+                ok = r.status_code < 400
+            except requests.RequestException:
+                ok = False
+            elapsed = time.perf_counter() - start
+            with lock:
+                if ok:
+                    latencies.append(elapsed)
+                else:
+                    errors[0] += 1
+
+    before = stub.stats()
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for _ in range(concurrency):
+            pool.submit(user)
+    elapsed = time.monotonic() - started
+    summary = summarize(latencies, elapsed=elapsed, errors=errors[0])
+    summary['upstream_per_request'] = _per_request(before, stub.stats(), len(latencies) + errors[0])
+    return summary
+
+
+def _serve(app):
+    from werkzeug.serving import WSGIRequestHandler, make_server
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    server = make_server('127.0.0.1', 0, app, threaded=True, request_handler=QuietHandler)
+    threading.Thread(target=server.serve_forever, daemon=True, name='bench-app').start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--routes', default=','.join(ROUTES), help="route da misurare, separate da virgola")
+    parser.add_argument('--iterations', type=int, default=30, help="richieste sequenziali per route (fase client)")
+    parser.add_argument('--concurrency', type=int, default=16, help="client concorrenti (0 = salta la fase load)")
+    parser.add_argument('--duration', type=float, default=5, help="secondi di carico per route")
+    parser.add_argument('--latency', type=float, default=0.05, help="latenza iniettata di Wikidata (s)")
+    parser.add_argument('--spotify-latency', type=float, default=None, help="latenza di Spotify (s), default come Wikidata")
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0, help="frazione di risposte 503 dagli upstream")
+    parser.add_argument('--playlist-size', type=int, default=300)
+    parser.add_argument('--cold', action='store_true', help="svuota le cache prima di ogni richiesta (fase client)")
+    parser.add_argument('--record', action='store_true', help="registra su fixtures le query Wikidata mancanti")
+    parser.add_argument('--save-baseline', metavar='NOME')
+    parser.add_argument('--compare', metavar='NOME')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    parser.add_argument('--json', action='store_true', help="stampa i risultati in JSON")
+    args = parser.parse_args()
+
+    routes = [r for r in args.routes.split(',') if r]
+    unknown = set(routes) - set(ROUTES)
+    if unknown:
+        parser.error(f"route sconosciute: {', '.join(sorted(unknown))}")
+
+    stub = StubUpstream(latency=args.latency, spotify_latency=args.spotify_latency, jitter=args.jitter,
+                        error_rate=args.error_rate, playlist_size=args.playlist_size, record=args.record)
+    stub_url = stub.start()
+    snapshot_dir = tempfile.mkdtemp(prefix='bench-snapshots-')
+    _configure_env(stub_url, snapshot_dir)
+    app_module = _load_app(stub_url)
+
+    results = {'config': {k: v for k, v in vars(args).items() if k not in ('save_baseline', 'compare', 'json')},
+               'routes': {}}
+    server = base_url = None
+    try:
+        if args.concurrency > 0:
+            server, base_url = _serve(app_module.app)
+        for route in routes:
+            sources = _requests(stub)
+            phases = results['routes'][route] = {}
+            phases['client'] = run_client_phase(app_module, stub, route, sources[route],
+                                                args.iterations, args.cold, snapshot_dir)
+            if base_url:
+                phases['load'] = run_load_phase(base_url, stub, sources[route], args.concurrency, args.duration)
+    finally:
+        if server is not None:
+            server.shutdown()
+        stub.stop()
+        shutil.rmtree(snapshot_dir, ignore_errors=True)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print_table(results)
+
+    if args.save_baseline:
+        print(f"Baseline salvata in {save_baseline(args.save_baseline, results)}")
+    if args.compare:
+        baseline = load_baseline(args.compare)
+        changed = sorted(k for k, v in results['config'].items()
+                         if k not in ('routes', 'tolerance', 'record') and baseline.get('config', {}).get(k) != v)
+        if changed:
+            print(f"⚠️ Configurazione diversa dalla baseline: {', '.join(changed)}")
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"❌ Regressioni rispetto a '{args.compare}':")
+            for line in regressions:
+                print(f"  - {line}")
+            sys.exit(1)
+        print(f"✅ Nessuna regressione rispetto a '{args.compare}'")
+
+
+if __name__ == '__main__':
+    main()
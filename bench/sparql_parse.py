@@ -0,0 +1,90 @@
+"""
+Micro-benchmark del parsing dei risultati SPARQL: JSON contro TSV e CSV.
+
+Genera la risposta di get_track_facts per `--songs` brani (righe sintetiche
+dello stub, 4-5 per brano), la serializza nei tre formati e misura per
+ciascuno tempo di parsing e picco di memoria (tracemalloc) fino alle righe
+pronte per WikiAgent. Il corpo arriva a blocchi come dal socket: il JSON va
+prima ricomposto per intero (come fa `Response.json()`), TSV e CSV vengono
+decodificati blocco per blocco (come `SparqlClient.query_rows`).
+
+    python -m bench.sparql_parse --songs 10000
+"""
+import argparse
+import codecs
+import json
+import time
+import tracemalloc
+
+from bench.stub_server import SERIALIZERS, _FACTS_VARS, _facts_rows
+from services.http_client import STREAM_CHUNK_SIZE
+from services.sparql_results import parse_stream, rows_from_json
+
+
+def build_body(fmt, songs):
+    data = {'head': {'vars': _FACTS_VARS},
+            'results': {'bindings': [row for n in range(1, songs + 1)
+                                     for row in _facts_rows(f"http://www.wikidata.org/entity/Q{n}")]}}
+    text = json.dumps(data) if fmt == 'json' else SERIALIZERS[fmt](data)
+    return text.encode('utf-8')
+
+
+def _chunks(body):
+    # Slice generate una alla volta: in memoria c'è un solo blocco per volta
+    for start in range(0, len(body), STREAM_CHUNK_SIZE):
+        yield body[start:start + STREAM_CHUNK_SIZE]
+
+
+def _decoded(chunks):
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    for chunk in chunks:
+        yield decoder.decode(chunk)
+    yield decoder.decode(b'', final=True)
+
+
+def parse(fmt, body):
+    if fmt == 'json':
+        return rows_from_json(json.loads(b''.join(_chunks(body))))
+    return parse_stream(fmt, _decoded(_chunks(body)))
+
+
+def measure(fmt, body, repeat):
+    """(miglior tempo in s, picco di memoria in byte, righe)."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = parse(fmt, body)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+        del result
+
+    # Il picco si misura a parte: tracemalloc rallenta le allocazioni
+    tracemalloc.start()
+    result = parse(fmt, body)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best, peak, len(result)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--songs', type=int, default=10000, help="brani nella risposta sintetica")
+    parser.add_argument('--repeat', type=int, default=5, help="ripetizioni per il tempo (vale la migliore)")
+    args = parser.parse_args()
+
+    header = f"{'formato':<9}{'corpo KB':>10}{'righe':>9}{'parse ms':>11}{'picco KB':>11}"
+    print(header)
+    print('-' * len(header))
+    reference = None
+    for fmt in ('json', 'tsv', 'csv'):
+        body = build_body(fmt, args.songs)
+        if reference is None:
+            reference = parse(fmt, body).rows
+        elif parse(fmt, body).rows != reference:
+            raise SystemExit(f"❌ Le righe {fmt} non coincidono con quelle JSON")
+        elapsed, peak, rows = measure(fmt, body, args.repeat)
+        print(f"{fmt:<9}{len(body) / 1024:>10.0f}{rows:>9}{elapsed * 1000:>11.1f}{peak / 1024:>11.0f}")
+
+
+if __name__ == '__main__':
+    main()
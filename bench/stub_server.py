@@ -0,0 +1,346 @@
+"""
+Stub locale di Spotify Web API e Wikidata Query Service per i benchmark.
+
+Rigioca le risposte registrate in bench/fixtures con latenza ed errori
+iniettati, e conta le chiamate ricevute per upstream e tipo di richiesta.
+Gira su un event loop in un thread separato, così non è lui a limitare il
+throughput misurato.
+
+Endpoint:
+    GET /sparql?query=...             Wikidata (per tipo di query o per hash esatto);
+                                      JSON, o TSV/CSV se richiesti con Accept senza `format`
+    GET /v1/me                        utente Spotify fittizio
+    GET /v1/playlists/<id>            snapshot_id della playlist registrata
+    GET /v1/playlists/<id>/tracks     pagine per offset/limit
+    GET /__stats                      contatori delle chiamate (JSON)
+
+Con `record=True` le query Wikidata senza risposta registrata vengono
+inoltrate all'endpoint reale e salvate in fixtures/wikidata.json (by_query).
+"""
+import asyncio
+import csv
+import hashlib
+import io
+import json
+import os
+import random
+import re
+import threading
+from urllib.parse import parse_qs, urlsplit
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+WIKIDATA_URL = "https://query.wikidata.org/sparql"
+WIKIDATA_USER_AGENT = 'MusicDataBot/1.0 (https://example.com; contact@example.com)'
+
+_BUNDLE_PART = re.compile(r'BIND\("(\w+)" AS \?part\)')
+_VALUES_ROW = re.compile(r'^\s*\((\d+) "', re.MULTILINE)
+_VALUES_SONG = re.compile(r'<(http://www\.wikidata\.org/entity/Q\d+)>')
+_GENRES = ('rock', 'pop', 'hard rock', 'soul', 'funk', 'disco', 'grunge', 'synth-pop')
+_FACTS_VARS = ['song', 'prop', 'value', 'label']
+SPARQL_TYPES = {'tsv': 'text/tab-separated-values', 'csv': 'text/csv'}
+
+
+def query_kind(query):
+    """Riconosce il tipo di query SPARQL generata da WikiAgent."""
+    if '?part' in query:
+        return 'track_bundle'
+    if 'VALUES (?idx' in query:
+        return 'track_urls_chunk'
+    if 'VALUES ?song' in query:
+        return 'track_facts_chunk'
+    if 'wikibase:mwapi' in query:
+        return 'track_url'
+    if 'Fan Choice' in query:
+        return 'recommendations'
+    if '?dataNascita' in query:
+        return 'artist_details'
+    if '"title" AS ?prop' in query:
+        return 'track_details'
+    return 'other'
+
+
+def query_hash(query):
+    return hashlib.sha1(' '.join(query.split()).encode('utf-8')).hexdigest()
+
+
+def _facts_rows(song_url):
+    """Righe sintetiche (ma stabili) di get_track_facts: anno, generi e interprete dipendono dal QID."""
+    n = int(song_url.rsplit('Q', 1)[-1])
+    song = {'type': 'uri', 'value': song_url}
+
+    def row(prop, value, label=None):
+        binding = {'song': song, 'prop': {'type': 'literal', 'value': prop}, 'value': value}
+        if label is not None:
+            binding['label'] = {'type': 'literal', 'xml:lang': 'it', 'value': label}
+        return binding
+
+    rows = [row('P577', {'type': 'literal', 'datatype': 'http://www.w3.org/2001/XMLSchema#dateTime',
+                         'value': f"{1960 + n % 60}-01-01T00:00:00Z"})]
+    for q, genre in enumerate(dict.fromkeys((_GENRES[n % 8], _GENRES[n // 8 % 8]))):
+        rows.append(row('P136', {'type': 'uri', 'value': f"http://www.wikidata.org/entity/Q{11399 + q}"}, genre))
+    rows.append(row('P175', {'type': 'uri', 'value': f"http://www.wikidata.org/entity/Q{15862 + n % 20}"},
+                    f"Artista {n % 20}"))
+    return rows
+
+
+def sparql_format(params, accept):
+    """'tsv' o 'csv' se il client li chiede con Accept (il parametro `format` ha la precedenza), altrimenti 'json'."""
+    if 'format' not in params:
+        for fmt, content_type in SPARQL_TYPES.items():
+            if content_type in accept:
+                return fmt
+    return 'json'
+
+
+def _tsv_term(term):
+    if term is None:
+        return ''
+    value = term['value']
+    if term['type'] == 'uri':
+        return f"<{value}>"
+    if term['type'] == 'bnode':
+        return f"_:{value}"
+    escaped = (value.replace('\\', '\\\\').replace('"', '\\"')
+               .replace('\n', '\\n').replace('\r', '\\r').replace('\t', '\\t'))
+    if 'xml:lang' in term:
+        return f'"{escaped}"@{term["xml:lang"]}'
+    if 'datatype' in term:
+        return f'"{escaped}"^^<{term["datatype"]}>'
+    return f'"{escaped}"'
+
+
+def to_tsv(data):
+    """Serializza una risposta SPARQL JSON come text/tab-separated-values (termini in sintassi N-Triples)."""
+    names = data['head'].get('vars', [])
+    lines = ['\t'.join(f"?{name}" for name in names)]
+    for binding in data['results']['bindings']:
+        lines.append('\t'.join(_tsv_term(binding.get(name)) for name in names))
+    return '\n'.join(lines) + '\n'
+
+
+def to_csv(data):
+    """Serializza una risposta SPARQL JSON come text/csv (solo valori lessicali)."""
+    names = data['head'].get('vars', [])
+    out = io.StringIO()
+    writer = csv.writer(out, lineterminator='\r\n')
+    writer.writerow(names)
+    for binding in data['results']['bindings']:
+        writer.writerow([binding[name]['value'] if name in binding else '' for name in names])
+    return out.getvalue()
+
+
+SERIALIZERS = {'tsv': to_tsv, 'csv': to_csv}
+
+
+class StubUpstream:
+    def __init__(self, latency=0.0, spotify_latency=None, jitter=0.0, error_rate=0.0,
+                 playlist_size=None, record=False, seed=1):
+        self.latency = latency
+        self.spotify_latency = latency if spotify_latency is None else spotify_latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.record = record
+        self.random = random.Random(seed)
+        self.wikidata = self._load('wikidata.json')
+        self.playlist = self._load('spotify_playlist.json')
+        self.items = self._playlist_items(playlist_size)
+        self.calls = {}
+        self._lock = threading.Lock()
+        self.loop = None
+        self.port = None
+        self._server = None
+        self._writers = set()
+
+    # --- Avvio --------------------------------------------------------------
+
+    def start(self, port=0):
+        """Avvia lo stub in un thread; restituisce l'URL base (http://127.0.0.1:<porta>)."""
+        ready = threading.Event()
+        self.loop = asyncio.new_event_loop()
+
+        def run():
+            asyncio.set_event_loop(self.loop)
+            self._server = self.loop.run_until_complete(
+                asyncio.start_server(self._handle, '127.0.0.1', port, backlog=4096))
+            self.port = self._server.sockets[0].getsockname()[1]
+            ready.set()
+            self.loop.run_forever()
+
+        threading.Thread(target=run, daemon=True, name='bench-stub').start()
+        ready.wait()
+        return self.url
+
+    def stop(self):
+        if self.loop is not None:
+            asyncio.run_coroutine_threadsafe(self._shutdown(), self.loop).result(timeout=10)
+            self.loop.call_soon_threadsafe(self.loop.stop)
+
+    async def _shutdown(self):
+        # Chiude le connessioni aperte prima di fermare il loop (niente task orfani all'uscita)
+        self._server.close()
+        for writer in list(self._writers):
+            writer.transport.abort()
+        while self._writers:
+            await asyncio.sleep(0.01)
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.port}"
+
+    # --- Contatori ----------------------------------------------------------
+
+    def stats(self):
+        with self._lock:
+            return dict(self.calls)
+
+    def reset(self):
+        with self._lock:
+            self.calls.clear()
+
+    def _count(self, name):
+        with self._lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+
+    # --- HTTP ---------------------------------------------------------------
+
+    async def _handle(self, reader, writer):
+        self._writers.add(writer)
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                method, target = head.split(b" ", 2)[:2]
+                accept = re.search(rb'(?im)^accept:\s*(.*?)\r$', head)
+                status, payload, headers = await self._route(method.decode(), target.decode(),
+                                                              accept.group(1).decode() if accept else '')
+                # I risultati TSV/CSV arrivano già serializzati, con il loro Content-Type
+                content_type = headers.pop('Content-Type', 'application/json')
+                body = (payload if isinstance(payload, str) else json.dumps(payload)).encode('utf-8')
+                lines = [f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}",
+                         f"Content-Type: {content_type}",
+                         f"Content-Length: {len(body)}"]
+                lines += [f"{k}: {v}" for k, v in headers.items()]
+                writer.write(("\r\n".join(lines) + "\r\n\r\n").encode('ascii') + body)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+    async def _route(self, method, target, accept=''):
+        parts = urlsplit(target)
+        params = {k: v[0] for k, v in parse_qs(parts.query).items()}
+        path = parts.path.rstrip('/')
+
+        if path == '/__stats':
+            return 200, self.stats(), {}
+
+        upstream = 'wikidata' if path == '/sparql' else 'spotify'
+        await asyncio.sleep(self._delay(upstream))
+        if self.error_rate and self.random.random() < self.error_rate:
+            self._count(f'{upstream}:error')
+            return 503, {'error': 'stub injected error'}, {'Retry-After': '0'}
+
+        if upstream == 'wikidata':
+            query = params.get('query', '')
+            kind = query_kind(query)
+            self._count(f'wikidata:{kind}')
+            data = await self._sparql(query, kind)
+            fmt = sparql_format(params, accept)
+            if fmt != 'json':
+                return 200, SERIALIZERS[fmt](data), {'Content-Type': f"{SPARQL_TYPES[fmt]}; charset=utf-8"}
+            return 200, data, {}
+        return self._spotify(path, params)
+
+    def _delay(self, upstream):
+        base = self.latency if upstream == 'wikidata' else self.spotify_latency
+        return max(0.0, base + self.random.uniform(-self.jitter, self.jitter))
+
+    # --- Wikidata -----------------------------------------------------------
+
+    async def _sparql(self, query, kind):
+        recorded = self.wikidata['by_query'].get(query_hash(query))
+        if recorded is not None:
+            return recorded
+        if self.record:
+            return await self._record(query)
+
+        by_kind = self.wikidata['by_kind']
+        if kind == 'track_urls_chunk':
+            # Una riga per ogni coppia della VALUES, con lo stesso esito registrato
+            template = by_kind[kind]['results']['bindings'][0]
+            rows = [dict(template, idx=dict(template['idx'], value=n)) for n in _VALUES_ROW.findall(query)]
+            return {'head': by_kind[kind]['head'], 'results': {'bindings': rows}}
+        if kind == 'track_facts_chunk':
+            rows = [row for url in dict.fromkeys(_VALUES_SONG.findall(query)) for row in _facts_rows(url)]
+            return {'head': {'vars': _FACTS_VARS}, 'results': {'bindings': rows}}
+        if kind == 'track_bundle':
+            sources = {'track': 'track_details', 'artist': 'artist_details', 'recommendations': 'recommendations'}
+            names, rows = ['part'], []
+            for part in _BUNDLE_PART.findall(query):
+                names += by_kind[sources[part]]['head']['vars']
+                for row in by_kind[sources[part]]['results']['bindings']:
+                    rows.append(dict(row, part={'type': 'literal', 'value': part}))
+            # SELECT *: le variabili di tutti i blocchi, serve a TSV e CSV
+            return {'head': {'vars': list(dict.fromkeys(names))}, 'results': {'bindings': rows}}
+        return by_kind.get(kind, {'head': {'vars': []}, 'results': {'bindings': []}})
+
+    async def _record(self, query):
+        import httpx
+        async with httpx.AsyncClient(timeout=60) as client:
+            r = await client.get(WIKIDATA_URL, params={'query': query, 'format': 'json'},
+                                 headers={'User-Agent': WIKIDATA_USER_AGENT,
+                                          'Accept': 'application/sparql-results+json'})
+            r.raise_for_status()
+            data = r.json()
+        with self._lock:
+            self.wikidata['by_query'][query_hash(query)] = data
+            with open(os.path.join(FIXTURES_DIR, 'wikidata.json'), 'w', encoding='utf-8') as f:
+                json.dump(self.wikidata, f, indent=1, ensure_ascii=False)
+        return data
+
+    # --- Spotify ------------------------------------------------------------
+
+    def _spotify(self, path, params):
+        if path == '/v1/me':
+            self._count('spotify:me')
+            return 200, {'display_name': 'bench', 'id': 'bench'}, {}
+
+        match = re.fullmatch(r'/v1/playlists/([^/]+)(/tracks)?', path)
+        if not match:
+            self._count('spotify:other')
+            return 404, {'error': {'status': 404, 'message': 'Not found'}}, {}
+
+        if match.group(2) is None:
+            self._count('spotify:snapshot')
+            return 200, {'snapshot_id': self.playlist['snapshot_id'], 'name': self.playlist['name']}, {}
+
+        self._count('spotify:page')
+        offset = int(params.get('offset', 0))
+        limit = int(params.get('limit', 100))
+        total = len(self.items)
+        next_url = None
+        if offset + limit < total:
+            next_url = f"{self.url}{path}?offset={offset + limit}&limit={limit}"
+        return 200, {'total': total, 'limit': limit, 'offset': offset, 'next': next_url,
+                     'items': self.items[offset:offset + limit]}, {}
+
+    def _playlist_items(self, size):
+        """Gli item registrati ripetuti fino a `size`, con id distinti a ogni giro."""
+        recorded = self.playlist['items']
+        if not size:
+            return recorded
+        items = []
+        for n in range(size):
+            item = json.loads(json.dumps(recorded[n % len(recorded)]))
+            track = item['track']
+            if n >= len(recorded) and track.get('id'):
+                track['id'] = f"{track['id'][:16]}{n:06d}"
+                track['name'] = f"{track['name']} #{n // len(recorded)}"
+            items.append(item)
+        return items
+
+    @staticmethod
+    def _load(name):
+        with open(os.path.join(FIXTURES_DIR, name), encoding='utf-8') as f:
+            return json.load(f)
@@ -0,0 +1,334 @@
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from services import models
+
+# Pool condiviso dai refresh stale-while-revalidate di tutte le cache: con molte
+# chiavi scadute insieme i ricalcoli si mettono in coda invece di aprire un thread ciascuno
+REFRESH_POOL = ThreadPoolExecutor(max_workers=int(os.environ.get('CACHE_REFRESH_WORKERS', 4)),
+                                  thread_name_prefix='cache-refresh')
+
+
+class InMemoryRedis:
+    """
+    Backend finto compatibile con il sottoinsieme di API Redis che usiamo
+    (get / set con ex, px, nx / delete). Utile in locale e nei test senza un server Redis.
+    """
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at is not None and expires_at <= time.time():
+                del self._data[key]
+                return None
+            return value
+
+    def set(self, key, value, ex=None, px=None, nx=False):
+        with self._lock:
+            if nx:
+                current = self._data.get(key)
+                if current is not None and (current[1] is None or current[1] > time.time()):
+                    return None
+            if px:
+                ex = px / 1000.0
+            expires_at = time.time() + ex if ex else None
+            self._data[key] = (value, expires_at)
+        return True
+
+    def delete(self, *keys):
+        with self._lock:
+            return sum(1 for k in keys if self._data.pop(k, None) is not None)
+
+
+class CacheEntry:
+    __slots__ = ('value', 'expires_at', 'stale_until')
+
+    def __init__(self, value, expires_at, stale_until):
+        self.value = value
+        self.expires_at = expires_at
+        self.stale_until = stale_until
+
+    def to_json(self):
+        return json.dumps({'v': self.value, 'exp': self.expires_at, 'stale': self.stale_until},
+                          default=models.encode, separators=(',', ':'))
+
+    @classmethod
+    def from_json(cls, raw):
+        if isinstance(raw, bytes):
+            raw = raw.decode('utf-8')
+        data = json.loads(raw, object_hook=models.decode)
+        return cls(data['v'], data['exp'], data['stale'])
+
+
+class TieredCache:
+    """
+    Cache a due livelli per le risposte SPARQL:
+      1. LRU in-process (limitata a `max_entries`)
+      2. Redis condiviso tra i worker (opzionale)
+
+    Ogni voce ha un TTL "fresco" e una finestra di stale-while-revalidate:
+    scaduto il TTL la voce viene comunque servita subito, mentre il pool
+    REFRESH_POOL ricalcola il valore in background.
+    """
+
+    def __init__(self, redis_client=None, max_entries=1024, ttls=None,
+                 stale_ttl=3600, default_ttl=3600, prefix="wiki"):
+        self.redis = redis_client
+        self.max_entries = max_entries
+        self.ttls = dict(ttls or {})
+        self.stale_ttl = stale_ttl
+        self.default_ttl = default_ttl
+        self.prefix = prefix
+
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+        self._refreshing = set()
+        # Riferimenti ai task di refresh: il loop tiene solo riferimenti deboli
+        self._tasks = set()
+        self._stats = {
+            'hits': 0,
+            'misses': 0,
+            'stale_hits': 0,
+            'evictions': 0,
+            'refreshes': 0,
+            'redis_hits': 0,
+            'redis_errors': 0,
+            'negative_stores': 0,
+        }
+
+    @classmethod
+    def from_env(cls, ttls=None):
+        """Costruisce la cache leggendo REDIS_URL e WIKI_CACHE_SIZE dall'ambiente."""
+        redis_client = None
+        redis_url = os.environ.get('REDIS_URL')
+        if redis_url:
+            try:
+                import redis
+                redis_client = redis.Redis.from_url(redis_url, socket_timeout=0.5,
+                                                    socket_connect_timeout=0.5)
+            except Exception as e:
+                print(f"⚠️ Redis non disponibile, uso solo la cache locale: {e}")
+        max_entries = int(os.environ.get('WIKI_CACHE_SIZE', 1024))
+        return cls(redis_client=redis_client, max_entries=max_entries, ttls=ttls)
+
+    # --- Chiavi -------------------------------------------------------------
+
+    def make_key(self, method, *parts):
+        """
+        Chiave normalizzata: prefisso, versione dei modelli, metodo e hash degli
+        argomenti (minuscoli, senza spazi extra). Gli argomenti non vengono uniti
+        con ':' perché un titolo che contiene ':' produrrebbe la chiave di un'altra coppia.
+        """
+        norm = [' '.join(str(p).split()).lower() if p is not None else None for p in parts]
+        digest = hashlib.sha1(json.dumps(norm, ensure_ascii=False).encode('utf-8')).hexdigest()
+        return f"{self.prefix}:v{models.SCHEMA_VERSION}:{method}:{digest}"
+
+    # --- API principale -----------------------------------------------------
+
+    def get_or_load(self, method, key, loader, cache_if=None, negative_ttl=None):
+        """
+        Restituisce il valore in cache per `key`, altrimenti chiama `loader()`.
+        `cache_if(value)` permette di non salvare risultati non validi (es. errori).
+        Con `negative_ttl` i valori scartati da `cache_if` (es. "non trovato")
+        vengono salvati comunque, ma con quel TTL più breve. Se `loader()`
+        solleva un'eccezione non si salva nulla.
+        """
+        now = time.time()
+        entry = self._get_entry(key)
+
+        if entry is not None:
+            if now < entry.expires_at:
+                self._incr('hits')
+                return entry.value
+            if now < entry.stale_until:
+                self._incr('stale_hits')
+                self._refresh_in_background(method, key, loader, cache_if, negative_ttl)
+                return entry.value
+
+        self._incr('misses')
+        value = loader()
+        self._store(method, key, value, cache_if, negative_ttl)
+        return value
+
+    async def aget_or_load(self, method, key, aloader, cache_if=None, negative_ttl=None):
+        """
+        Come get_or_load, ma con un loader asincrono (modalità ASGI). Il client
+        Redis è sincrono: le sue chiamate girano in un thread, non sull'event loop.
+        """
+        now = time.time()
+        entry = await self._aget_entry(key)
+
+        if entry is not None:
+            if now < entry.expires_at:
+                self._incr('hits')
+                return entry.value
+            if now < entry.stale_until:
+                self._incr('stale_hits')
+                self._refresh_in_task(method, key, aloader, cache_if, negative_ttl)
+                return entry.value
+
+        self._incr('misses')
+        value = await aloader()
+        await self._off_loop(self._store, method, key, value, cache_if, negative_ttl)
+        return value
+
+    async def aget(self, key):
+        entry = await self._aget_entry(key)
+        if entry is not None and time.time() < entry.stale_until:
+            return entry.value
+        return None
+
+    async def aset(self, method, key, value, ttl=None):
+        await self._off_loop(self.set, method, key, value, ttl)
+
+    def get(self, key):
+        entry = self._get_entry(key)
+        if entry is not None and time.time() < entry.stale_until:
+            return entry.value
+        return None
+
+    def set(self, method, key, value, ttl=None):
+        if ttl is None:
+            ttl = self.ttls.get(method, self.default_ttl)
+        now = time.time()
+        entry = CacheEntry(value, now + ttl, now + ttl + self.stale_ttl)
+        self._lru_put(key, entry)
+        if self.redis is not None:
+            try:
+                self.redis.set(key, entry.to_json(), ex=int(ttl + self.stale_ttl))
+            except Exception:
+                self._incr('redis_errors')
+
+    def delete(self, key):
+        with self._lock:
+            self._lru.pop(key, None)
+        if self.redis is not None:
+            try:
+                self.redis.delete(key)
+            except Exception:
+                self._incr('redis_errors')
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['size'] = len(self._lru)
+        return stats
+
+    # --- Interni ------------------------------------------------------------
+
+    def _incr(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def _store(self, method, key, value, cache_if, negative_ttl):
+        if cache_if is None or cache_if(value):
+            self.set(method, key, value)
+        elif negative_ttl:
+            self.set(method, key, value, ttl=negative_ttl)
+            self._incr('negative_stores')
+
+    def _get_entry(self, key):
+        entry = self._lru_get(key)
+        if entry is not None or self.redis is None:
+            return entry
+        return self._redis_get(key)
+
+    async def _aget_entry(self, key):
+        entry = self._lru_get(key)
+        if entry is not None or self.redis is None:
+            return entry
+        return await asyncio.to_thread(self._redis_get, key)
+
+    async def _off_loop(self, fn, *args):
+        # Senza Redis è tutto in memoria: niente salto di thread
+        if self.redis is None:
+            return fn(*args)
+        return await asyncio.to_thread(fn, *args)
+
+    def _lru_get(self, key):
+        with self._lock:
+            entry = self._lru.get(key)
+            if entry is not None:
+                self._lru.move_to_end(key)
+            return entry
+
+    def _redis_get(self, key):
+        try:
+            raw = self.redis.get(key)
+        except Exception:
+            self._incr('redis_errors')
+            return None
+        if raw is None:
+            return None
+        try:
+            entry = CacheEntry.from_json(raw)
+        except (ValueError, KeyError, TypeError):
+            # Voce illeggibile (troncata, scritta da un'altra versione): come un miss
+            self._incr('redis_errors')
+            return None
+
+        self._incr('redis_hits')
+        # Promuove la voce nel livello locale
+        self._lru_put(key, entry)
+        return entry
+
+    def _lru_put(self, key, entry):
+        with self._lock:
+            self._lru[key] = entry
+            self._lru.move_to_end(key)
+            while len(self._lru) > self.max_entries:
+                self._lru.popitem(last=False)
+                self._stats['evictions'] += 1
+
+    def _refresh_in_background(self, method, key, loader, cache_if, negative_ttl=None):
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def worker():
+            try:
+                value = loader()
+                self._store(method, key, value, cache_if, negative_ttl)
+                self._incr('refreshes')
+            except Exception as e:
+                print(f"⚠️ Refresh cache fallito per {key}: {e}")
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        REFRESH_POOL.submit(worker)
+
+    def _refresh_in_task(self, method, key, aloader, cache_if, negative_ttl=None):
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        async def worker():
+            try:
+                value = await aloader()
+                await self._off_loop(self._store, method, key, value, cache_if, negative_ttl)
+                self._incr('refreshes')
+            except Exception as e:
+                print(f"⚠️ Refresh cache fallito per {key}: {e}")
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        task = asyncio.get_running_loop().create_task(worker())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
@@ -0,0 +1,123 @@
+"""
+Circuit breaker per le query a Wikidata, uno per tipo di query.
+
+Quando il Query Service è lento o irraggiungibile ogni chiamata aspettava
+timeout e retry prima di fallire, tenendo occupati i thread delle route.
+Dopo `failure_threshold` errori consecutivi il circuito si apre: per
+`reset_timeout` secondi le chiamate falliscono subito (CircuitOpenError) e
+i chiamanti usano il loro valore di ripiego. Poi una sola chiamata di prova
+(half-open) decide se richiudere il circuito o riaprirlo.
+
+Un circuito per tipo di query: le ricerche mwapi e i blocchi batch vanno in
+timeout ben prima dei lookup diretti sulle entità, e non devono bloccarli.
+Contano come errori solo i segnali di indisponibilità (rete, timeout, 429,
+5xx); una query errata (4xx) o la scadenza della richiesta no.
+
+Configurazione: WIKIDATA_BREAKER_FAILURES (0 = disattivato), WIKIDATA_BREAKER_RESET.
+"""
+import os
+import threading
+import time
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+# Valori numerici dello stato per /metrics
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitOpenError(Exception):
+    """Il circuito è aperto: la chiamata non è stata eseguita."""
+
+
+class CircuitBreaker:
+    def __init__(self, name, failure_threshold=5, reset_timeout=30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+        self._stats = {'successes': 0, 'failures': 0, 'rejected': 0, 'opened': 0}
+
+    def allow(self):
+        """True se la chiamata può partire; in half-open passa una sola chiamata di prova."""
+        if self.failure_threshold <= 0:
+            return True
+        with self._lock:
+            if self.state == OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self.state = HALF_OPEN
+            if self.state == CLOSED:
+                return True
+            if self.state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            self._stats['rejected'] += 1
+            return False
+
+    def guard(self):
+        """Come allow, ma solleva CircuitOpenError."""
+        if not self.allow():
+            raise CircuitOpenError(f"circuito '{self.name}' aperto: Wikidata non disponibile")
+
+    def record_success(self):
+        with self._lock:
+            self._stats['successes'] += 1
+            self._failures = 0
+            self._probing = False
+            if self.state != CLOSED:
+                print(f"✅ Circuito '{self.name}' richiuso")
+            self.state = CLOSED
+
+    def record_failure(self):
+        with self._lock:
+            self._stats['failures'] += 1
+            self._failures += 1
+            self._probing = False
+            if self.state == HALF_OPEN or (self.state == CLOSED and self._failures >= self.failure_threshold):
+                if self.state == CLOSED:
+                    print(f"🔌 Circuito '{self.name}' aperto dopo {self._failures} errori: "
+                          f"chiamate sospese per {self.reset_timeout:g}s")
+                self.state = OPEN
+                self._opened_at = time.monotonic()
+                self._stats['opened'] += 1
+
+    def release(self):
+        """La chiamata è finita senza dire nulla sulla salute dell'endpoint (es. query errata, scadenza)."""
+        with self._lock:
+            self._probing = False
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['state'] = _STATE_VALUES[self.state]
+        return stats
+
+
+class CircuitBreakers:
+    """Registro dei circuiti, creati al primo uso per nome."""
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        return cls(failure_threshold=int(os.environ.get('WIKIDATA_BREAKER_FAILURES', 5)),
+                   reset_timeout=float(os.environ.get('WIKIDATA_BREAKER_RESET', 30)))
+
+    def get(self, name):
+        with self._lock:
+            breaker = self._breakers.get(name)
+            if breaker is None:
+                breaker = self._breakers[name] = CircuitBreaker(name, self.failure_threshold, self.reset_timeout)
+            return breaker
+
+    def stats(self):
+        with self._lock:
+            breakers = list(self._breakers.values())
+        return {b.name: b.stats() for b in breakers}
@@ -0,0 +1,70 @@
+"""
+Scadenza (deadline) delle chiamate a monte per la richiesta in corso.
+
+La route fissa un budget di tempo all'inizio della richiesta; la scadenza
+vive in una ContextVar, quindi segue la richiesta nei thread dell'executor
+(copy_context) e nei task asyncio. I client HTTP la usano per:
+  - limitare connect/read timeout al tempo rimasto
+  - non riprovare (né attendere il rate limiter) oltre la scadenza
+Senza scadenza impostata (prewarm, refresh in background) valgono solo i
+timeout del client.
+"""
+import contextvars
+import time
+from contextlib import contextmanager
+
+_deadline = contextvars.ContextVar('upstream_deadline', default=None)
+
+
+class DeadlineExceeded(TimeoutError):
+    """Il budget di tempo della richiesta è finito: la chiamata a monte non parte (o viene interrotta)."""
+
+
+def start(seconds):
+    """Imposta la scadenza della richiesta a `seconds` da ora (None o <= 0: nessuna scadenza)."""
+    _deadline.set(time.monotonic() + seconds if seconds and seconds > 0 else None)
+
+
+def clear():
+    # I thread del server WSGI vengono riusati: la scadenza non deve passare alla richiesta dopo
+    _deadline.set(None)
+
+
+@contextmanager
+def budget(seconds):
+    """Scadenza per un blocco di codice; dentro una scadenza più stretta vale quella (0 = invariata)."""
+    if not seconds or seconds <= 0:
+        yield
+        return
+    current = _deadline.get()
+    deadline = time.monotonic() + seconds
+    token = _deadline.set(deadline if current is None else min(current, deadline))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining():
+    """Secondi rimasti (anche negativi), None senza scadenza."""
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def check(what='chiamata a monte'):
+    """Secondi rimasti (None senza scadenza); DeadlineExceeded se il budget è finito."""
+    left = remaining()
+    if left is not None and left <= 0:
+        raise DeadlineExceeded(f"scadenza della richiesta superata prima di: {what}")
+    return left
+
+
+def fits(delay):
+    """True se un'attesa di `delay` secondi termina prima della scadenza."""
+    left = remaining()
+    return left is None or delay < left
+
+
+def expired():
+    left = remaining()
+    return left is not None and left <= 0
@@ -0,0 +1,240 @@
+"""
+Dataset dimostrativo per la modalità offline (OFFLINE_MODE=1).
+
+Un file JSON con una playlist, i brani, gli artisti ed eventualmente i
+consigliati, caricato una volta all'avvio in indici in memoria. Espone gli
+stessi metodi di LocalBackend (per WikiAgent) e la playlist per
+SpotifyHandler, così demo e test di carico girano senza rete.
+
+Formato:
+    {"playlist": [{"title", "artist", "album", "cover", "song"}],
+     "songs":    {id: {"title", "performers": [qid], "date", "genres": [...],
+                       "producers": [...], "awards": [...], "image"}},
+     "artists":  {qid: {"name", "description", "birth", "death", "origin",
+                        "genres": [...], "image"}},
+     "recommendations": {id brano: [... come get_recommendations ...]}}   (facoltativo)
+
+I consigliati mancanti vengono calcolati con RecommendationIndex sugli stessi
+dati (stesso interprete / stesso genere). Il file incluso è un campione scritto
+a mano: gli artisti hanno il loro QID, i brani un identificativo locale. Solo i
+QID diventano URL di Wikidata; gli identificativi locali diventano `demo:<id>`,
+così le pagine offline non linkano entità inesistenti.
+Per rigenerarlo con i dati e gli identificativi reali di Wikidata:
+    python -m services.fixtures build --out data/demo_fixtures.json
+"""
+import argparse
+import json
+import os
+import re
+
+from services.local_store import ENTITY_PREFIX, qid_of
+from services.matcher import TrackMatcher
+from services.models import ArtistRef, Recommendation, Track, TrackDetails
+from services.recommender import RecommendationIndex
+
+DEFAULT_FIXTURES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                'data', 'demo_fixtures.json')
+LOCAL_PREFIX = "demo:"
+_QID = re.compile(r'^Q\d+$')
+
+
+def entity_url(entity_id):
+    """URL di Wikidata per i QID, 'demo:<id>' per gli identificativi locali del campione."""
+    return (ENTITY_PREFIX if _QID.match(entity_id) else LOCAL_PREFIX) + entity_id
+
+
+def id_of(url):
+    """Inverso di entity_url (accetta anche QID nudi)."""
+    url = (url or '').strip('<>')
+    return url[len(LOCAL_PREFIX):] if url.startswith(LOCAL_PREFIX) else qid_of(url)
+
+
+def _year(date):
+    try:
+        return int((date or '')[:4])
+    except ValueError:
+        return None
+
+
+class FixtureStore:
+    def __init__(self, data):
+        self.songs = data.get('songs', {})
+        self.artists = data.get('artists', {})
+        self.explicit_recs = {qid: [Recommendation.from_dict(r) for r in recs]
+                              for qid, recs in data.get('recommendations', {}).items()}
+        self.playlist = []
+
+        self.matcher = TrackMatcher()
+        self.recs_index = RecommendationIndex(entity_url=entity_url)
+        for qid, artist in self.artists.items():
+            self.matcher.add_artist_name(qid, artist.get('name'))
+            self.recs_index.artist_labels[qid] = artist.get('name')
+        for qid, song in self.songs.items():
+            performers = song.get('performers', [])
+            self.matcher.add_title(qid, song.get('title'))
+            self.matcher.performers[qid] = list(performers)
+            self.recs_index.upsert(qid, song.get('title'), song.get('image'), _year(song.get('date')),
+                                   performers, song.get('genres', []))
+
+        # I brani della playlist puntano già alle entità: la pagina linka /track direttamente
+        for entry in data.get('playlist', []):
+            track = Track.from_dict(entry)
+            self.playlist.append(track)
+            qid = entry.get('song')
+            song = self.songs.get(qid) if qid else None
+            if song is None:
+                continue
+            track.wikidata_id = entity_url(qid)
+            track.wikidata_artist_id = entity_url(song['performers'][0]) if song.get('performers') else None
+            track.resolved = True
+
+    @classmethod
+    def load(cls, path=DEFAULT_FIXTURES):
+        with open(path, encoding='utf-8') as f:
+            store = cls(json.load(f))
+        print(f"📦 Dataset offline caricato: {len(store.songs)} brani, {len(store.artists)} artisti")
+        return store
+
+    @classmethod
+    def from_env(cls):
+        """Il dataset se OFFLINE_MODE=1 (percorso in DEMO_FIXTURES), altrimenti None."""
+        if os.environ.get('OFFLINE_MODE') != '1':
+            return None
+        return cls.load(os.environ.get('DEMO_FIXTURES', DEFAULT_FIXTURES))
+
+    # --- Playlist (SpotifyHandler) ------------------------------------------
+
+    def playlist_tracks(self):
+        return [t.copy() for t in self.playlist]
+
+    # --- Stessi metodi di LocalBackend (WikiAgent) --------------------------
+
+    def get_track_url(self, title, artist):
+        match = self.matcher.match(title, artist)
+        if match is None or match[2] < self.matcher.threshold:
+            return None
+        return entity_url(match[0]), entity_url(match[1])
+
+    def get_track_details(self, song_url):
+        song = self.songs.get(id_of(song_url))
+        if song is None:
+            return None
+        artisti = [ArtistRef(self.artists.get(q, {}).get('name') or entity_url(q), entity_url(q))
+                   for q in song.get('performers', [])]
+        return TrackDetails(
+            found=True,
+            wikidata_url=entity_url(id_of(song_url)),
+            title=song.get('title') or 'Titolo Sconosciuto',
+            image=song.get('image'),
+            date=song.get('date') or 'N/D',
+            genres=', '.join(song.get('genres', [])) or 'N/D',
+            producers=', '.join(song.get('producers', [])) or 'N/D',
+            awards=', '.join(song.get('awards', [])) or 'Nessuno',
+            artisti_list=artisti or [ArtistRef('Artista Sconosciuto', '')]
+        )
+
+    def get_track_facts(self, song_url):
+        song = self.songs.get(id_of(song_url))
+        if song is None:
+            return None
+        return {
+            'date': song.get('date'),
+            'genres': list(song.get('genres', [])),
+            'performers': [[self.artists.get(q, {}).get('name') or entity_url(q), entity_url(q)]
+                           for q in song.get('performers', [])],
+        }
+
+    def get_artist_details(self, artist_url):
+        artist = self.artists.get(id_of(artist_url))
+        if artist is None:
+            return None
+        return {
+            'found': True,
+            'name': artist.get('name') or 'Sconosciuto',
+            'image': artist.get('image'),
+            'description': artist.get('description') or 'Nessuna biografia disponibile su Wikidata.',
+            'birth': artist.get('birth'),
+            'death': artist.get('death'),
+            'origin': artist.get('origin') or 'Non specificato',
+            'genres': ', '.join(artist.get('genres', [])) or 'Non specificato',
+            'url': artist_url
+        }
+
+    def get_recommendations(self, song_url, artist_url):
+        explicit = self.explicit_recs.get(id_of(song_url))
+        if explicit is not None:
+            return [r.copy() for r in explicit]
+        return self.recs_index.recommend(id_of(song_url), id_of(artist_url), artist_url)
+
+
+# --- Rigenerazione da Wikidata ----------------------------------------------
+
+def build(source, out):
+    """Risolve su Wikidata i brani della playlist di `source` e salva dettagli, artisti e consigliati."""
+    from services.wiki_client import WikiAgent
+
+    with open(source, encoding='utf-8') as f:
+        playlist = json.load(f).get('playlist', [])
+    agent = WikiAgent(local=None, remote_fallback=True)
+    data = {'playlist': [], 'songs': {}, 'artists': {}, 'recommendations': {}}
+
+    for track in playlist:
+        entry = {k: track.get(k, '') for k in ('title', 'artist', 'album', 'cover')}
+        data['playlist'].append(entry)
+        song_url, artist_url = agent.get_track_url(track['title'], track['artist'])
+        if not song_url:
+            print(f"⚠️ {track['title']} - {track['artist']}: non trovato su Wikidata")
+            continue
+
+        bundle = agent.get_track_bundle(song_url, artist_url)
+        details = bundle['track']
+        if not details.found:
+            continue
+        song_qid = qid_of(song_url)
+        entry['song'] = song_qid
+        performers = [qid_of(a.url) for a in details.artisti_list if a.url]
+        data['songs'][song_qid] = {
+            'title': details.title,
+            'performers': performers,
+            'date': None if details.date == 'N/D' else details.date,
+            'genres': [] if details.genres == 'N/D' else details.genres.split(', '),
+            'producers': [] if details.producers == 'N/D' else details.producers.split(', '),
+            'awards': [] if details.awards == 'Nessuno' else details.awards.split(', '),
+            'image': details.image,
+        }
+        data['recommendations'][song_qid] = [r.to_dict() for r in bundle['recommendations']]
+
+        for qid in performers:
+            if qid in data['artists']:
+                continue
+            artist = agent.get_artist_details(ENTITY_PREFIX + qid)
+            if artist.get('found'):
+                data['artists'][qid] = {
+                    'name': artist['name'],
+                    'description': artist['description'],
+                    'birth': artist['birth'],
+                    'death': artist['death'],
+                    'origin': artist['origin'],
+                    'genres': [] if artist['genres'] == 'Non specificato' else artist['genres'].split(', '),
+                    'image': artist.get('image'),
+                }
+        print(f"✅ {track['title']} -> {song_qid}")
+
+    with open(out, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=1, ensure_ascii=False)
+    print(f"📦 Dataset salvato in {out}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Dataset della modalità offline.")
+    sub = parser.add_subparsers(dest='command', required=True)
+    build_parser = sub.add_parser('build', help="rigenera il dataset interrogando Wikidata")
+    build_parser.add_argument('--source', default=DEFAULT_FIXTURES, help="file con la playlist da risolvere")
+    build_parser.add_argument('--out', default=DEFAULT_FIXTURES)
+    args = parser.parse_args()
+    if args.command == 'build':
+        build(args.source, args.out)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,344 @@
+import asyncio
+import os
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+from services import deadline, metrics
+from services.deadline import DeadlineExceeded
+from services.sparql_results import FORMATS, aparse_stream, parse_stream, rows_from_json
+
+# Blocchi letti dal socket mentre si decodificano le righe di TSV/CSV
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# Codici per cui ha senso riprovare: rate limit e indisponibilità temporanea
+RETRY_STATUSES = {429, 502, 503, 504}
+
+
+def is_unavailable(error):
+    """True se l'errore indica un endpoint lento o irraggiungibile (per il circuit breaker)."""
+    if isinstance(error, (requests.ConnectionError, requests.Timeout, httpx.TransportError)):
+        return True
+    response = getattr(error, 'response', None)
+    status = getattr(response, 'status_code', None)
+    return status is not None and (status == 429 or status >= 500)
+
+
+class TokenBucket:
+    """
+    Rate limiter lato client: `rate` richieste al secondo con raffiche fino a `burst`.
+    Condiviso tra i thread dello stesso processo.
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = float(rate)
+        self.capacity = float(burst)
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """Prenota un gettone e restituisce quanti secondi attendere prima di usarlo."""
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            # I gettoni possono andare in negativo: le prenotazioni si mettono in fila
+            self.tokens -= 1
+            return max(0.0, -self.tokens / self.rate)
+
+    def acquire(self):
+        """Blocca finché non c'è un gettone disponibile."""
+        time.sleep(self._reserve_before_deadline())
+
+    async def acquire_async(self):
+        await asyncio.sleep(self._reserve_before_deadline())
+
+    def _reserve_before_deadline(self):
+        # Un'attesa che finirebbe oltre la scadenza della richiesta è inutile
+        delay = self.reserve()
+        if not deadline.fits(delay):
+            raise DeadlineExceeded("scadenza della richiesta superata in attesa del rate limiter")
+        return delay
+
+
+def parse_retry_after(value):
+    """Interpreta l'header Retry-After (secondi o data HTTP). Restituisce i secondi o None."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class SparqlClient:
+    """
+    Client HTTP per il Query Service di Wikidata:
+      - una sola `requests.Session` con pool di connessioni keep-alive
+      - timeout di connessione/lettura
+      - retry con backoff esponenziale che rispetta `Retry-After`
+      - token bucket per restare sotto la quota per IP
+    """
+
+    def __init__(self, url, headers, pool_size=16, connect_timeout=3.05, read_timeout=30,
+                 max_retries=3, backoff=0.5, max_backoff=30, rate=5, burst=10, session=None,
+                 result_format='tsv'):
+        self.url = url
+        self.pool_size = pool_size
+        # Formato delle query a righe (query_rows): 'tsv', 'csv' o 'json'
+        self.result_format = result_format
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.limiter = TokenBucket(rate, burst)
+
+        self.session = session or requests.Session()
+        self.session.headers.update(headers)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    @classmethod
+    def from_env(cls, url, headers):
+        env = os.environ
+        return cls(
+            url, headers,
+            pool_size=int(env.get('WIKIDATA_POOL_SIZE', 16)),
+            connect_timeout=float(env.get('WIKIDATA_CONNECT_TIMEOUT', 3.05)),
+            read_timeout=float(env.get('WIKIDATA_READ_TIMEOUT', 30)),
+            max_retries=int(env.get('WIKIDATA_MAX_RETRIES', 3)),
+            rate=float(env.get('WIKIDATA_RATE', 5)),
+            burst=int(env.get('WIKIDATA_BURST', 10)),
+            result_format=env.get('WIKIDATA_RESULT_FORMAT', 'tsv'),
+        )
+
+    def get(self, params, headers=None, stream=False):
+        """
+        GET con retry. Restituisce la `Response` finale (già verificata con raise_for_status);
+        con `stream` il corpo non è ancora stato letto e il chiamante deve chiudere la risposta.
+        Rispetta la scadenza della richiesta (services.deadline): timeout ridotti al
+        tempo rimasto, niente attese oltre la scadenza, DeadlineExceeded a budget finito.
+        """
+        attempt = 0
+        while True:
+            self.limiter.acquire()
+            start = time.perf_counter()
+            try:
+                r = self.session.get(self.url, params=params, headers=headers,
+                                     timeout=self._budgeted_timeout(), stream=stream)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                metrics.observe_upstream('wikidata', time.perf_counter() - start,
+                                         error='timeout' if isinstance(e, requests.Timeout) else 'connection')
+                if deadline.expired():
+                    raise DeadlineExceeded("scadenza della richiesta superata durante la query") from e
+                delay = self._delay(attempt, None)
+                if attempt >= self.max_retries or not deadline.fits(delay):
+                    raise
+                time.sleep(delay)
+                attempt += 1
+                continue
+            metrics.observe_upstream('wikidata', time.perf_counter() - start,
+                                     status=r.status_code, size=None if stream else len(r.content))
+
+            if r.status_code in RETRY_STATUSES and attempt < self.max_retries:
+                delay = self._delay(attempt, parse_retry_after(r.headers.get('Retry-After')))
+                if deadline.fits(delay):
+                    print(f"⚠️ Wikidata {r.status_code}, nuovo tentativo ({attempt + 1}/{self.max_retries})")
+                    metrics.count_retry('wikidata', r.status_code)
+                    r.close()
+                    time.sleep(delay)
+                    attempt += 1
+                    continue
+
+            if r.status_code >= 400:
+                r.close()
+            r.raise_for_status()
+            return r
+
+    def query(self, query):
+        """Esegue una query SPARQL e restituisce il JSON dei risultati."""
+        return self.get({'query': query, 'format': 'json'}).json()
+
+    def query_rows(self, query, fmt=None):
+        """
+        Esegue una query SPARQL e restituisce ResultRows (tuple piatte). Con 'tsv' o
+        'csv' le righe vengono decodificate mentre la risposta arriva, senza tenere
+        in memoria il corpo intero; 'json' passa dal formato standard.
+        """
+        fmt = fmt or self.result_format
+        if fmt == 'json':
+            return rows_from_json(self.query(query))
+        # Niente parametro `format`: sul Query Service avrebbe la precedenza su Accept
+        with self.get({'query': query}, headers={'Accept': FORMATS[fmt]}, stream=True) as r:
+            r.encoding = 'utf-8'
+            return parse_stream(fmt, r.iter_content(STREAM_CHUNK_SIZE, decode_unicode=True))
+
+    def _budgeted_timeout(self):
+        """(connect, read) ridotti al tempo rimasto prima della scadenza."""
+        left = deadline.check('query Wikidata')
+        if left is None:
+            return self.timeout
+        return tuple(min(t, left) for t in self.timeout)
+
+    def _delay(self, attempt, retry_after):
+        if retry_after is not None:
+            delay = retry_after
+        else:
+            delay = self.backoff * (2 ** attempt)
+        return min(delay, self.max_backoff)
+
+
+class LoopClient:
+    """
+    httpx.AsyncClient legato all'event loop in cui è nato (le connessioni del pool
+    appartengono a quel loop). Se il loop cambia il vecchio client viene chiuso
+    sul suo loop quando questo gira ancora; un loop già chiuso ha chiuso con sé
+    i suoi trasporti. aclose() chiude il client alla fine del servizio.
+    """
+
+    __slots__ = ('factory', '_client', '_loop')
+
+    def __init__(self, factory):
+        self.factory = factory
+        self._client = None
+        self._loop = None
+
+    def get(self):
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._loop is not loop:
+            self._discard()
+            self._client = self.factory()
+            self._loop = loop
+        return self._client
+
+    async def aclose(self):
+        client, self._client, self._loop = self._client, None, None
+        if client is not None:
+            await client.aclose()
+
+    def _discard(self):
+        client, loop = self._client, self._loop
+        self._client = self._loop = None
+        if client is not None and loop.is_running():
+            asyncio.run_coroutine_threadsafe(client.aclose(), loop)
+
+
+class AsyncSparqlClient:
+    """
+    Versione asincrona di SparqlClient (httpx.AsyncClient) per la modalità ASGI.
+    Condivide il token bucket con il client sincrono, così la quota per IP vale
+    per tutto il processo. Il client httpx è legato all'event loop (LoopClient):
+    viene creato al primo uso nel loop corrente.
+    """
+
+    def __init__(self, url, headers, limiter, pool_size=16, connect_timeout=3.05,
+                 read_timeout=30, max_retries=3, backoff=0.5, max_backoff=30, result_format='tsv'):
+        self.url = url
+        self.headers = dict(headers)
+        self.result_format = result_format
+        self.limiter = limiter
+        self.pool_size = pool_size
+        self.timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._http = LoopClient(self._new_client)
+
+    @classmethod
+    def from_sync(cls, client):
+        """Stessa configurazione (e stesso rate limiter) di un SparqlClient esistente."""
+        connect_timeout, read_timeout = client.timeout
+        return cls(client.url, client.session.headers, client.limiter,
+                   pool_size=client.pool_size, connect_timeout=connect_timeout,
+                   read_timeout=read_timeout, max_retries=client.max_retries,
+                   backoff=client.backoff, max_backoff=client.max_backoff,
+                   result_format=client.result_format)
+
+    @property
+    def client(self):
+        return self._http.get()
+
+    def _new_client(self):
+        limits = httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size)
+        return httpx.AsyncClient(headers=self.headers, timeout=self.timeout, limits=limits)
+
+    async def get(self, params, headers=None, stream=False):
+        attempt = 0
+        while True:
+            await self.limiter.acquire_async()
+            start = time.perf_counter()
+            try:
+                request = self.client.build_request('GET', self.url, params=params, headers=headers,
+                                                    timeout=self._budgeted_timeout())
+                r = await self.client.send(request, stream=stream)
+            except (httpx.ConnectError, httpx.TimeoutException) as e:
+                metrics.observe_upstream('wikidata', time.perf_counter() - start,
+                                         error='timeout' if isinstance(e, httpx.TimeoutException) else 'connection')
+                if deadline.expired():
+                    raise DeadlineExceeded("scadenza della richiesta superata durante la query") from e
+                delay = self._delay(attempt, None)
+                if attempt >= self.max_retries or not deadline.fits(delay):
+                    raise
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+            metrics.observe_upstream('wikidata', time.perf_counter() - start,
+                                     status=r.status_code, size=None if stream else len(r.content))
+
+            if r.status_code in RETRY_STATUSES and attempt < self.max_retries:
+                delay = self._delay(attempt, parse_retry_after(r.headers.get('Retry-After')))
+                if deadline.fits(delay):
+                    print(f"⚠️ Wikidata {r.status_code}, nuovo tentativo ({attempt + 1}/{self.max_retries})")
+                    metrics.count_retry('wikidata', r.status_code)
+                    await r.aclose()
+                    await asyncio.sleep(delay)
+                    attempt += 1
+                    continue
+
+            if r.status_code >= 400:
+                await r.aclose()
+            r.raise_for_status()
+            return r
+
+    async def query(self, query):
+        r = await self.get({'query': query, 'format': 'json'})
+        return r.json()
+
+    async def query_rows(self, query, fmt=None):
+        """Versione asincrona di SparqlClient.query_rows."""
+        fmt = fmt or self.result_format
+        if fmt == 'json':
+            return rows_from_json(await self.query(query))
+        r = await self.get({'query': query}, headers={'Accept': FORMATS[fmt]}, stream=True)
+        try:
+            return await aparse_stream(fmt, r.aiter_text())
+        finally:
+            await r.aclose()
+
+    async def aclose(self):
+        await self._http.aclose()
+
+    def _budgeted_timeout(self):
+        left = deadline.check('query Wikidata')
+        if left is None:
+            return self.timeout
+        return httpx.Timeout(min(self.timeout.read, left), connect=min(self.timeout.connect, left))
+
+    def _delay(self, attempt, retry_after):
+        if retry_after is not None:
+            delay = retry_after
+        else:
+            delay = self.backoff * (2 ** attempt)
+        return min(delay, self.max_backoff)
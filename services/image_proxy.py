@@ -0,0 +1,301 @@
+"""
+Proxy per copertine e foto, con miniature della dimensione giusta.
+
+Le pagine mostrano immagini piccole (64px in playlist, 180px nelle schede)
+ma ricevevano la copertina Spotify più grande (640px) e gli originali di
+Wikimedia Commons (P18), spesso di diversi MB. Qui:
+  - per Spotify si sceglie la variante (64 / 300 / 640) più piccola che basta
+  - per Commons si chiede a Special:FilePath la miniatura (?width=)
+  - le immagini passano da /img con cache su disco + LRU in memoria e
+    header di cache lunghi: il browser (e un eventuale proxy) non le richiede più
+
+Solo gli host in ALLOWED_HOSTS vengono serviti, così /img non è un proxy aperto.
+Configurazione: IMAGE_PROXY=0 (link diretti, solo ridimensionati),
+IMAGE_CACHE_DIR, IMAGE_CACHE_MAX_BYTES, IMAGE_MEMORY_BYTES.
+"""
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlencode, urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from services import metrics
+from services.singleflight import SingleFlight
+
+ALLOWED_HOSTS = {'i.scdn.co', 'commons.wikimedia.org', 'upload.wikimedia.org'}
+# Larghezze servite: la richiesta viene arrotondata per eccesso (poche varianti per immagine)
+WIDTHS = (64, 128, 180, 300, 360, 640)
+# Varianti delle copertine Spotify: il prefisso dell'id dell'immagine ne indica la larghezza
+SPOTIFY_VARIANTS = {64: 'ab67616d00004851', 300: 'ab67616d00001e02', 640: 'ab67616d0000b273'}
+MAX_IMAGE_BYTES = 8 * 1024 * 1024
+# Un'immagine a un dato URL non cambia: il browser può tenerla un mese
+BROWSER_MAX_AGE = 30 * 24 * 3600
+USER_AGENT = 'MusicDataBot/1.0 (https://example.com; contact@example.com)'
+
+# Solo formati raster: un SVG può contenere script e /img lo servirebbe dalla
+# stessa origine dell'app. Le miniature di Commons (?width=) arrivano comunque
+# come PNG; un SVG originale viene rifiutato e /img rimanda al link diretto.
+_EXTENSIONS = {'image/jpeg': '.jpg', 'image/png': '.png', 'image/webp': '.webp',
+               'image/gif': '.gif'}
+_TYPES = {ext: ctype for ctype, ext in _EXTENSIONS.items()}
+
+
+def fit_width(width):
+    """La larghezza servita più piccola che copre `width`."""
+    for w in WIDTHS:
+        if w >= width:
+            return w
+    return WIDTHS[-1]
+
+
+def pick_spotify_image(images, width):
+    """Dalla lista `images` di Spotify, l'immagine più piccola larga almeno `width` (o la più grande)."""
+    sized = [img for img in images if img.get('url')]
+    if not sized:
+        return None
+    # Spotify le elenca dalla più grande; senza dimensioni teniamo quell'ordine
+    sized.sort(key=lambda img: img.get('width') or 0)
+    for img in sized:
+        if (img.get('width') or 0) >= width:
+            return img['url']
+    return sized[-1]['url']
+
+
+def sized_url(url, width):
+    """URL della variante dell'immagine adatta a `width` pixel (se la sorgente lo permette)."""
+    if not url:
+        return url
+    parts = urlsplit(url)
+    if parts.hostname == 'i.scdn.co':
+        image_id = parts.path.rsplit('/', 1)[-1]
+        for prefix in SPOTIFY_VARIANTS.values():
+            if image_id.startswith(prefix):
+                variant = min((w for w in SPOTIFY_VARIANTS if w >= width), default=max(SPOTIFY_VARIANTS))
+                return url.replace(prefix, SPOTIFY_VARIANTS[variant], 1)
+    elif parts.hostname == 'commons.wikimedia.org' and '/Special:FilePath/' in parts.path:
+        return f"https://commons.wikimedia.org{parts.path}?width={width}"
+    return url
+
+
+class _CachedImage:
+    __slots__ = ('data', 'content_type', 'etag')
+
+    def __init__(self, data, content_type, etag):
+        self.data = data
+        self.content_type = content_type
+        self.etag = etag
+
+
+class ImageProxy:
+    def __init__(self, directory, enabled=True, max_disk_bytes=500 * 1024 * 1024,
+                 max_memory_bytes=32 * 1024 * 1024, timeout=(3.05, 10), session=None):
+        self.directory = directory
+        self.enabled = enabled
+        self.max_disk_bytes = max_disk_bytes
+        self.max_memory_bytes = max_memory_bytes
+        self.timeout = timeout
+        self.flight = SingleFlight()
+
+        self.session = session or requests.Session()
+        self.session.headers['User-Agent'] = USER_AGENT
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._stats = {'hits': 0, 'disk_hits': 0, 'misses': 0, 'errors': 0, 'evictions': 0}
+        os.makedirs(directory, exist_ok=True)
+
+    @classmethod
+    def from_env(cls, default_dir):
+        env = os.environ
+        return cls(
+            env.get('IMAGE_CACHE_DIR', default_dir),
+            enabled=env.get('IMAGE_PROXY', '1') != '0',
+            max_disk_bytes=int(env.get('IMAGE_CACHE_MAX_BYTES', 500 * 1024 * 1024)),
+            max_memory_bytes=int(env.get('IMAGE_MEMORY_BYTES', 32 * 1024 * 1024)),
+        )
+
+    # --- Link nei template --------------------------------------------------
+
+    def thumb(self, url, width):
+        """Filtro Jinja `thumb`: link a /img per gli host consentiti, altrimenti l'URL ridimensionato."""
+        if not url:
+            return url
+        width = fit_width(int(width))
+        if not self.enabled or urlsplit(url).hostname not in ALLOWED_HOSTS:
+            return sized_url(url, width)
+        return '/img?' + urlencode({'src': url, 'w': width})
+
+    @staticmethod
+    def allowed(url):
+        parts = urlsplit(url or '')
+        return parts.scheme in ('http', 'https') and parts.hostname in ALLOWED_HOSTS
+
+    # --- Immagini -----------------------------------------------------------
+
+    def get(self, url, width):
+        """L'immagine `url` alla larghezza `width`: dalla memoria, dal disco o dalla rete. None se non scaricabile."""
+        source = sized_url(url, fit_width(width))
+        key = hashlib.sha1(source.encode('utf-8')).hexdigest()
+
+        image = self._memory_get(key)
+        if image is not None:
+            self._incr('hits')
+            return image
+        image = self._disk_get(key)
+        if image is not None:
+            self._incr('disk_hits')
+            self._memory_put(key, image)
+            return image
+
+        self._incr('misses')
+        # Più pagine aperte insieme chiedono le stesse copertine: un solo download
+        return self.flight.do(f"image:{key}", lambda: self._download(key, source),
+                              lookup=lambda: self._memory_get(key))
+
+    def respond(self, image, request, response_class):
+        headers = {
+            'ETag': f'"{image.etag}"',
+            'Cache-Control': f"public, max-age={BROWSER_MAX_AGE}, immutable",
+            # Il browser non deve reinterpretare il contenuto come un altro tipo (es. HTML)
+            'X-Content-Type-Options': 'nosniff',
+        }
+        if request.if_none_match.contains_weak(image.etag):
+            return response_class(b'', status=304, headers=headers)
+        return response_class(image.data, status=200, headers=headers, content_type=image.content_type)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['memory_bytes'] = self._memory_bytes
+            stats['memory_entries'] = len(self._memory)
+        return stats
+
+    # --- Interni ------------------------------------------------------------
+
+    def _download(self, key, source):
+        start = time.perf_counter()
+        try:
+            with self.session.get(source, timeout=self.timeout, stream=True) as r:
+                if r.status_code != 200:
+                    metrics.observe_upstream('images', time.perf_counter() - start,
+                                             status=r.status_code, call='thumbnail')
+                    self._incr('errors')
+                    return None
+                content_type = r.headers.get('Content-Type', '').split(';')[0].strip()
+                data = b''.join(self._capped(r))
+        except requests.RequestException as e:
+            metrics.observe_upstream('images', time.perf_counter() - start, call='thumbnail',
+                                     error='timeout' if isinstance(e, requests.Timeout) else 'connection')
+            print(f"⚠️ Immagine non scaricata ({source}): {e}")
+            self._incr('errors')
+            return None
+        metrics.observe_upstream('images', time.perf_counter() - start, status=200, size=len(data),
+                                 call='thumbnail')
+        if not data or content_type not in _EXTENSIONS:
+            self._incr('errors')
+            return None
+
+        image = _CachedImage(data, content_type, key[:20])
+        self._disk_put(key, image)
+        self._memory_put(key, image)
+        return image
+
+    @staticmethod
+    def _capped(response):
+        total = 0
+        for chunk in response.iter_content(64 * 1024):
+            total += len(chunk)
+            if total > MAX_IMAGE_BYTES:
+                raise requests.RequestException(f"immagine oltre {MAX_IMAGE_BYTES} byte")
+            yield chunk
+
+    def _memory_get(self, key):
+        with self._lock:
+            image = self._memory.get(key)
+            if image is not None:
+                self._memory.move_to_end(key)
+            return image
+
+    def _memory_put(self, key, image):
+        with self._lock:
+            if key in self._memory:
+                return
+            self._memory[key] = image
+            self._memory_bytes += len(image.data)
+            while self._memory_bytes > self.max_memory_bytes and len(self._memory) > 1:
+                _, old = self._memory.popitem(last=False)
+                self._memory_bytes -= len(old.data)
+
+    def _path(self, key, content_type):
+        return os.path.join(self.directory, key + _EXTENSIONS[content_type])
+
+    def _disk_get(self, key):
+        for ext, content_type in _TYPES.items():
+            path = os.path.join(self.directory, key + ext)
+            try:
+                with open(path, 'rb') as f:
+                    data = f.read()
+            except OSError:
+                continue
+            # L'accesso rinnova il file (eviction LRU sulla data di modifica)
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+            return _CachedImage(data, content_type, key[:20])
+        return None
+
+    def _disk_put(self, key, image):
+        path = self._path(key, image.content_type)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp, 'wb') as f:
+                f.write(image.data)
+            os.replace(tmp, path)
+        except OSError as e:
+            print(f"⚠️ Immagine non salvata su disco: {e}")
+            self._incr('errors')
+            return
+        with self._lock:
+            self._writes += 1
+            check = self._writes % 50 == 0
+        if check:
+            self._evict()
+
+    def _evict(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.tmp'):
+                continue
+            full = os.path.join(self.directory, name)
+            try:
+                st = os.stat(full)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, full))
+
+        # Dalla meno recente finché la cartella torna sotto il limite
+        entries.sort()
+        total_bytes = sum(size for _, size, _ in entries)
+        for _, size, full in entries:
+            if total_bytes <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(full)
+                self._incr('evictions')
+            except OSError:
+                continue
+            total_bytes -= size
+
+    def _incr(self, name):
+        with self._lock:
+            self._stats[name] += 1
@@ -0,0 +1,157 @@
+"""
+Statistiche sull'intera playlist: distribuzione dei generi, istogramma per
+decennio e interpreti più presenti.
+
+Il calcolo richiede tre passi, tutti a blocchi e senza query per brano:
+  1. la playlist intera (dalla cache degli snapshot se invariata)
+  2. resolve_tracks_batch: brani Spotify -> entità Wikidata
+  3. get_track_facts: generi (P136), data (P577) e interpreti (P175) in
+     query VALUES da FACTS_CHUNK_SIZE brani
+I blocchi dei passi 2 e 3 partono in parallelo entro la scadenza della richiesta:
+quelli oltre il budget falliscono e il risultato torna con 'partial': true (i
+brani già risolti restano nella cache di WikiAgent, la richiesta dopo riparte da lì).
+L'aggregazione è un solo passaggio con Counter sui dati compatti dei brani.
+Il risultato è salvato nella cache di WikiAgent per (playlist, snapshot_id):
+finché la playlist non cambia le statistiche non vengono ricalcolate, e più
+richieste concorrenti per la stessa playlist condividono un solo calcolo.
+"""
+import statistics
+from collections import Counter
+
+TOP_GENRES = 15
+TOP_PERFORMERS = 10
+
+
+class PlaylistInsights:
+    def __init__(self, agent, spotify):
+        self.agent = agent
+        self.spotify = spotify
+
+    def get(self, playlist_id):
+        tracks, snapshot_id, is_demo = self.spotify.playlist_snapshot(playlist_id)
+        key = self._key(playlist_id, snapshot_id, is_demo)
+        cached = self.agent.cache.get(key)
+        if cached is not None:
+            return cached
+
+        def compute():
+            resolved = self.agent.resolve_tracks_batch([(t.title, t.artist) for t in tracks])
+            facts = self.agent.get_track_facts(_song_urls(resolved))
+            result = self._result(tracks, resolved, facts, snapshot_id, is_demo)
+            if _cacheable(result):
+                self.agent.cache.set('insights', key, result)
+            return result
+
+        return self.agent.flight.do(key, compute, lookup=lambda: self.agent.cache.get(key))
+
+    async def aget(self, playlist_id):
+        tracks, snapshot_id, is_demo = await self.spotify.aplaylist_snapshot(playlist_id)
+        key = self._key(playlist_id, snapshot_id, is_demo)
+        cached = await self.agent.cache.aget(key)
+        if cached is not None:
+            return cached
+
+        async def compute():
+            resolved = await self.agent.aresolve_tracks_batch([(t.title, t.artist) for t in tracks])
+            facts = await self.agent.aget_track_facts(_song_urls(resolved))
+            result = self._result(tracks, resolved, facts, snapshot_id, is_demo)
+            if _cacheable(result):
+                await self.agent.cache.aset('insights', key, result)
+            return result
+
+        return await self.agent.aflight.do(key, compute)
+
+    # --- Interni ------------------------------------------------------------
+
+    def _key(self, playlist_id, snapshot_id, is_demo):
+        # I dati demo sono gli stessi per ogni playlist: una sola voce in cache
+        if is_demo:
+            return self.agent.cache.make_key('insights', 'demo')
+        return self.agent.cache.make_key('insights', playlist_id, snapshot_id or '')
+
+    @staticmethod
+    def _result(tracks, resolved, facts, snapshot_id, is_demo):
+        result = aggregate(tracks, resolved, facts)
+        result['snapshot'] = snapshot_id
+        result['demo'] = is_demo
+        return result
+
+
+def _cacheable(result):
+    # Senza snapshot_id non sapremmo quando la playlist cambia; con blocchi
+    # falliti le statistiche sono parziali: in entrambi i casi niente cache
+    return not result['partial'] and bool(result['snapshot'] or result['demo'])
+
+
+def _song_urls(resolved):
+    return [res[0] for res in resolved if res is not None and res[0]]
+
+
+def aggregate(tracks, resolved, facts):
+    """
+    Statistiche della playlist a partire dall'esito della risoluzione (allineato
+    a `tracks`) e dai dati dei brani ({song_url: facts}). Un brano presente più
+    volte nella playlist conta più volte, come la ascolta chi la riproduce.
+    """
+    genres = Counter()
+    performers = Counter()
+    performer_names = {}
+    years = []
+    found = with_facts = 0
+    partial = False
+
+    for res in resolved:
+        if res is None:
+            partial = True
+            continue
+        song_url = res[0]
+        if not song_url:
+            continue
+        found += 1
+        song = facts.get(song_url)
+        if song is None:
+            # Un blocco riuscito ha una voce per ogni brano: manca solo se il blocco
+            # è fallito (timeout, circuito aperto, scadenza) e i dati sono incompleti
+            partial = True
+            continue
+        with_facts += 1
+        genres.update(set(song['genres']))
+        # Un interprete conta una volta per brano anche se ripetuto nei dati
+        for url, name in {url: name for name, url in song['performers']}.items():
+            performers[url] += 1
+            performer_names[url] = name
+        year = _year(song.get('date'))
+        if year is not None:
+            years.append(year)
+
+    return {
+        'tracks': len(tracks),
+        'resolved': found,
+        'with_facts': with_facts,
+        'dated': len(years),
+        'partial': partial,
+        'genres': [{'name': name, 'count': count, 'share': round(count / with_facts, 4)}
+                   for name, count in genres.most_common(TOP_GENRES)],
+        'decades': _decades(years),
+        'performers': [{'name': performer_names[url], 'url': url, 'count': count}
+                       for url, count in performers.most_common(TOP_PERFORMERS)],
+        'median_year': int(statistics.median_low(years)) if years else None,
+        'span': [min(years), max(years)] if years else None,
+    }
+
+
+def _year(date):
+    """Anno da una data ISO (anche con segno o solo anno); None se assente o non valida."""
+    if not date:
+        return None
+    head = date.lstrip('+').split('-')[0]
+    return int(head) if head.isdigit() else None
+
+
+def _decades(years):
+    """Istogramma per decennio, compresi i decenni vuoti nell'intervallo (il grafico resta continuo)."""
+    counts = Counter(year // 10 * 10 for year in years)
+    if not counts:
+        return []
+    return [{'decade': decade, 'count': counts.get(decade, 0)}
+            for decade in range(min(counts), max(counts) + 10, 10)]
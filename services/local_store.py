@@ -0,0 +1,408 @@
+"""
+Indice locale del sottografo musicale di Wikidata (SQLite).
+
+Importa un dump JSON di Wikidata già filtrato (un'entità per riga, come
+`latest-all.json` ridotto con wikibase-dump-filter o simili) e risponde alle
+stesse domande di WikiAgent senza passare dal Query Service pubblico.
+
+Uso:
+    python -m services.local_store dump_musica.json.gz --db data/wikidata_music.sqlite
+"""
+import argparse
+import bz2
+import gzip
+import json
+import os
+import sqlite3
+import threading
+from urllib.parse import quote
+
+from services.matcher import MATCH_THRESHOLD, TrackMatcher, normalize, strip_decorations
+from services.models import ArtistRef, TrackDetails
+from services.recommender import RecommendationIndex
+
+ENTITY_PREFIX = "http://www.wikidata.org/entity/"
+COMMONS_PREFIX = "http://commons.wikimedia.org/wiki/Special:FilePath/"
+
+# Opere musicali (Q7366 canzone, Q2188189 opera musicale)
+SONG_CLASSES = {'Q7366', 'Q2188189'}
+# Proprietà che collegano un'entità ad altre entità
+LINK_PROPS = ('P31', 'P175', 'P136', 'P162', 'P166', 'P19', 'P740')
+# Proprietà con valore temporale
+DATE_PROPS = {'P577': 'date', 'P569': 'birth', 'P570': 'death'}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS items (
+    qid TEXT PRIMARY KEY,
+    is_song INTEGER NOT NULL DEFAULT 0,
+    label TEXT,
+    label_en TEXT,
+    description_it TEXT,
+    image TEXT,
+    date TEXT,
+    year INTEGER,
+    birth TEXT,
+    death TEXT
+);
+CREATE TABLE IF NOT EXISTS names (
+    qid TEXT NOT NULL,
+    norm TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS links (
+    subject TEXT NOT NULL,
+    prop TEXT NOT NULL,
+    target TEXT NOT NULL
+);
+"""
+
+INDEXES = """
+CREATE INDEX IF NOT EXISTS idx_names_norm ON names(norm);
+CREATE INDEX IF NOT EXISTS idx_names_qid ON names(qid);
+CREATE INDEX IF NOT EXISTS idx_links_subject ON links(subject, prop);
+CREATE INDEX IF NOT EXISTS idx_links_target ON links(prop, target);
+"""
+
+
+def qid_of(url):
+    """'http://www.wikidata.org/entity/Q42' -> 'Q42' (accetta anche '<...>' e QID nudi)."""
+    return (url or '').strip('<>').rstrip('/').split('/')[-1]
+
+
+def _entity_url(qid):
+    return ENTITY_PREFIX + qid
+
+
+def _wikidata_time(value):
+    """'+1975-10-31T00:00:00Z' -> '1975-10-31T00:00:00Z' (mese/giorno 00 diventano 01, come nel WDQS)."""
+    time_value = value.get('time', '')
+    if not time_value:
+        return None
+    sign = '-' if time_value.startswith('-') else ''
+    date_part, _, rest = time_value.lstrip('+-').partition('T')
+    parts = date_part.split('-')
+    if len(parts) != 3:
+        return None
+    year, month, day = parts
+    month = month if month != '00' else '01'
+    day = day if day != '00' else '01'
+    return f"{sign}{year}-{month}-{day}T{rest or '00:00:00Z'}"
+
+
+def _claim_values(entity, prop):
+    for claim in entity.get('claims', {}).get(prop, []):
+        if claim.get('rank') == 'deprecated':
+            continue
+        snak = claim.get('mainsnak', {})
+        if snak.get('snaktype') != 'value':
+            continue
+        yield snak.get('datavalue', {}).get('value')
+
+
+def _open_dump(path):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8')
+    if path.endswith('.bz2'):
+        return bz2.open(path, 'rt', encoding='utf-8')
+    return open(path, encoding='utf-8')
+
+
+def iter_dump(path):
+    """Itera le entità di un dump JSON Wikidata (array con un'entità per riga)."""
+    with _open_dump(path) as f:
+        for line in f:
+            line = line.strip().rstrip(',')
+            if not line or line in ('[', ']'):
+                continue
+            yield json.loads(line)
+
+
+class LocalStore:
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    @property
+    def conn(self):
+        # Una connessione per thread: sqlite3 non condivide le connessioni tra thread
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path)
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    # --- Import -------------------------------------------------------------
+
+    def import_dump(self, dump_path, batch_size=5000):
+        """Importa (o aggiorna) il database a partire da un dump filtrato."""
+        conn = self.conn
+        conn.executescript(SCHEMA + INDEXES)
+        count = 0
+        # qid -> (riga, nomi, collegamenti): un'entità ripetuta nel blocco vale una volta (l'ultima)
+        batch = {}
+
+        for entity in iter_dump(dump_path):
+            if entity.get('type') != 'item':
+                continue
+            row, entity_names, entity_links = self._parse_entity(entity)
+            batch[row[0]] = (row, entity_names, entity_links)
+            count += 1
+
+            if len(batch) >= batch_size:
+                self._flush(batch)
+                batch = {}
+
+        self._flush(batch)
+        conn.commit()
+        print(f"✅ Importate {count} entità in {self.path}")
+        return count
+
+    def _flush(self, batch):
+        conn = self.conn
+        qids = [(qid,) for qid in batch]
+        # Reimport: le righe collegate vengono sostituite (ricerca per indice, non scansione)
+        conn.executemany("DELETE FROM names WHERE qid = ?", qids)
+        conn.executemany("DELETE FROM links WHERE subject = ?", qids)
+        conn.executemany("INSERT OR REPLACE INTO items VALUES (?,?,?,?,?,?,?,?,?,?)",
+                         [row for row, _, _ in batch.values()])
+        conn.executemany("INSERT INTO names VALUES (?,?)", [n for _, names, _ in batch.values() for n in names])
+        conn.executemany("INSERT INTO links VALUES (?,?,?)", [l for _, _, links in batch.values() for l in links])
+
+    def _parse_entity(self, entity):
+        qid = entity['id']
+        labels = entity.get('labels', {})
+        label_it = labels.get('it', {}).get('value')
+        label_en = labels.get('en', {}).get('value')
+        # Stessa priorità delle query remote: IT > EN > qualsiasi lingua
+        label = label_it or label_en or next((l['value'] for l in labels.values()), None)
+        description = entity.get('descriptions', {}).get('it', {}).get('value')
+
+        links = []
+        for prop in LINK_PROPS:
+            for value in _claim_values(entity, prop):
+                if isinstance(value, dict) and value.get('id'):
+                    links.append((qid, prop, value['id']))
+        is_song = int(any(p == 'P31' and t in SONG_CLASSES for _, p, t in links))
+
+        image = next(_claim_values(entity, 'P18'), None)
+        image = COMMONS_PREFIX + quote(image) if image else None
+
+        dates = {}
+        for prop, column in DATE_PROPS.items():
+            values = sorted(v for v in (_wikidata_time(x) for x in _claim_values(entity, prop)) if v)
+            dates[column] = values[0] if values else None
+        year = int(dates['date'][:4]) if dates['date'] and dates['date'][0] != '-' else None
+
+        norms = {normalize(l['value']) for l in labels.values() if l.get('value')}
+        names = [(qid, n) for n in norms if n]
+
+        row = (qid, is_song, label, label_en, description, image,
+               dates['date'], year, dates['birth'], dates['death'])
+        return row, names, links
+
+    # --- Letture ------------------------------------------------------------
+
+    def item(self, qid):
+        return self.conn.execute("SELECT * FROM items WHERE qid = ?", (qid,)).fetchone()
+
+    def targets(self, qid, prop):
+        """Entità collegate a `qid` tramite `prop`, con la loro etichetta."""
+        return self.conn.execute(
+            "SELECT i.qid, i.label, i.label_en FROM links l JOIN items i ON i.qid = l.target "
+            "WHERE l.subject = ? AND l.prop = ?", (qid, prop)).fetchall()
+
+    def find_song(self, title, artist):
+        row = self.conn.execute(
+            "SELECT s.qid AS song, a.qid AS artist FROM names ns "
+            "JOIN items s ON s.qid = ns.qid AND s.is_song = 1 "
+            "JOIN links l ON l.subject = s.qid AND l.prop = 'P175' "
+            "JOIN names na ON na.qid = l.target "
+            "JOIN items a ON a.qid = l.target "
+            "WHERE ns.norm = ? AND na.norm = ? LIMIT 1",
+            (normalize(strip_decorations(title)), normalize(artist))).fetchone()
+        return (row['song'], row['artist']) if row else None
+
+    def song_records(self, qids=None):
+        """
+        Brani con interpreti e generi, per costruire indici in memoria.
+        Restituisce tuple (qid, label, image, year, [interpreti], [generi]).
+        """
+        if qids is None:
+            where, params = "i.is_song = 1", ()
+        else:
+            qids = list(qids)
+            where = f"i.is_song = 1 AND i.qid IN ({','.join('?' * len(qids))})"
+            params = tuple(qids)
+        songs = self.conn.execute(
+            f"SELECT i.qid, i.label, i.image, i.year FROM items i WHERE {where}", params).fetchall()
+        links = {}
+        for row in self.conn.execute(
+                f"SELECT l.subject, l.prop, l.target FROM links l JOIN items i ON i.qid = l.subject "
+                f"WHERE {where} AND l.prop IN ('P175', 'P136')", params):
+            entry = links.setdefault(row['subject'], ([], []))
+            entry[0 if row['prop'] == 'P175' else 1].append(row['target'])
+        for s in songs:
+            performers, genres = links.get(s['qid'], ([], []))
+            yield s['qid'], s['label'], s['image'], s['year'], performers, genres
+
+    def song_names(self):
+        """Tutte le etichette normalizzate dei brani: (qid, norm)."""
+        return self.conn.execute(
+            "SELECT n.qid, n.norm FROM names n JOIN items i ON i.qid = n.qid WHERE i.is_song = 1")
+
+    def performer_links(self):
+        """Coppie (brano, interprete) per tutti i brani."""
+        return self.conn.execute(
+            "SELECT l.subject, l.target FROM links l JOIN items i ON i.qid = l.subject "
+            "WHERE i.is_song = 1 AND l.prop = 'P175'")
+
+    def performer_names(self):
+        """Tutte le etichette normalizzate degli interpreti: (qid, norm)."""
+        return self.conn.execute(
+            "SELECT n.qid, n.norm FROM names n "
+            "WHERE n.qid IN (SELECT target FROM links WHERE prop = 'P175')")
+
+    def artist_labels(self):
+        """Etichette (EN se presente, come nella query Discovery remota) di tutti gli interpreti."""
+        rows = self.conn.execute(
+            "SELECT DISTINCT i.qid, COALESCE(i.label_en, i.label) AS label "
+            "FROM links l JOIN items i ON i.qid = l.target WHERE l.prop = 'P175'")
+        return {r['qid']: r['label'] for r in rows}
+
+
+class LocalBackend:
+    """
+    Risponde ai metodi di WikiAgent dal LocalStore con le stesse strutture
+    delle query remote. Restituisce None quando il dato non è presente,
+    così WikiAgent può ripiegare sull'endpoint pubblico.
+    """
+
+    def __init__(self, store, match_threshold=MATCH_THRESHOLD):
+        self.store = store
+        self.match_threshold = match_threshold
+        self._recs_index = None
+        self._recs_lock = threading.Lock()
+        self._matcher = None
+        self._matcher_lock = threading.Lock()
+
+    @property
+    def recs_index(self):
+        # Costruito al primo uso: evita di rallentare l'avvio dei worker
+        if self._recs_index is None:
+            with self._recs_lock:
+                if self._recs_index is None:
+                    self._recs_index = RecommendationIndex.from_store(self.store)
+        return self._recs_index
+
+    def refresh_recommendations(self, qids=None):
+        """Aggiorna l'indice dei consigliati: completo (qids=None) o solo per i brani indicati."""
+        if qids is None or self._recs_index is None:
+            with self._recs_lock:
+                self._recs_index = RecommendationIndex.from_store(self.store)
+        else:
+            self._recs_index.refresh(self.store, qids)
+
+    @property
+    def matcher(self):
+        if self._matcher is None:
+            with self._matcher_lock:
+                if self._matcher is None:
+                    self._matcher = TrackMatcher.from_store(self.store, self.match_threshold)
+        return self._matcher
+
+    def match_track(self, title, artist):
+        """
+        (song_url, artist_url, confidenza): prima la corrispondenza esatta delle
+        etichette, poi l'abbinamento fuzzy sui trigrammi. None se non c'è nessun candidato.
+        """
+        found = self.store.find_song(title, artist)
+        if found:
+            return _entity_url(found[0]), _entity_url(found[1]), 1.0
+        match = self.matcher.match(title, artist)
+        if match is None:
+            return None
+        return _entity_url(match[0]), _entity_url(match[1]), match[2]
+
+    def get_track_url(self, title, artist):
+        match = self.match_track(title, artist)
+        # Sotto soglia: meglio la ricerca remota che un brano sbagliato
+        if match is None or match[2] < self.match_threshold:
+            return None
+        return match[0], match[1]
+
+    def get_track_details(self, entity_url):
+        qid = qid_of(entity_url)
+        song = self.store.item(qid)
+        if song is None or not song['is_song']:
+            return None
+
+        def joined(prop, empty):
+            labels = [r['label'] for r in self.store.targets(qid, prop) if r['label']]
+            return ', '.join(labels) if labels else empty
+
+        artisti = [ArtistRef(r['label'] or _entity_url(r['qid']), _entity_url(r['qid']))
+                   for r in self.store.targets(qid, 'P175')]
+        if not artisti:
+            artisti.append(ArtistRef('Artista Sconosciuto', ''))
+
+        return TrackDetails(
+            found=True,
+            wikidata_url=_entity_url(qid),
+            title=song['label'] or 'Titolo Sconosciuto',
+            image=song['image'],
+            date=song['date'].split('T')[0] if song['date'] else 'N/D',
+            genres=joined('P136', 'N/D'),
+            producers=joined('P162', 'N/D'),
+            awards=joined('P166', 'Nessuno'),
+            artisti_list=artisti
+        )
+
+    def get_track_facts(self, entity_url):
+        """Genere, data e interpreti di un brano per le statistiche della playlist."""
+        qid = qid_of(entity_url)
+        song = self.store.item(qid)
+        if song is None or not song['is_song']:
+            return None
+        return {
+            'date': song['date'].split('T')[0] if song['date'] else None,
+            'genres': [r['label'] for r in self.store.targets(qid, 'P136') if r['label']],
+            'performers': [[r['label'] or _entity_url(r['qid']), _entity_url(r['qid'])]
+                           for r in self.store.targets(qid, 'P175')],
+        }
+
+    def get_artist_details(self, entity_url):
+        qid = qid_of(entity_url)
+        artist = self.store.item(qid)
+        if artist is None:
+            return None
+
+        places = self.store.targets(qid, 'P19') or self.store.targets(qid, 'P740')
+        genres = [r['label'] for r in self.store.targets(qid, 'P136') if r['label']]
+        return {
+            'found': True,
+            'name': artist['label'] or 'Sconosciuto',
+            'image': artist['image'],
+            'description': artist['description_it'] or 'Nessuna biografia disponibile su Wikidata.',
+            'birth': artist['birth'].split('T')[0] if artist['birth'] else None,
+            'death': artist['death'].split('T')[0] if artist['death'] else None,
+            'origin': places[0]['label'] if places and places[0]['label'] else 'Non specificato',
+            'genres': ', '.join(genres) if genres else 'Non specificato',
+            'url': entity_url
+        }
+
+    def get_recommendations(self, song_url, artist_url):
+        return self.recs_index.recommend(qid_of(song_url), qid_of(artist_url), artist_url)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Importa un dump Wikidata filtrato nell'indice locale.")
+    parser.add_argument('dump', help="Dump JSON (anche .gz/.bz2), un'entità per riga")
+    parser.add_argument('--db', default=os.environ.get('WIKI_LOCAL_DB', 'data/wikidata_music.sqlite'))
+    args = parser.parse_args()
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.db)), exist_ok=True)
+    LocalStore(args.db).import_dump(args.dump)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+"""
+Abbinamento fuzzy (titolo, artista) -> (brano, interprete) sulle etichette di Wikidata.
+
+Sostituisce la doppia ricerca mwapi EntitySearch di get_track_url quando è
+disponibile l'indice locale: i titoli vengono ripuliti dai suffissi tipici di
+Spotify ("- Remastered 2011", "(feat. X)", "- Live", ...) e confrontati per
+similarità di trigrammi con le etichette dei brani e degli interpreti.
+"""
+import heapq
+import re
+import threading
+import unicodedata
+
+# Sotto questa confidenza il risultato locale viene scartato (si ripiega sulla query remota)
+MATCH_THRESHOLD = 0.8
+# Peso del titolo nella confidenza (il resto è la similarità dell'artista)
+TITLE_WEIGHT = 0.6
+# Candidati valutati per intero dopo il filtro sui trigrammi rari
+MAX_CANDIDATES = 200
+
+# Parole che rendono "decorativo" un inciso tra parentesi o dopo " - "
+_DECORATION_WORDS = (
+    r"remaster(?:ed)?|live|feat\.?|ft\.?|featuring|with|radio edit|edit|single version|"
+    r"album version|version|versione|mono|stereo|deluxe|bonus track|demo|acoustic|from|"
+    r"original mix|explicit|clean"
+)
+_BRACKETED = re.compile(r"\s*[\(\[][^\)\]]*\b(?:%s)\b[^\)\]]*[\)\]]" % _DECORATION_WORDS, re.IGNORECASE)
+_DASH_SUFFIX = re.compile(r"\s+-\s+.*\b(?:%s)\b.*$" % _DECORATION_WORDS, re.IGNORECASE)
+_INLINE_FEAT = re.compile(r"\s+(?:feat\.?|ft\.|featuring)\s.*$", re.IGNORECASE)
+_NON_WORD = re.compile(r"[^\w\s]")
+
+
+def normalize(text):
+    """Normalizza un'etichetta per il confronto: minuscolo, senza accenti, spazi compattati."""
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    return ' '.join(text.casefold().split())
+
+
+def strip_decorations(title):
+    """
+    Toglie da un titolo Spotify gli incisi che non fanno parte del nome dell'opera:
+    'Song - Remastered 2011' -> 'Song', 'Song (feat. X) [Live]' -> 'Song'.
+    Conserva maiuscole e accenti (va bene anche per la ricerca remota).
+    """
+    text = title or ''
+    text = _BRACKETED.sub('', text)
+    text = _DASH_SUFFIX.sub('', text)
+    text = _INLINE_FEAT.sub('', text)
+    return ' '.join(text.split()) or ' '.join((title or '').split())
+
+
+def clean_title(title):
+    return ' '.join(_NON_WORD.sub(' ', normalize(strip_decorations(title))).split())
+
+
+def clean_artist(artist):
+    text = _INLINE_FEAT.sub('', artist or '')
+    return ' '.join(_NON_WORD.sub(' ', normalize(text)).split())
+
+
+def trigrams(text):
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def similarity(a, b):
+    """Coefficiente di Dice sui trigrammi (1.0 = identici)."""
+    if not a or not b:
+        return 0.0
+    return 2 * len(a & b) / (len(a) + len(b))
+
+
+class TrackMatcher:
+    """
+    Indice invertito trigramma -> titoli. Per ogni ricerca si usano solo i
+    trigrammi più rari del titolo per trovare i candidati (un titolo molto
+    simile ne condivide per forza almeno uno), poi si calcola la confidenza
+    esatta combinando la similarità del titolo e quella dell'interprete.
+    """
+
+    def __init__(self, threshold=MATCH_THRESHOLD):
+        self.threshold = threshold
+        self.titles = []         # [(titolo ripulito, qid brano)]
+        self.grams = {}          # trigramma -> [indice in self.titles]
+        self.performers = {}     # qid brano -> [qid interprete]
+        self.artist_names = {}   # qid interprete -> [nome ripulito]
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_store(cls, store, threshold=MATCH_THRESHOLD):
+        matcher = cls(threshold)
+        for qid, norm in store.song_names():
+            matcher.add_title(qid, norm)
+        for song, artist in store.performer_links():
+            matcher.performers.setdefault(song, []).append(artist)
+        for qid, norm in store.performer_names():
+            matcher.add_artist_name(qid, norm)
+        return matcher
+
+    # --- Costruzione --------------------------------------------------------
+
+    def add_title(self, qid, label):
+        title = clean_title(label)
+        if not title:
+            return
+        with self._lock:
+            idx = len(self.titles)
+            self.titles.append((title, qid))
+            for g in trigrams(title):
+                self.grams.setdefault(g, []).append(idx)
+
+    def add_artist_name(self, qid, label):
+        name = clean_artist(label)
+        if name:
+            names = self.artist_names.setdefault(qid, [])
+            if name not in names:
+                names.append(name)
+
+    # --- Ricerca ------------------------------------------------------------
+
+    def match(self, title, artist):
+        """
+        Miglior abbinamento: (qid brano, qid interprete, confidenza) oppure None.
+        La soglia non viene applicata qui: decide il chiamante.
+        """
+        query_title = clean_title(title)
+        query_artist = trigrams(clean_artist(artist))
+        query_grams = trigrams(query_title)
+        if not query_title:
+            return None
+
+        best = None
+        for idx in self._candidates(query_grams):
+            candidate, song = self.titles[idx]
+            title_sim = similarity(query_grams, trigrams(candidate))
+            # Anche con l'artista perfetto non si arriverebbe alla soglia
+            if TITLE_WEIGHT * title_sim + (1 - TITLE_WEIGHT) < self.threshold:
+                continue
+            for performer in self.performers.get(song, ()):
+                artist_sim = max((similarity(query_artist, trigrams(n))
+                                  for n in self.artist_names.get(performer, ())), default=0.0)
+                score = TITLE_WEIGHT * title_sim + (1 - TITLE_WEIGHT) * artist_sim
+                if best is None or score > best[2]:
+                    best = (song, performer, score)
+        return best
+
+    def _candidates(self, query_grams):
+        # Trigrammi in ordine di rarità: bastano i primi metà+1 per non perdere i titoli simili
+        postings = sorted((self.grams.get(g, ()) for g in query_grams), key=len)
+        postings = postings[:len(postings) // 2 + 1]
+        hits = {}
+        for posting in postings:
+            for idx in posting:
+                hits[idx] = hits.get(idx, 0) + 1
+        return heapq.nlargest(MAX_CANDIDATES, hits, key=hits.get)
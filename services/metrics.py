@@ -0,0 +1,320 @@
+"""
+Metriche in formato Prometheus, log strutturati e profilazione per richiesta.
+
+Tutto in-process e senza dipendenze: ogni worker espone i propri valori su
+/metrics (Prometheus li aggrega per istanza). Le chiamate a Wikidata e Spotify
+vengono misurate a due livelli:
+  - metodo di WikiAgent / SpotifyHandler (cache compresa), con @instrumented
+  - singola richiesta HTTP verso l'upstream, con observe_upstream()
+e, durante una richiesta web, finiscono anche nel log JSON della richiesta.
+"""
+import contextvars
+import cProfile
+import functools
+import inspect
+import io
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+
+# Bucket (secondi) adatti sia alle hit di cache sia alle query SPARQL lente
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+# Metodo di WikiAgent/SpotifyHandler in corso (etichetta delle richieste HTTP a monte)
+current_call = contextvars.ContextVar('current_call', default='unknown')
+# Chiamate a monte della richiesta web in corso (None fuori da una richiesta)
+_request_spans = contextvars.ContextVar('request_spans', default=None)
+
+
+class _Histogram:
+    __slots__ = ('buckets', 'counts', 'total', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.total += value
+        self.count += 1
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}      # (nome, etichette) -> valore
+        self._histograms = {}    # (nome, etichette) -> _Histogram
+        self._help = {}
+        self._collectors = []
+
+    def describe(self, name, kind, help_text):
+        self._help[name] = (kind, help_text)
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            hist = self._histograms.get(key)
+            if hist is None:
+                hist = self._histograms[key] = _Histogram(buckets)
+            hist.observe(value)
+
+    def register_collector(self, collector):
+        """
+        `collector()` restituisce campioni calcolati al momento dello scrape:
+        tuple (nome, tipo, help, etichette, valore). Serve per le statistiche
+        già tenute dai servizi (cache, single-flight, prewarm).
+        """
+        self._collectors.append(collector)
+
+    def render(self):
+        """Testo nel formato di esposizione di Prometheus (0.0.4)."""
+        families = {}
+        with self._lock:
+            for (name, labels), value in self._counters.items():
+                families.setdefault(name, []).append((name, labels, value))
+            for (name, labels), hist in self._histograms.items():
+                samples = families.setdefault(name, [])
+                cumulative = 0
+                for bound, count in zip(hist.buckets, hist.counts):
+                    cumulative += count
+                    samples.append((f"{name}_bucket", labels + (('le', _fmt(bound)),), cumulative))
+                samples.append((f"{name}_bucket", labels + (('le', '+Inf'),), hist.count))
+                samples.append((f"{name}_sum", labels, hist.total))
+                samples.append((f"{name}_count", labels, hist.count))
+
+        for collector in self._collectors:
+            try:
+                for name, kind, help_text, labels, value in collector():
+                    self._help.setdefault(name, (kind, help_text))
+                    families.setdefault(name, []).append((name, tuple(sorted(labels.items())), value))
+            except Exception as e:
+                print(f"⚠️ Collector metriche fallito: {e}")
+
+        lines = []
+        for name in sorted(families):
+            kind, help_text = self._help.get(name, ('untyped', ''))
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for sample, labels, value in families[name]:
+                lines.append(f"{sample}{_fmt_labels(labels)} {_fmt(value)}")
+        return '\n'.join(lines) + '\n'
+
+
+def _fmt(value):
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def _fmt_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in labels)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(labels, escaped)) + '}'
+
+
+REGISTRY = MetricsRegistry()
+REGISTRY.describe('app_http_requests_total', 'counter', 'Richieste web servite, per route e stato.')
+REGISTRY.describe('app_http_request_duration_seconds', 'histogram', 'Durata delle richieste web.')
+REGISTRY.describe('app_http_response_size_bytes', 'histogram', 'Dimensione delle risposte (non in streaming).')
+REGISTRY.describe('app_template_render_seconds', 'histogram', 'Tempo di rendering dei template.')
+REGISTRY.describe('app_service_call_duration_seconds', 'histogram',
+                  'Durata dei metodi di WikiAgent e SpotifyHandler (cache compresa).')
+REGISTRY.describe('app_service_call_errors_total', 'counter', 'Eccezioni sollevate dai metodi instrumentati.')
+REGISTRY.describe('app_upstream_request_duration_seconds', 'histogram',
+                  'Durata delle singole richieste HTTP verso Wikidata e Spotify.')
+REGISTRY.describe('app_upstream_response_size_bytes', 'histogram', 'Dimensione delle risposte degli upstream.')
+REGISTRY.describe('app_upstream_errors_total', 'counter', 'Errori e timeout delle richieste agli upstream.')
+REGISTRY.describe('app_upstream_retries_total', 'counter', 'Nuovi tentativi verso gli upstream (429/5xx).')
+
+
+# --- Instrumentazione -------------------------------------------------------
+
+def instrumented(service):
+    """
+    Decoratore per i metodi pubblici di WikiAgent/SpotifyHandler (sync e async):
+    misura la durata e imposta `current_call`, così le richieste HTTP fatte
+    al suo interno vengono etichettate con il nome del metodo.
+    """
+    def decorate(fn):
+        is_async = inspect.iscoroutinefunction(fn)
+        # La variante async (aget_x) condivide le serie della sincrona (get_x)
+        call = fn.__name__[1:] if is_async and fn.__name__.startswith('a') else fn.__name__
+
+        if is_async:
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                token = current_call.set(call)
+                start = time.perf_counter()
+                outcome = 'ok'
+                try:
+                    return await fn(*args, **kwargs)
+                except BaseException:
+                    outcome = 'error'
+                    raise
+                finally:
+                    current_call.reset(token)
+                    _record_call(service, call, time.perf_counter() - start, outcome)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            token = current_call.set(call)
+            start = time.perf_counter()
+            outcome = 'ok'
+            try:
+                return fn(*args, **kwargs)
+            except BaseException:
+                outcome = 'error'
+                raise
+            finally:
+                current_call.reset(token)
+                _record_call(service, call, time.perf_counter() - start, outcome)
+        return wrapper
+    return decorate
+
+
+def _record_call(service, call, seconds, outcome):
+    REGISTRY.observe('app_service_call_duration_seconds', seconds, service=service, call=call)
+    if outcome != 'ok':
+        REGISTRY.inc('app_service_call_errors_total', service=service, call=call)
+    spans = _request_spans.get()
+    if spans is not None:
+        spans.append({'service': service, 'call': call, 'ms': round(seconds * 1000, 2), 'outcome': outcome})
+
+
+def observe_upstream(service, seconds, status=None, size=None, error=None, call=None):
+    """
+    Una richiesta HTTP verso un upstream: durata, dimensione ed eventuale errore
+    ('timeout'/'connection'). Senza `call` si usa il metodo instrumentato in corso.
+    """
+    call = call or current_call.get()
+    REGISTRY.observe('app_upstream_request_duration_seconds', seconds, service=service, call=call)
+    if size is not None:
+        REGISTRY.observe('app_upstream_response_size_bytes', size, buckets=SIZE_BUCKETS, service=service)
+    if error is not None or (status is not None and status >= 400):
+        REGISTRY.inc('app_upstream_errors_total', service=service, call=call,
+                     type=error or f"http_{status}")
+
+
+def count_retry(service, status):
+    REGISTRY.inc('app_upstream_retries_total', service=service, status=str(status))
+
+
+def stats_samples(name, stats, help_text, **labels):
+    """Contatori già tenuti da un servizio (dizionario nome -> valore) come campioni per un collector."""
+    for stat, value in stats.items():
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield name, 'gauge', help_text, dict(labels, stat=stat), value
+
+
+def hit_ratio(stats):
+    """Frazione di letture servite dalla cache (le hit stale contano come hit)."""
+    hits = stats.get('hits', 0) + stats.get('stale_hits', 0)
+    total = hits + stats.get('misses', 0)
+    return round(hits / total, 4) if total else 0.0
+
+
+# --- Richieste web ----------------------------------------------------------
+
+class RequestTimer:
+    """Stato di una richiesta web: tempi, chiamate a monte ed eventuale profiler."""
+
+    def __init__(self, profile=False):
+        self.started = time.perf_counter()
+        self.spans = []
+        self._token = _request_spans.set(self.spans)
+        self.profiler = None
+        if profile:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+    def finish(self, route, method, status, size=None, path=None):
+        """Registra la richiesta; restituisce il percorso del profilo salvato (o None)."""
+        seconds = time.perf_counter() - self.started
+        try:
+            _request_spans.reset(self._token)
+        except ValueError:
+            # Hook eseguito in un contesto diverso da quello di apertura
+            _request_spans.set(None)
+        REGISTRY.inc('app_http_requests_total', route=route, method=method, status=str(status))
+        REGISTRY.observe('app_http_request_duration_seconds', seconds, route=route)
+        if size is not None:
+            REGISTRY.observe('app_http_response_size_bytes', size, buckets=SIZE_BUCKETS, route=route)
+
+        profile_file = None
+        if self.profiler is not None:
+            self.profiler.disable()
+            profile_file = dump_profile(self.profiler, route)
+
+        log_event('request', method=method, route=route, path=path, status=status,
+                  duration_ms=round(seconds * 1000, 2), size=size, upstream=self.spans,
+                  profile=profile_file)
+        return profile_file
+
+
+def observe_render(template, seconds):
+    REGISTRY.observe('app_template_render_seconds', seconds, template=template)
+
+
+# --- Log strutturati --------------------------------------------------------
+
+_log_lock = threading.Lock()
+
+
+def json_logs_enabled():
+    return os.environ.get('LOG_FORMAT', '').lower() == 'json'
+
+
+def log_event(event, **fields):
+    """Una riga JSON per evento (LOG_FORMAT=json), su LOG_FILE o stderr."""
+    if not json_logs_enabled():
+        return
+    record = {'ts': round(time.time(), 3), 'event': event}
+    record.update((k, v) for k, v in fields.items() if v is not None)
+    line = json.dumps(record, ensure_ascii=False, default=str)
+    path = os.environ.get('LOG_FILE')
+    with _log_lock:
+        if path:
+            with open(path, 'a', encoding='utf-8') as f:
+                f.write(line + '\n')
+        else:
+            sys.stderr.write(line + '\n')
+
+
+# --- Profilazione -----------------------------------------------------------
+
+def profiling_enabled():
+    """L'header X-Profile viene onorato solo con PROFILE_REQUESTS=1."""
+    return os.environ.get('PROFILE_REQUESTS') == '1'
+
+
+def dump_profile(profiler, route, top=25):
+    """
+    Salva il profilo (.prof, apribile con snakeviz o flameprof per il flame graph)
+    e stampa le funzioni più costose per tempo cumulativo.
+    """
+    directory = os.environ.get('PROFILE_DIR', os.path.join('/tmp', 'app-profiles'))
+    os.makedirs(directory, exist_ok=True)
+    name = route.strip('/').replace('/', '_') or 'root'
+    path = os.path.join(directory, f"{time.strftime('%Y%m%d-%H%M%S')}-{name}-{os.getpid()}.prof")
+    profiler.dump_stats(path)
+
+    out = io.StringIO()
+    pstats.Stats(profiler, stream=out).strip_dirs().sort_stats('cumulative').print_stats(top)
+    print(f"🔬 Profilo {route} salvato in {path}\n{out.getvalue()}")
+    return path
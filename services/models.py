@@ -0,0 +1,159 @@
+"""
+Modelli compatti per brani, dettagli e consigliati.
+
+Classi con __slots__ (niente __dict__ per istanza) e stringhe ripetute
+(artisti, album, generi, tipi di consigliato) internate, così playlist grandi
+e voci di cache occupano una frazione della memoria dei dizionari.
+Ogni modello si serializza come lista posizionale (`to_row`/`from_row`):
+è il formato delle cache (JSON su Redis e su disco), più corto di un oggetto
+con i nomi dei campi ripetuti. `to_dict` serve per le risposte JSON.
+"""
+import copy
+import sys
+
+PLACEHOLDER_COVER = "https://via.placeholder.com/150"
+
+# Versione del formato delle voci di cache (fa parte delle chiavi, vedi
+# TieredCache.make_key): va incrementata quando cambia la forma dei valori
+# salvati, così le voci scritte dal deploy precedente su Redis vengono ignorate.
+SCHEMA_VERSION = 2
+
+
+def _intern(text):
+    return sys.intern(text) if isinstance(text, str) else text
+
+
+class _Model:
+    __slots__ = ()
+
+    def to_row(self):
+        return [getattr(self, name) for name in self.__slots__]
+
+    @classmethod
+    def from_row(cls, row):
+        # I file scritti prima dei modelli contengono dizionari
+        if isinstance(row, dict):
+            return cls.from_dict(row)
+        return cls(*row)
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**{k: v for k, v in data.items() if k in cls.__slots__})
+
+    def copy(self):
+        return copy.copy(self)
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self.to_row() == other.to_row()
+
+    def __repr__(self):
+        fields = ', '.join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"{type(self).__name__}({fields})"
+
+
+class Track(_Model):
+    """Brano di una playlist (già ripulito dai dati grezzi di Spotify)."""
+    __slots__ = ('title', 'artist', 'album', 'cover', 'id', 'wikidata_id', 'wikidata_artist_id', 'resolved')
+
+    def __init__(self, title, artist, album, cover='', id=None, wikidata_id=None,
+                 wikidata_artist_id=None, resolved=False):
+        self.title = title
+        self.artist = _intern(artist)
+        self.album = _intern(album)
+        self.cover = cover
+        self.id = id
+        self.wikidata_id = wikidata_id
+        self.wikidata_artist_id = wikidata_artist_id
+        self.resolved = resolved
+
+
+class ArtistRef(_Model):
+    """Interprete di un brano: nome ed entità Wikidata ('' o None se sconosciuta)."""
+    __slots__ = ('name', 'url')
+
+    def __init__(self, name, url):
+        self.name = _intern(name)
+        self.url = _intern(url)
+
+
+class Recommendation(_Model):
+    __slots__ = ('title', 'artist', 'type', 'image', 'url', 'artist_url')
+
+    def __init__(self, title, artist, type, image=PLACEHOLDER_COVER, url=None, artist_url=None):
+        self.title = title
+        self.artist = _intern(artist)
+        self.type = _intern(type)
+        self.image = image
+        self.url = url
+        self.artist_url = _intern(artist_url)
+
+
+class TrackDetails(_Model):
+    """
+    Scheda di un brano come la usa track.html. `recommendations` viene
+    riempito dalla route (non fa parte del valore in cache).
+    """
+    __slots__ = ('found', 'wikidata_url', 'title', 'image', 'date', 'genres', 'producers', 'awards',
+                 'artisti_list', 'recommendations')
+
+    def __init__(self, found=False, wikidata_url=None, title=None, image=None, date='N/D', genres='N/D',
+                 producers='N/D', awards='Nessuno', artisti_list=None, recommendations=None):
+        self.found = found
+        self.wikidata_url = wikidata_url
+        self.title = title
+        self.image = image
+        self.date = date
+        self.genres = _intern(genres)
+        self.producers = producers
+        self.awards = awards
+        self.artisti_list = [a if isinstance(a, ArtistRef) else ArtistRef.from_row(a)
+                             for a in artisti_list or []]
+        self.recommendations = [r if isinstance(r, Recommendation) else Recommendation.from_row(r)
+                                for r in recommendations or []]
+
+    @classmethod
+    def not_found(cls, artist=None):
+        """Scheda vuota; con `artist` mostra comunque il nome dell'interprete."""
+        return cls(artisti_list=[ArtistRef(artist, None)] if artist else None)
+
+    def to_row(self):
+        row = super().to_row()
+        row[-2] = [a.to_row() for a in self.artisti_list]
+        row[-1] = [r.to_row() for r in self.recommendations]
+        return row
+
+    def to_dict(self):
+        data = super().to_dict()
+        data['artisti_list'] = [a.to_dict() for a in self.artisti_list]
+        data['recommendations'] = [r.to_dict() for r in self.recommendations]
+        return data
+
+    def copy(self):
+        # Le liste sono per copia: la route aggiunge i consigliati senza toccare la cache
+        details = copy.copy(self)
+        details.artisti_list = list(self.artisti_list)
+        details.recommendations = list(self.recommendations)
+        return details
+
+
+# --- Codifica nelle cache ---------------------------------------------------
+
+MODELS = {cls.__name__: cls for cls in (Track, ArtistRef, Recommendation, TrackDetails)}
+
+
+def encode(value):
+    """`default` per json.dumps: un modello diventa {"__m": nome, "r": riga}."""
+    if isinstance(value, _Model):
+        return {'__m': type(value).__name__, 'r': value.to_row()}
+    raise TypeError(f"Oggetto non serializzabile: {type(value).__name__}")
+
+
+def decode(data):
+    """`object_hook` per json.loads, inverso di encode."""
+    model = data.get('__m') if len(data) == 2 else None
+    if model in MODELS:
+        return MODELS[model].from_row(data['r'])
+    return data
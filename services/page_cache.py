@@ -0,0 +1,140 @@
+"""
+Cache delle pagine renderizzate (/track, /artista) con risposte HTTP condizionali.
+
+Le due pagine dipendono solo dai parametri della query e dai dati di Wikidata:
+l'HTML renderizzato viene salvato (già compresso gzip e, se installato il
+pacchetto `brotli`, br) in una LRU in-process indicizzata sui parametri
+normalizzati. Una visita ripetuta non esegue né query né template.
+
+Ogni risposta porta ETag, Last-Modified e Cache-Control `public`, così anche
+un reverse proxy o una CDN davanti all'app possono servirla; le richieste
+condizionali (If-None-Match / If-Modified-Since) ricevono 304 senza corpo.
+
+Configurazione: PAGE_CACHE_SIZE (pagine in memoria, 0 = cache disattivata),
+PAGE_CACHE_TTL (secondi di validità, anche per max-age).
+"""
+import gzip
+import hashlib
+import os
+import threading
+import time
+from urllib.parse import urlencode
+
+from werkzeug.http import http_date
+
+from services.cache import TieredCache
+
+try:
+    import brotli
+except ImportError:  # facoltativo: senza brotli si serve solo gzip
+    brotli = None
+
+
+class RenderedPage:
+    """Una pagina pronta da servire: HTML, varianti compresse e validatori."""
+    __slots__ = ('body', 'encoded', 'etag', 'last_modified', 'cacheable')
+
+    def __init__(self, html, cacheable=True):
+        self.body = html.encode('utf-8')
+        self.etag = hashlib.sha1(self.body).hexdigest()[:20]
+        self.last_modified = int(time.time())
+        self.cacheable = cacheable
+        # Compressione una volta sola, al render: le visite successive servono i byte pronti
+        self.encoded = {}
+        compressed = gzip.compress(self.body, compresslevel=6)
+        if len(compressed) < len(self.body):
+            self.encoded['gzip'] = compressed
+        if brotli is not None:
+            compressed = brotli.compress(self.body, quality=5)
+            if len(compressed) < len(self.body):
+                self.encoded['br'] = compressed
+
+    def tag(self, encoding=None):
+        # ETag forte diverso per ogni codifica, come richiesto da RFC 9110
+        return f"{self.etag}-{encoding}" if encoding else self.etag
+
+
+class PageCache:
+    def __init__(self, max_entries=256, ttl=600):
+        self.ttl = ttl
+        self.enabled = max_entries > 0
+        # Solo LRU locale e niente stale-while-revalidate: il render richiede il contesto della richiesta
+        self.pages = TieredCache(max_entries=max(max_entries, 1), ttls={'page': ttl},
+                                stale_ttl=0, prefix='page')
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'not_modified': 0, 'uncacheable': 0}
+
+    @classmethod
+    def from_env(cls):
+        return cls(max_entries=int(os.environ.get('PAGE_CACHE_SIZE', 256)),
+                   ttl=int(os.environ.get('PAGE_CACHE_TTL', 600)))
+
+    def key(self, route, args):
+        """Chiave sui parametri normalizzati: ordine, spazi e parametri vuoti non contano."""
+        items = sorted((k, ' '.join(v.split())) for k, v in args.items() if v and v.strip())
+        digest = hashlib.sha1(urlencode(items).encode('utf-8')).hexdigest()
+        return self.pages.make_key('page', route, digest)
+
+    def lookup(self, route, args):
+        """(chiave, pagina in cache o None)."""
+        key = self.key(route, args)
+        page = self.pages.get(key) if self.enabled else None
+        self._incr('hits' if page is not None else 'misses')
+        return key, page
+
+    def store(self, key, html, cacheable=True):
+        """Prepara la pagina e la salva se `cacheable` (le pagine parziali non vanno in cache)."""
+        page = RenderedPage(html, cacheable)
+        if not cacheable:
+            self._incr('uncacheable')
+        elif self.enabled:
+            self.pages.set('page', key, page)
+        return page
+
+    def respond(self, page, request, response_class):
+        """Risposta per `request`: 304 se il client ha già questa versione, altrimenti il corpo compresso."""
+        encoding = self._negotiate(page, request)
+        headers = {
+            'ETag': f'"{page.tag(encoding)}"',
+            'Last-Modified': http_date(page.last_modified),
+            'Vary': 'Accept-Encoding',
+            'Cache-Control': (f"public, max-age={self.ttl}, stale-while-revalidate={self.ttl}"
+                              if page.cacheable else 'no-cache'),
+        }
+        if self._not_modified(page, request):
+            self._incr('not_modified')
+            return response_class(b'', status=304, headers=headers)
+        if encoding:
+            headers['Content-Encoding'] = encoding
+        return response_class(page.encoded.get(encoding, page.body), status=200, headers=headers,
+                              content_type='text/html; charset=utf-8')
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        cache = self.pages.stats()
+        stats['size'] = cache['size']
+        stats['evictions'] = cache['evictions']
+        return stats
+
+    # --- Interni ------------------------------------------------------------
+
+    @staticmethod
+    def _negotiate(page, request):
+        accepted = request.accept_encodings
+        for encoding in ('br', 'gzip'):
+            if encoding in page.encoded and accepted[encoding] > 0:
+                return encoding
+        return None
+
+    @staticmethod
+    def _not_modified(page, request):
+        if request.if_none_match:
+            # Qualsiasi codifica della stessa versione va bene (un proxy può averla ricompressa)
+            return any(request.if_none_match.contains_weak(page.tag(e)) for e in (None, 'gzip', 'br'))
+        since = request.if_modified_since
+        return since is not None and page.last_modified <= since.timestamp()
+
+    def _incr(self, name):
+        with self._lock:
+            self._stats[name] += 1
@@ -0,0 +1,211 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+from services.models import Track
+
+# Formato dei file: dalla versione 2 le voci scartate (file locali, podcast) sono
+# righe `null`, così le posizioni nel file coincidono con quelle di Spotify
+FORMAT_VERSION = 2
+
+# Un .tmp fermo da più di tanti secondi è di uno scrittore morto (crash, kill del
+# worker): nessuno lo completerà, _evict lo rimuove
+TMP_GRACE = 3600
+
+
+class _SnapshotWriter:
+    """Scrive le pagine su un file temporaneo; diventa visibile solo con commit()."""
+
+    def __init__(self, cache, playlist_id, snapshot_id):
+        self.cache = cache
+        self.playlist_id = playlist_id
+        self.snapshot_id = snapshot_id
+        self.path = cache.path_for(playlist_id, snapshot_id)
+        self.tmp_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        self.f = open(self.tmp_path, 'w', encoding='utf-8')
+
+    def write(self, page):
+        """Salva una pagina di Spotify; None (voce scartata) diventa una riga `null`."""
+        for track in page:
+            # Riga posizionale: niente nomi dei campi ripetuti per ogni brano
+            row = track.to_row() if track is not None else None
+            self.f.write(json.dumps(row, ensure_ascii=False, separators=(',', ':')))
+            self.f.write('\n')
+
+    def commit(self):
+        self.f.close()
+        os.replace(self.tmp_path, self.path)
+        self.cache._committed(self.playlist_id, self.path)
+
+    def abort(self):
+        self.f.close()
+        try:
+            os.remove(self.tmp_path)
+        except OSError:
+            pass
+
+
+class PlaylistSnapshotCache:
+    """
+    Cache su disco delle playlist già analizzate, una per (playlist, snapshot_id).
+    Spotify cambia lo snapshot_id a ogni modifica della playlist: se è lo stesso,
+    la lista dei brani è identica e non serve riscaricarla.
+    Formato: JSON-lines, un brano per riga (lettura in streaming, pagina per pagina).
+    """
+
+    def __init__(self, directory, max_entries=200, max_age=7 * 24 * 3600,
+                 max_bytes=200 * 1024 * 1024, page_size=100, tmp_grace=TMP_GRACE):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        self.tmp_grace = tmp_grace
+        self.page_size = page_size
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'writes': 0, 'evictions': 0, 'errors': 0}
+        os.makedirs(directory, exist_ok=True)
+
+    @classmethod
+    def from_env(cls, default_dir):
+        env = os.environ
+        return cls(
+            env.get('SPOTIFY_SNAPSHOT_DIR', default_dir),
+            max_entries=int(env.get('SPOTIFY_SNAPSHOT_MAX_ENTRIES', 200)),
+            max_age=float(env.get('SPOTIFY_SNAPSHOT_MAX_AGE', 7 * 24 * 3600)),
+            max_bytes=int(env.get('SPOTIFY_SNAPSHOT_MAX_BYTES', 200 * 1024 * 1024)),
+            tmp_grace=float(env.get('SPOTIFY_SNAPSHOT_TMP_GRACE', TMP_GRACE)),
+        )
+
+    def path_for(self, playlist_id, snapshot_id):
+        digest = hashlib.sha1(snapshot_id.encode('utf-8')).hexdigest()[:16]
+        return os.path.join(self.directory, f"{playlist_id}_{digest}.v{FORMAT_VERSION}.jsonl")
+
+    def get_pages(self, playlist_id, snapshot_id):
+        """Generatore di pagine dalla cache, oppure None se lo snapshot non è salvato (o è scaduto)."""
+        f = self._open(playlist_id, snapshot_id)
+        return self._read_pages(f) if f is not None else None
+
+    def get_window(self, playlist_id, snapshot_id, offset, limit):
+        """
+        (brani in [offset, offset + limit), totale) dallo snapshot salvato, oppure None.
+        Posizioni e totale sono quelli di Spotify: le righe `null` contano ma non
+        vengono restituite. Si decodificano solo le righe della finestra.
+        """
+        f = self._open(playlist_id, snapshot_id)
+        if f is None:
+            return None
+        tracks = []
+        total = 0
+        with f:
+            for total, line in enumerate(f, 1):
+                if offset < total <= offset + limit:
+                    row = json.loads(line)
+                    if row is not None:
+                        tracks.append(Track.from_row(row))
+        return tracks, total
+
+    def writer(self, playlist_id, snapshot_id):
+        return _SnapshotWriter(self, playlist_id, snapshot_id)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+    # --- Interni ------------------------------------------------------------
+
+    def _open(self, playlist_id, snapshot_id):
+        """
+        File dello snapshot già aperto, oppure None. Chi legge usa il file aperto:
+        se un altro processo lo rimuove (eviction) o lo sostituisce (os.replace)
+        dopo il controllo, la lettura prosegue sul contenuto originale.
+        """
+        path = self.path_for(playlist_id, snapshot_id)
+        try:
+            f = open(path, encoding='utf-8')
+        except OSError:
+            self._incr('misses')
+            return None
+        try:
+            if time.time() - os.fstat(f.fileno()).st_mtime > self.max_age:
+                f.close()
+                self._remove(path)
+                self._incr('misses')
+                return None
+            # L'accesso rinnova la voce (eviction LRU sulla data di modifica)
+            os.utime(path)
+        except OSError:
+            # Rimosso tra l'apertura e il rinnovo: come se non ci fosse
+            f.close()
+            self._incr('misses')
+            return None
+        self._incr('hits')
+        return f
+
+    def _read_pages(self, f):
+        page = []
+        with f:
+            for line in f:
+                row = json.loads(line)
+                if row is None:
+                    continue
+                page.append(Track.from_row(row))
+                if len(page) >= self.page_size:
+                    yield page
+                    page = []
+        if page:
+            yield page
+
+    def _committed(self, playlist_id, path):
+        self._incr('writes')
+        # Gli snapshot precedenti della stessa playlist non serviranno più
+        prefix = f"{playlist_id}_"
+        for name in os.listdir(self.directory):
+            full = os.path.join(self.directory, name)
+            if name.startswith(prefix) and name.endswith('.jsonl') and full != path:
+                self._remove(full)
+        self._evict()
+
+    def _evict(self):
+        entries = []
+        total_bytes = 0
+        now = time.time()
+        for name in os.listdir(self.directory):
+            if not name.endswith(('.jsonl', '.tmp')):
+                continue
+            full = os.path.join(self.directory, name)
+            try:
+                st = os.stat(full)
+            except OSError:
+                continue
+            if name.endswith('.tmp'):
+                # Scrittura in corso: occupa spazio ma non si tocca; orfano: si rimuove
+                if now - st.st_mtime > self.tmp_grace:
+                    self._remove(full)
+                else:
+                    total_bytes += st.st_size
+                continue
+            entries.append((st.st_mtime, st.st_size, full))
+
+        # Dalla meno recente: scadute, poi oltre il numero massimo o la dimensione totale
+        entries.sort()
+        total_bytes += sum(size for _, size, _ in entries)
+        count = len(entries)
+        for mtime, size, full in entries:
+            if now - mtime <= self.max_age and count <= self.max_entries and total_bytes <= self.max_bytes:
+                break
+            self._remove(full)
+            count -= 1
+            total_bytes -= size
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+            self._incr('evictions')
+        except OSError:
+            self._incr('errors')
+
+    def _incr(self, name):
+        with self._lock:
+            self._stats[name] += 1
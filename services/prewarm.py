@@ -0,0 +1,157 @@
+import os
+import queue
+import threading
+import time
+from collections import deque
+
+# Coppie per ogni job di risoluzione (una query batch ciascuno)
+RESOLVE_CHUNK = 50
+# Campioni tenuti per le statistiche di latenza
+LATENCY_SAMPLES = 500
+
+
+class Prewarmer:
+    """
+    Worker in background che arricchisce le playlist prima dei click:
+    risoluzione batch su Wikidata, poi dettagli brano, artisti e consigliati
+    (una query combinata per brano, vedi WikiAgent.get_track_bundle).
+    I risultati finiscono nella cache di WikiAgent, quindi il click successivo
+    su /resolve_track o /track non aspetta Wikidata.
+    """
+
+    def __init__(self, agent, workers=4, max_queue=10000):
+        self.agent = agent
+        self.queue = queue.Queue(maxsize=max_queue)
+        self._inflight = set()
+        self._lock = threading.Lock()
+        self._latency = {}
+        self._done = deque(maxlen=10000)
+        self._counters = {'enqueued': 0, 'skipped': 0, 'dropped': 0, 'completed': 0, 'failed': 0}
+        self.workers = [threading.Thread(target=self._run, daemon=True, name=f"prewarm-{i}")
+                        for i in range(workers)]
+        for t in self.workers:
+            t.start()
+
+    @classmethod
+    def from_env(cls, agent):
+        """PREWARM_WORKERS=0 disattiva il pre-riscaldamento."""
+        workers = int(os.environ.get('PREWARM_WORKERS', 4))
+        if workers <= 0:
+            return None
+        return cls(agent, workers=workers, max_queue=int(os.environ.get('PREWARM_QUEUE', 10000)))
+
+    # --- Accodamento --------------------------------------------------------
+
+    def enqueue_tracks(self, tracks):
+        """Accoda i brani di una pagina di playlist, saltando quelli già in lavorazione."""
+        pairs = []
+        with self._lock:
+            for t in tracks:
+                key = _track_key(t.title, t.artist)
+                if key in self._inflight:
+                    self._counters['skipped'] += 1
+                    continue
+                self._inflight.add(key)
+                pairs.append((t.title, t.artist))
+
+        for start in range(0, len(pairs), RESOLVE_CHUNK):
+            self._put(('resolve', pairs[start:start + RESOLVE_CHUNK]))
+
+    def _put(self, job):
+        try:
+            self.queue.put_nowait(job)
+            self._count('enqueued')
+        except queue.Full:
+            # Coda piena: il lavoro verrà fatto comunque al click, in modo lazy
+            self._count('dropped')
+            if job[0] == 'resolve':
+                self._release(job[1])
+            else:
+                self._release([job[1]])
+
+    # --- Worker -------------------------------------------------------------
+
+    def _run(self):
+        while True:
+            job = self.queue.get()
+            try:
+                if job[0] == 'resolve':
+                    self._resolve(job[1])
+                else:
+                    self._enrich(*job[1:])
+                self._count('completed')
+            except Exception as e:
+                self._count('failed')
+                print(f"⚠️ Prewarm fallito ({job[0]}): {e}")
+            finally:
+                with self._lock:
+                    self._done.append(time.monotonic())
+                self.queue.task_done()
+
+    def _resolve(self, pairs):
+        try:
+            results = self._timed('resolve', self.agent.resolve_tracks_batch, pairs)
+        except Exception:
+            self._release(pairs)
+            raise
+        for pair, res in zip(pairs, results):
+            if res and res[0]:
+                self._put(('enrich', pair, res[0], res[1]))
+            else:
+                self._release([pair])
+
+    def _enrich(self, pair, song_url, artist_url):
+        try:
+            # Dettagli, consigliati e artista principale in una sola query
+            bundle = self._timed('track_bundle', self.agent.get_track_bundle, song_url, artist_url)
+            details = bundle['track']
+            for a in details.artisti_list if details.found else []:
+                if a.url and a.url != artist_url:
+                    self._timed('artist_details', self.agent.get_artist_details, a.url)
+        finally:
+            self._release([pair])
+
+    # --- Statistiche --------------------------------------------------------
+
+    def status(self):
+        now = time.monotonic()
+        with self._lock:
+            stages = {}
+            for stage, samples in self._latency.items():
+                ordered = sorted(samples)
+                stages[stage] = {
+                    'count': len(ordered),
+                    'avg_ms': round(sum(ordered) / len(ordered) * 1000, 1),
+                    'p95_ms': round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000, 1),
+                }
+            status = dict(self._counters)
+            status['in_flight_tracks'] = len(self._inflight)
+            # Copia sotto lock: i worker aggiungono al deque mentre /metrics lo legge
+            done = list(self._done)
+        status['queue_depth'] = self.queue.qsize()
+        status['workers'] = len(self.workers)
+        status['jobs_per_min'] = sum(1 for t in done if now - t <= 60)
+        status['stages'] = stages
+        return status
+
+    def _timed(self, stage, fn, *args):
+        start = time.monotonic()
+        try:
+            return fn(*args)
+        finally:
+            elapsed = time.monotonic() - start
+            with self._lock:
+                self._latency.setdefault(stage, deque(maxlen=LATENCY_SAMPLES)).append(elapsed)
+
+    def _release(self, pairs):
+        with self._lock:
+            for title, artist in pairs:
+                self._inflight.discard(_track_key(title, artist))
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+
+def _track_key(title, artist):
+    return (' '.join((title or '').split()).lower(), ' '.join((artist or '').split()).lower())
@@ -0,0 +1,175 @@
+"""
+Indice precalcolato per i consigliati (Fan Choice e Discovery).
+
+Sostituisce la query Discovery per-richiesta con due indici invertiti in memoria:
+  - interprete -> brani
+  - genere -> brani ordinati per anno (ricerca dell'intervallo ±4 anni con bisect)
+
+L'indice si costruisce dal LocalStore (dump importato), quindi è attivo solo
+con WIKI_BACKEND=local. Con il backend remoto (default) i consigliati restano
+una query SPARQL per brano, coperta dalla cache e dal bundle di /track.
+"""
+import bisect
+import threading
+
+from services.models import Recommendation
+
+ENTITY_PREFIX = "http://www.wikidata.org/entity/"
+PLACEHOLDER_IMAGE = "https://via.placeholder.com/150"
+
+# Stessi limiti della query SPARQL originale
+FAN_CHOICE_LIMIT = 5
+DISCOVERY_LIMIT = 5
+YEAR_WINDOW = 4
+
+
+class _GenreBucket:
+    __slots__ = ('dated', 'undated')
+
+    def __init__(self):
+        self.dated = []       # [(anno, qid)] ordinata
+        self.undated = []     # [qid] senza data di pubblicazione
+
+
+def entity_url(qid):
+    return ENTITY_PREFIX + qid
+
+
+class RecommendationIndex:
+    def __init__(self, entity_url=entity_url):
+        # Da identificativo a URL nei consigliati (il dataset offline ha anche id locali)
+        self.entity_url = entity_url
+        self.songs = {}          # qid -> (label, image, year, performers, genres)
+        self.by_performer = {}   # qid interprete -> [qid brano]
+        self.by_genre = {}       # qid genere -> _GenreBucket
+        self.artist_labels = {}
+        self._lock = threading.RLock()
+
+    @classmethod
+    def from_store(cls, store):
+        index = cls()
+        index.artist_labels = store.artist_labels()
+        for record in store.song_records():
+            index.upsert(*record)
+        return index
+
+    # --- Aggiornamento ------------------------------------------------------
+
+    def upsert(self, qid, label, image, year, performers, genres):
+        """Inserisce o aggiorna un brano senza ricostruire l'indice."""
+        with self._lock:
+            self.remove(qid)
+            self.songs[qid] = (label, image, year, tuple(performers), tuple(genres))
+            for p in performers:
+                self.by_performer.setdefault(p, []).append(qid)
+            for g in genres:
+                bucket = self.by_genre.setdefault(g, _GenreBucket())
+                if year is None:
+                    bucket.undated.append(qid)
+                else:
+                    bisect.insort(bucket.dated, (year, qid))
+
+    def remove(self, qid):
+        with self._lock:
+            old = self.songs.pop(qid, None)
+            if old is None:
+                return
+            _, _, year, performers, genres = old
+            for p in performers:
+                self.by_performer[p].remove(qid)
+            for g in genres:
+                bucket = self.by_genre[g]
+                if year is None:
+                    bucket.undated.remove(qid)
+                else:
+                    i = bisect.bisect_left(bucket.dated, (year, qid))
+                    del bucket.dated[i]
+
+    def refresh(self, store, qids, chunk_size=500):
+        """Aggiornamento incrementale dei soli brani indicati (es. dopo un reimport parziale)."""
+        qids = list(qids)
+        with self._lock:
+            self.artist_labels = store.artist_labels()
+            for start in range(0, len(qids), chunk_size):
+                chunk = qids[start:start + chunk_size]
+                seen = set()
+                for record in store.song_records(chunk):
+                    self.upsert(*record)
+                    seen.add(record[0])
+                # I brani spariti dallo store escono anche dall'indice
+                for qid in set(chunk) - seen:
+                    self.remove(qid)
+
+    # --- Interrogazione -----------------------------------------------------
+
+    def recommend(self, song_qid, artist_qid, artist_url):
+        """Stessa struttura di WikiAgent.get_recommendations. None se il brano non è indicizzato."""
+        with self._lock:
+            song = self.songs.get(song_qid)
+            if song is None:
+                return None
+            _, _, year, _, genres = song
+
+            recs, seen = [], set()
+            found = 0
+            for qid in self.by_performer.get(artist_qid, ()):
+                if found >= FAN_CHOICE_LIMIT:
+                    break
+                if qid != song_qid and self._append(recs, seen, qid, "Fan Choice",
+                                                    "Stesso Artista", artist_url):
+                    found += 1
+
+            found = 0
+            for qid in self._discovery_candidates(genres, year):
+                if found >= DISCOVERY_LIMIT:
+                    break
+                performers = self.songs[qid][3]
+                if qid == song_qid or not performers or artist_qid in performers:
+                    continue
+                other = performers[0]
+                if self._append(recs, seen, qid, "Discovery",
+                                self.artist_labels.get(other) or "Artista Simile",
+                                self.entity_url(other)):
+                    found += 1
+            return recs
+
+    def _discovery_candidates(self, genres, year):
+        """Brani dei generi in comune: prima i più vicini per anno, poi quelli senza data."""
+        for g in genres:
+            bucket = self.by_genre.get(g)
+            if bucket is None:
+                continue
+            dated = bucket.dated
+            if year is None:
+                for _, qid in dated:
+                    yield qid
+            else:
+                lo = bisect.bisect_left(dated, (year - YEAR_WINDOW,))
+                hi = bisect.bisect_left(dated, (year + YEAR_WINDOW + 1,))
+                # Si parte dall'anno del brano e ci si allarga verso gli estremi
+                mid = bisect.bisect_left(dated, (year,), lo, hi)
+                left, right = mid - 1, mid
+                while left >= lo or right < hi:
+                    if right < hi and (left < lo or dated[right][0] - year <= year - dated[left][0]):
+                        yield dated[right][1]
+                        right += 1
+                    else:
+                        yield dated[left][1]
+                        left -= 1
+            yield from bucket.undated
+
+    def _append(self, recs, seen, qid, rec_type, artist_name, artist_url):
+        label, image, _, _, _ = self.songs[qid]
+        title = label or "Titolo Sconosciuto"
+        if title in seen:
+            return False
+        seen.add(title)
+        recs.append(Recommendation(
+            title=title,
+            artist=artist_name,
+            type=rec_type,
+            image=image or PLACEHOLDER_IMAGE,
+            url=self.entity_url(qid),
+            artist_url=artist_url
+        ))
+        return True
@@ -0,0 +1,123 @@
+"""
+Configurazione e servizi condivisi dalle due modalità di servizio (app.py e asgi.py).
+
+Importare il modulo non crea nulla: niente thread, pool o client. Ogni
+applicazione costruisce il proprio insieme con Services.from_env(), così
+asgi.py non importa app.py (e non si porta dietro la seconda app Flask con
+il suo executor).
+"""
+import os
+from urllib.parse import urlencode
+
+from services import metrics
+from services.fixtures import FixtureStore
+from services.image_proxy import ImageProxy
+from services.insights import PlaylistInsights
+from services.page_cache import PageCache
+from services.prewarm import Prewarmer
+from services.spotify import SpotifyHandler
+from services.spotify_auth import SPOTIFY_CLIENT_ID, SPOTIFY_CLIENT_SECRET
+from services.wiki_client import WikiAgent
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Tempo massimo (secondi) che /track aspetta Wikidata prima di rendere la pagina parziale
+TRACK_PAGE_DEADLINE = float(os.environ.get('TRACK_PAGE_DEADLINE', 8))
+# Budget (secondi) di ogni richiesta per tutte le query a Wikidata, anche quelle nei thread
+# dell'executor: oltre, le chiamate non partono e i retry si fermano (0 = nessun limite)
+REQUEST_DEADLINE = float(os.environ.get('REQUEST_DEADLINE', 10))
+# Budget delle statistiche: risolvono l'intera playlist a blocchi in parallelo; allo
+# scadere la risposta è parziale ('partial': true) e non finisce in cache
+INSIGHTS_DEADLINE = float(os.environ.get('INSIGHTS_DEADLINE', 30))
+# Route con un budget diverso da REQUEST_DEADLINE (None = nessuno: lo streaming
+# della playlist ne usa uno per pagina)
+ENDPOINT_DEADLINES = {'load': None, 'playlist_insights_api': INSIGHTS_DEADLINE}
+# Righe per richiesta dell'API della playlist (la vista a scorrimento ne chiede API_PAGE_SIZE alla volta)
+API_PAGE_SIZE = 100
+API_MAX_LIMIT = 500
+# Immagine di ripiego per i brani senza copertina (né da Spotify né da Wikidata)
+DEFAULT_TRACK_IMAGE = 'https://img.pixers.pics/pho_wat(s3:700/FO/62/54/28/58/700_FO62542858_dc0c3c4b646ab8a8a389c58f8af73ed9.jpg,700,688,cms:2018/10/5bd1b6b8d04b8_220x50-watermark.png,over,480,638,jpg)/adesivi-disco-di-vinile-isolato-su-sfondo-bianco.jpg'
+
+
+class Services:
+    """Cache, client e lavori in background di un'applicazione."""
+
+    __slots__ = ('agent', 'sp_handler', 'prewarmer', 'page_cache', 'images', 'insights')
+
+    def __init__(self, agent, sp_handler, prewarmer, page_cache, images, insights):
+        self.agent = agent
+        self.sp_handler = sp_handler
+        self.prewarmer = prewarmer
+        self.page_cache = page_cache
+        self.images = images
+        self.insights = insights
+
+    @classmethod
+    def from_env(cls):
+        # Modalità offline (OFFLINE_MODE=1): Spotify e Wikidata serviti dal dataset locale, senza rete
+        fixtures = FixtureStore.from_env()
+        agent = WikiAgent(local=fixtures, remote_fallback=False) if fixtures is not None else WikiAgent()
+        # Nessuna chiamata di rete all'avvio: il login avviene alla prima playlist richiesta
+        sp_handler = SpotifyHandler(client_id=SPOTIFY_CLIENT_ID, client_secret=SPOTIFY_CLIENT_SECRET,
+                                    fixtures=fixtures, redis_client=agent.cache.redis)
+        return cls(agent, sp_handler,
+                   # Arricchimento in background dei brani delle playlist caricate (PREWARM_WORKERS=0 lo disattiva)
+                   Prewarmer.from_env(agent),
+                   # HTML già renderizzato di /track e /artista, con ETag e 304 (PAGE_CACHE_SIZE=0 lo disattiva)
+                   PageCache.from_env(),
+                   # Copertine e foto ridimensionate, servite da /img con cache su disco (filtro `thumb` nei template)
+                   ImageProxy.from_env(os.path.join(PROJECT_ROOT, '.image_cache')),
+                   # Generi, decenni e interpreti dell'intera playlist, in cache per snapshot
+                   PlaylistInsights(agent, sp_handler))
+
+    async def aclose(self):
+        """Chiude i client httpx della modalità ASGI (after_serving)."""
+        await self.agent.aclose()
+        await self.sp_handler.aclose()
+
+    def metrics(self):
+        """Statistiche già tenute dai servizi, lette a ogni scrape di /metrics."""
+        caches = {'wikidata': self.agent.cache.stats(), 'playlist': self.sp_handler.snapshots.stats(),
+                  'page': self.page_cache.stats(), 'image': self.images.stats()}
+        for name, stats in caches.items():
+            yield from metrics.stats_samples('app_cache_events', stats, 'Contatori delle cache.', cache=name)
+            yield 'app_cache_hit_ratio', 'gauge', 'Frazione di letture servite dalla cache.', {'cache': name}, metrics.hit_ratio(stats)
+        yield from metrics.stats_samples('app_singleflight', self.agent.flight.stats(),
+                                         'Query condivise tra chiamate concorrenti.', mode='sync')
+        yield from metrics.stats_samples('app_singleflight', self.agent.aflight.stats(),
+                                         'Query condivise tra chiamate concorrenti.', mode='async')
+        if self.prewarmer is not None:
+            yield from metrics.stats_samples('app_prewarm', self.prewarmer.status(), 'Stato del prewarm in background.')
+        for call, stats in self.agent.breakers.stats().items():
+            yield from metrics.stats_samples('app_circuit_breaker', stats,
+                                             'Circuit breaker per tipo di query Wikidata (state: 0 chiuso, '
+                                             '1 half-open, 2 aperto).', call=call)
+
+    def playlist_payload(self, pid, offset, limit, window, resolve):
+        """Corpo JSON di /api/playlist: la finestra di brani e il link alla successiva."""
+        tracks, total, snapshot_id, is_demo = window
+        next_url = None
+        if offset + limit < total:
+            params = {'offset': offset + limit, 'limit': limit}
+            if snapshot_id:
+                params['snapshot'] = snapshot_id
+            if resolve:
+                params['resolve'] = 1
+            next_url = f"/api/playlist/{pid}?{urlencode(params)}"
+        return {
+            'playlist': pid,
+            'snapshot': snapshot_id,
+            'demo': is_demo,
+            'offset': offset,
+            'limit': limit,
+            'total': total,
+            'next': next_url,
+            'tracks': [dict(t.to_dict(), thumb=self.images.thumb(t.cover, 128)) for t in tracks],
+        }
+
+
+def window_args(args):
+    """offset e limit dell'API della playlist, ricondotti a valori validi."""
+    offset = max(args.get('offset', 0, type=int), 0)
+    limit = min(max(args.get('limit', API_PAGE_SIZE, type=int), 1), API_MAX_LIMIT)
+    return offset, limit
@@ -0,0 +1,155 @@
+import asyncio
+import threading
+import time
+import uuid
+
+from services import deadline
+from services.deadline import DeadlineExceeded
+
+
+class _Call:
+    __slots__ = ('event', 'result', 'error', 'waiters')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Coalescenza delle chiamate identiche concorrenti: per ogni chiave una sola
+    chiamata a monte è in corso, gli altri chiamanti ne attendono il risultato.
+
+    Con un client Redis la coalescenza vale anche tra processi: il processo che
+    ottiene il lock esegue la query, gli altri attendono che il risultato compaia
+    in cache (tramite `lookup`) o che il lock venga rilasciato.
+
+    L'attesa non supera la scadenza della richiesta (services.deadline): a budget
+    finito il chiamante riceve DeadlineExceeded, anche se la query continua.
+    """
+
+    def __init__(self, redis_client=None, lock_ttl=30.0, poll_interval=0.05):
+        self.redis = redis_client
+        self.lock_ttl = lock_ttl
+        self.poll_interval = poll_interval
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._stats = {'leaders': 0, 'shared': 0, 'remote_waits': 0}
+
+    def do(self, key, fn, lookup=None):
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                self._stats['shared'] += 1
+                leader = False
+            else:
+                call = self._calls[key] = _Call()
+                self._stats['leaders'] += 1
+                leader = True
+
+        if not leader:
+            left = deadline.check('attesa della query in corso')
+            if not call.event.wait(left):
+                raise DeadlineExceeded("scadenza della richiesta superata in attesa della query in corso")
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = self._run_across_processes(key, fn, lookup)
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['in_flight'] = len(self._calls)
+        return stats
+
+    def _run_across_processes(self, key, fn, lookup):
+        if self.redis is None:
+            return fn()
+
+        lock_key = f"lock:{key}"
+        token = uuid.uuid4().hex
+        try:
+            acquired = self.redis.set(lock_key, token, nx=True, px=int(self.lock_ttl * 1000))
+        except Exception:
+            # Redis non raggiungibile: la coalescenza resta solo nel processo
+            return fn()
+
+        if acquired:
+            try:
+                return fn()
+            finally:
+                self._release(lock_key, token)
+
+        # Un altro processo sta già interrogando Wikidata: attendiamo il suo risultato
+        with self._lock:
+            self._stats['remote_waits'] += 1
+        wait_until = time.monotonic() + self.lock_ttl
+        left = deadline.remaining()
+        if left is not None:
+            wait_until = min(wait_until, time.monotonic() + left)
+        while time.monotonic() < wait_until:
+            time.sleep(self.poll_interval)
+            if lookup is not None:
+                value = lookup()
+                if value is not None:
+                    return value
+            try:
+                if self.redis.get(lock_key) is None:
+                    break
+            except Exception:
+                break
+        deadline.check('attesa del lock di un altro processo')
+        return fn()
+
+    def _release(self, lock_key, token):
+        try:
+            current = self.redis.get(lock_key)
+            if isinstance(current, bytes):
+                current = current.decode('utf-8')
+            # Cancelliamo solo il nostro lock (potrebbe essere scaduto e ripreso da altri)
+            if current == token:
+                self.redis.delete(lock_key)
+        except Exception:
+            pass
+
+
+class AsyncSingleFlight:
+    """
+    Versione asyncio di SingleFlight per la modalità ASGI: i chiamanti concorrenti
+    nello stesso event loop attendono lo stesso task. Solo in-process.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._stats = {'leaders': 0, 'shared': 0}
+
+    async def do(self, key, afn):
+        task = self._calls.get(key)
+        if task is not None:
+            self._stats['shared'] += 1
+        else:
+            self._stats['leaders'] += 1
+            # La query gira in un task separato: se il primo chiamante viene
+            # cancellato (es. deadline superata) gli altri ne ricevono comunque il risultato
+            task = asyncio.get_running_loop().create_task(afn())
+            self._calls[key] = task
+            task.add_done_callback(lambda _: self._calls.pop(key, None))
+        return await asyncio.shield(task)
+
+    def stats(self):
+        stats = dict(self._stats)
+        stats['in_flight'] = len(self._calls)
+        return stats
@@ -0,0 +1,190 @@
+"""
+Risultati SPARQL in forma compatta: righe piatte (tuple) invece dei dizionari
+annidati di application/sparql-results+json.
+
+Con il JSON ogni cella diventa un dizionario {'type', 'value', ...} e la
+risposta intera resta in memoria due volte (testo + oggetti Python) prima di
+essere letta. Per le query con molte righe (risoluzione batch, dati della
+playlist intera) il client chiede invece TSV o CSV e le righe vengono
+decodificate man mano che arrivano dal socket: in memoria restano solo le
+tuple di stringhe.
+
+I tre formati producono le stesse righe: ogni cella è il valore lessicale
+del termine (URI senza <>, letterale senza virgolette, lingua e datatype),
+None se la variabile non è legata. Il CSV non distingue una variabile non
+legata da una stringa vuota (entrambe diventano None) e va bene solo per
+query che non hanno letterali vuoti significativi.
+"""
+import csv
+import re
+
+FORMATS = {
+    'json': 'application/sparql-results+json',
+    'tsv': 'text/tab-separated-values',
+    'csv': 'text/csv',
+}
+
+# Sequenze di escape dei letterali nel TSV (sintassi N-Triples)
+_ESCAPE = re.compile(r'\\(?:u([0-9A-Fa-f]{4})|U([0-9A-Fa-f]{8})|(.))')
+_ECHAR = {'t': '\t', 'n': '\n', 'r': '\r', 'b': '\b', 'f': '\f', '"': '"', "'": "'", '\\': '\\'}
+
+
+class ResultRows:
+    """Variabili della SELECT e righe come tuple allineate a `vars`."""
+    __slots__ = ('vars', 'rows')
+
+    def __init__(self, vars, rows):
+        self.vars = vars
+        self.rows = rows
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def column(self, name):
+        """Indice della variabile `name` nelle tuple (ValueError se la query non la restituisce)."""
+        return self.vars.index(name)
+
+
+class LineSplitter:
+    """
+    Divide un flusso di blocchi di testo in righe, solo su '\\n'.
+    (str.splitlines spezzerebbe anche su U+2028 e simili, che nel TSV
+    possono comparire non escapati dentro i letterali.) L'eventuale '\\r'
+    finale resta nella riga: nel CSV può far parte di un campo tra virgolette,
+    quindi lo toglie il parser.
+    """
+    __slots__ = ('_tail',)
+
+    def __init__(self):
+        self._tail = ''
+
+    def feed(self, chunk):
+        """Le righe complete arrivate con `chunk`."""
+        lines = (self._tail + chunk).split('\n')
+        self._tail = lines.pop()
+        return lines
+
+    def close(self):
+        tail, self._tail = self._tail, ''
+        return [tail] if tail else []
+
+
+def _unescape(match):
+    code = match.group(1) or match.group(2)
+    if code:
+        return chr(int(code, 16))
+    return _ECHAR.get(match.group(3), match.group(3))
+
+
+def decode_tsv_term(field):
+    """Valore lessicale di un termine RDF in sintassi TSV; None se vuoto (variabile non legata)."""
+    if not field:
+        return None
+    first = field[0]
+    if first == '<':
+        return field[1:-1]
+    if first == '"':
+        # Dopo l'ultima virgoletta possono esserci solo @lingua o ^^<datatype>
+        value = field[1:field.rindex('"')]
+        return _ESCAPE.sub(_unescape, value) if '\\' in value else value
+    # Numeri e booleani abbreviati (42, 1.5e3, true) e blank node (_:b0)
+    return field
+
+
+class TsvParser:
+    """Parser incrementale: una riga alla volta con feed(), le righe decodificate con result()."""
+
+    def __init__(self):
+        self.vars = None
+        self.rows = []
+
+    def feed(self, line):
+        # Nel TSV i '\r' dei letterali sono escapati: uno finale è solo il fine riga CRLF
+        if line.endswith('\r'):
+            line = line[:-1]
+        if self.vars is None:
+            self.vars = [h.lstrip('?$') for h in line.split('\t')] if line else []
+            return
+        if not line:
+            return
+        fields = line.split('\t')
+        if len(fields) < len(self.vars):
+            fields += [''] * (len(self.vars) - len(fields))
+        self.rows.append(tuple(map(decode_tsv_term, fields)))
+
+    def result(self):
+        return ResultRows(self.vars or [], self.rows)
+
+
+class CsvParser:
+    """
+    Come TsvParser per il CSV (RFC 4180). Un campo tra virgolette può andare a
+    capo: le righe si accumulano finché le virgolette non sono bilanciate, con
+    il loro '\\r' (un CRLF dentro il campo resta CRLF; quello di fine record
+    lo scarta il modulo csv).
+    """
+
+    def __init__(self):
+        self.vars = None
+        self.rows = []
+        self._pending = None
+
+    def feed(self, line):
+        if self._pending is not None:
+            line = self._pending + '\n' + line
+        if line.count('"') % 2:
+            self._pending = line
+            return
+        self._pending = None
+        record = next(csv.reader([line]), [])
+        if self.vars is None:
+            self.vars = record
+            return
+        if not record:
+            return
+        if len(record) < len(self.vars):
+            record += [''] * (len(self.vars) - len(record))
+        self.rows.append(tuple(value or None for value in record))
+
+    def result(self):
+        return ResultRows(self.vars or [], self.rows)
+
+
+PARSERS = {'tsv': TsvParser, 'csv': CsvParser}
+
+
+def parse_stream(fmt, chunks):
+    """ResultRows da un iterabile di blocchi di testo TSV o CSV (es. iter_content della risposta)."""
+    parser = PARSERS[fmt]()
+    splitter = LineSplitter()
+    for chunk in chunks:
+        for line in splitter.feed(chunk):
+            parser.feed(line)
+    for line in splitter.close():
+        parser.feed(line)
+    return parser.result()
+
+
+async def aparse_stream(fmt, chunks):
+    """Come parse_stream, per un iterabile asincrono (es. aiter_text di httpx)."""
+    parser = PARSERS[fmt]()
+    splitter = LineSplitter()
+    async for chunk in chunks:
+        for line in splitter.feed(chunk):
+            parser.feed(line)
+    for line in splitter.close():
+        parser.feed(line)
+    return parser.result()
+
+
+def rows_from_json(data):
+    """Stesse righe a partire da una risposta application/sparql-results+json già decodificata."""
+    names = data.get('head', {}).get('vars', [])
+    rows = []
+    for binding in data.get('results', {}).get('bindings', []):
+        rows.append(tuple(binding[name]['value'] if name in binding else None for name in names))
+    return ResultRows(names, rows)
+
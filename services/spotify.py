@@ -1,41 +1,82 @@
 import spotipy
-from spotipy.oauth2 import SpotifyOAuth
+import asyncio
+import httpx
+import requests
 import re
 import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from services import metrics
+from services.http_client import LoopClient, parse_retry_after
+from services.image_proxy import pick_spotify_image
+from services.models import Track
+from services.playlist_cache import PlaylistSnapshotCache
+from services.spotify_auth import build_auth
+
+# Proiezione dei soli campi usati da _parse_item: riduce di molto il payload di ogni pagina
+PLAYLIST_FIELDS = "total,limit,next,items(track(id,name,type,is_local,artists(name),album(name,images)))"
+PAGE_SIZE = 100
+# Larghezza minima della copertina salvata: basta per la scheda del brano (180px)
+COVER_WIDTH = 300
+# Web API usata direttamente (httpx) dalla modalità asincrona
+SPOTIFY_API = "https://api.spotify.com/v1"
+# Tentativi su 429 oltre a quelli interni di spotipy
+MAX_RATE_LIMIT_RETRIES = 5
+# Attesa (secondi) prima di ritentare l'autenticazione fallita
+AUTH_RETRY_INTERVAL = float(os.environ.get('SPOTIFY_AUTH_RETRY', 60))
 
 class SpotifyHandler:
-    def __init__(self, client_id, client_secret):
+    def __init__(self, client_id, client_secret, page_workers=None, fixtures=None, redis_client=None):
         self.sp = None
         self.active = False
+        self.client_id = client_id
+        self.client_secret = client_secret
+        # Modalità offline: la playlist demo arriva dal dataset locale e non si tenta il login
+        self.fixtures = fixtures
+        # Pagine della playlist scaricate in parallelo (per offset)
+        self.page_workers = page_workers or int(os.environ.get('SPOTIFY_PAGE_WORKERS', 4))
         
         # 1. Calcola il percorso per la cache (cartella principale del progetto)
         current_dir = os.path.dirname(os.path.abspath(__file__))
-        project_root = os.path.dirname(current_dir)
-        cache_path = os.path.join(project_root, ".spotify_cache")
+        self.project_root = os.path.dirname(current_dir)
+        # Playlist già analizzate, riutilizzate finché lo snapshot_id non cambia
+        self.snapshots = PlaylistSnapshotCache.from_env(os.path.join(self.project_root, ".playlist_cache"))
+        # Base della Web API (SPOTIFY_API_URL per puntare a uno stub, es. nei benchmark)
+        self.api_url = os.environ.get('SPOTIFY_API_URL', SPOTIFY_API).rstrip('/')
+        # Client httpx della modalità ASGI, creato al primo uso nell'event loop corrente
+        self._ahttp = LoopClient(lambda: httpx.AsyncClient(timeout=httpx.Timeout(30, connect=3.05)))
+
+        # 2. Autenticazione pigra: il client nasce alla prima richiesta (ensure_client),
+        #    così l'avvio dei worker non fa chiamate di rete; il token è condiviso (vedi spotify_auth)
+        self.redis = redis_client
+        self._init_lock = threading.Lock()
+        self._retry_at = 0.0
+
+        if fixtures is not None:
+            print("📦 Spotify in modalità offline: uso la playlist del dataset locale")
 
-        if client_id and client_secret:
+    def ensure_client(self):
+        """Crea il client spotipy al primo uso (thread-safe). False se non è disponibile."""
+        if self.active or self.fixtures is not None or not (self.client_id and self.client_secret):
+            return self.active
+        with self._init_lock:
+            # Dopo un errore si riprova solo tra AUTH_RETRY_INTERVAL secondi (niente raffiche sull'endpoint)
+            if self.active or time.monotonic() < self._retry_at:
+                return self.active
             try:
-                # 2. Autenticazione Robusta (Login Utente)
-                # Questo è fondamentale per leggere le tue playlist private/pubbliche senza errori
-                auth_manager = SpotifyOAuth(
-                    client_id=client_id,
-                    client_secret=client_secret,
-                    redirect_uri="http://127.0.0.1:5000/callback",
-                    scope="playlist-read-private playlist-read-collaborative",
-                    cache_path=cache_path,
-                    open_browser=False # False perché il server è già avviato
-                )
-                
+                auth_manager = build_auth(self.client_id, self.client_secret, self.project_root, self.redis)
+                # Dalla cache condivisa se ancora valido, altrimenti un solo rinnovo per tutti i worker
+                auth_manager.get_access_token(as_dict=False)
                 self.sp = spotipy.Spotify(auth_manager=auth_manager)
-                
-                # Test connessione immediato
-                user = self.sp.current_user()
-                print(f"✅ Spotify Connesso come: {user['display_name']}")
+                self.sp.prefix = self.api_url + '/'
+                print(f"✅ Spotify Connesso (token {auth_manager.mode})")
                 self.active = True
-                
             except Exception as e:
                 print(f"❌ Errore Auth Spotify: {e}")
-                self.active = False
+                self._retry_at = time.monotonic() + AUTH_RETRY_INTERVAL
+        return self.active
 
     def extract_id_from_url(self, url):
         """Estrae l'ID pulito dall'URL."""
@@ -49,83 +90,413 @@ class SpotifyHandler:
 
     def get_playlist_tracks(self, playlist_id):
         """Scarica i brani usando la logica universale 'Script Indipendente'."""
-        tracks = []
-        
-        # Se non siamo attivi o l'ID è demo, restituisci dati finti
-        if not self.active or playlist_id == "demo":
-            return self._get_backup_data(), True
+        pages, is_demo = self.iter_playlist_pages(playlist_id)
+        tracks = [track for page in pages for track in page]
+        return tracks, is_demo
+
+    @metrics.instrumented('spotify')
+    def iter_playlist_pages(self, playlist_id):
+        """
+        Versione in streaming: restituisce (generatore di pagine, is_demo).
+        Ogni pagina è la lista dei brani già puliti; i dati grezzi di Spotify
+        vengono scartati appena convertiti, quindi in memoria c'è una pagina alla volta.
+        La prima pagina viene scaricata subito, così un errore iniziale ripiega sulla demo.
+        """
+        pages, is_demo, _ = self._open_playlist(playlist_id)
+        return pages, is_demo
+
+    @metrics.instrumented('spotify')
+    def playlist_window(self, playlist_id, offset, limit, snapshot_id=None):
+        """
+        Una finestra della playlist per l'API JSON: (brani, totale, snapshot_id, is_demo).
+        Posizioni e totale sono quelli di Spotify (contano anche le voci scartate,
+        es. file locali). Con lo snapshot_id di una risposta precedente la finestra
+        arriva dal disco senza chiamare Spotify (e la lista resta coerente durante
+        lo scorrimento); altrimenti si scaricano solo le pagine che coprono
+        [offset, offset + limit), così il costo non cresce con la playlist.
+        Lo snapshot su disco lo salvano le letture complete (/playlist, insights).
+        """
+        if snapshot_id and playlist_id != "demo":
+            window = self.snapshots.get_window(playlist_id, snapshot_id, offset, limit)
+            if window is not None:
+                return window[0], window[1], snapshot_id, False
+        if playlist_id == "demo" or not self.ensure_client():
+            return (*_window(self._get_backup_data(), offset, limit), None, True)
 
         try:
-            print(f"🔄 Scarico playlist ID: {playlist_id}...")
-            
-            # --- LOGICA VINCENTE DELLO SCRIPT ESTERNO ---
-            
-            # 1. Scarica tutto l'oggetto con market="IT" (Evita errori 403 su brani locali/regionali)
-            data = self.sp.playlist(playlist_id, market="IT")
-            
-            # 2. Cerca dove sono nascosti i brani (Struttura variabile)
-            paginator = None
-            if 'tracks' in data and isinstance(data['tracks'], dict):
-                paginator = data['tracks'] # Caso Standard
-            elif 'items' in data and isinstance(data['items'], dict):
-                paginator = data['items']  # Caso del tuo JSON
+            snapshot_id = self._call('playlist_snapshot', self.sp.playlist, playlist_id,
+                                     fields="snapshot_id", market="IT").get('snapshot_id')
+            if snapshot_id:
+                window = self.snapshots.get_window(playlist_id, snapshot_id, offset, limit)
+                if window is not None:
+                    return window[0], window[1], snapshot_id, False
+
+            first = self._fetch_page(playlist_id, offset, min(limit, PAGE_SIZE))
+            if not isinstance(first.get('items'), list):
+                print("❌ Errore Struttura: Non trovo 'items'.")
+                return (*_window(self._get_backup_data(), offset, limit), None, True)
+            rest = _window_requests(first, offset, limit)
+            if rest:
+                with ThreadPoolExecutor(max_workers=self.page_workers) as pool:
+                    others = list(pool.map(lambda req: self._fetch_page(playlist_id, *req), rest))
             else:
-                print("❌ Errore Struttura: Non trovo 'tracks' né 'items'.")
-                return self._get_backup_data(), True
-
-            # 3. Estrai la lista grezza
-            raw_items = paginator.get('items', [])
-            
-            # 4. Paginazione: Scarica il resto se ce n'è (Gestisce playlist lunghe)
-            while paginator['next']:
-                paginator = self.sp.next(paginator)
-                raw_items.extend(paginator['items'])
-
-            print(f"✅ Trovati {len(raw_items)} brani totali.")
-
-            # 5. Pulizia e Parsing dei dati
-            for item in raw_items:
-                # A volte è dentro 'track', a volte 'item', a volte diretto
-                track = item.get('track')
-                if not track: track = item.get('item')
-                
-                # Filtri di sicurezza:
-                # - Deve avere un ID
-                # - Deve essere di tipo 'track' (no podcast)
-                # - Non deve essere un file locale (is_local=False)
-                if track and track.get('id') and track.get('type') == 'track' and not track.get('is_local'):
-                    
-                    # Gestione sicura Immagine
-                    cover = "https://via.placeholder.com/150"
-                    try:
-                        if track['album']['images']:
-                            cover = track['album']['images'][0]['url']
-                    except: pass
-                    
-                    # Gestione sicura Artista
-                    artist = "Sconosciuto"
-                    try:
-                        if track['artists']:
-                            artist = track['artists'][0]['name']
-                    except: pass
-
-                    tracks.append({
-                        "title": track['name'],
-                        "artist": artist,
-                        "album": track['album']['name'],
-                        "cover": cover,
-                        "id": track['id']
-                    })
-            
-            return tracks, False # False = Dati Reali
+                others = []
+        except Exception as e:
+            print(f"❌ ERRORE LETTURA FLASK: {e}")
+            return (*_window(self._get_backup_data(), offset, limit), None, True)
+
+        return (*self._window_tracks(first, others, offset), snapshot_id, False)
+
+    @metrics.instrumented('spotify')
+    def playlist_snapshot(self, playlist_id):
+        """
+        Tutti i brani con lo snapshot_id della versione letta: (brani, snapshot_id, is_demo).
+        Serve a chi calcola dati sull'intera playlist e li mette in cache per snapshot.
+        """
+        pages, is_demo, snapshot_id = self._open_playlist(playlist_id)
+        return [track for page in pages for track in page], snapshot_id, is_demo
+
+    def _open_playlist(self, playlist_id):
+        """(generatore di pagine, is_demo, snapshot_id) per iter_playlist_pages e playlist_window."""
+        # Se l'ID è demo o Spotify non è disponibile, restituisci dati finti
+        if playlist_id == "demo" or not self.ensure_client():
+            return iter([self._get_backup_data()]), True, None
+
+        try:
+            # 0. Richiesta leggera del solo snapshot_id: se la playlist non è cambiata
+            #    serviamo la lista dalla cache senza riscaricarla
+            snapshot_id = self._call('playlist_snapshot', self.sp.playlist, playlist_id,
+                                     fields="snapshot_id", market="IT").get('snapshot_id')
+            if snapshot_id:
+                cached = self.snapshots.get_pages(playlist_id, snapshot_id)
+                if cached is not None:
+                    print(f"⚡ Playlist {playlist_id} invariata, uso la cache")
+                    return cached, False, snapshot_id
+
+            print(f"🔄 Scarico playlist ID: {playlist_id}...")
+
+            # 1. Prima pagina con market="IT" (Evita errori 403 su brani locali/regionali):
+            #    riporta anche 'total' e 'limit', che servono a calcolare gli offset delle altre
+            first = self._fetch_page(playlist_id, 0)
+            if not isinstance(first.get('items'), list):
+                print("❌ Errore Struttura: Non trovo 'items'.")
+                return iter([self._get_backup_data()]), True, None
 
         except Exception as e:
             print(f"❌ ERRORE LETTURA FLASK: {e}")
-            return self._get_backup_data(), True
+            return iter([self._get_backup_data()]), True, None
+
+        writer = self.snapshots.writer(playlist_id, snapshot_id) if snapshot_id else None
+        return self._stream(self._pages(playlist_id, first), writer), False, snapshot_id # False = Dati Reali
+
+    def _fetch_page(self, playlist_id, offset, limit=PAGE_SIZE):
+        """Una pagina della playlist per offset, riprovando sui 429 secondo Retry-After."""
+        for attempt in range(MAX_RATE_LIMIT_RETRIES + 1):
+            try:
+                return self._call('playlist_page', self.sp.playlist_items, playlist_id, fields=PLAYLIST_FIELDS,
+                                  limit=limit, offset=offset, market="IT", additional_types=('track',))
+            except spotipy.SpotifyException as e:
+                if e.http_status != 429 or attempt == MAX_RATE_LIMIT_RETRIES:
+                    raise
+                metrics.count_retry('spotify', 429)
+                retry_after = (e.headers or {}).get('Retry-After')
+                delay = float(retry_after) if retry_after else 2 ** attempt
+                print(f"⚠️ Spotify 429 (offset {offset}), attendo {delay}s")
+                time.sleep(delay)
+
+    def _call(self, call, fn, *args, **kwargs):
+        """Chiamata spotipy misurata come richiesta a monte (spotipy non espone la dimensione della risposta)."""
+        start = time.perf_counter()
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            status = getattr(e, 'http_status', None)
+            error = None if status else ('timeout' if isinstance(e, requests.Timeout) else 'connection')
+            metrics.observe_upstream('spotify', time.perf_counter() - start, status=status, error=error, call=call)
+            raise
+        metrics.observe_upstream('spotify', time.perf_counter() - start, status=200, call=call)
+        return result
+
+    def _pages(self, playlist_id, first):
+        """
+        Generatore delle pagine: la prima è già scaricata, le successive vengono
+        richieste in parallelo per offset (al massimo `page_workers` alla volta)
+        e restituite nell'ordine della playlist. Gli item grezzi vengono scartati
+        pagina per pagina; le voci che _parse_item scarta restano None (posizioni
+        di Spotify nello snapshot), le toglie _stream.
+        """
+        yield list(map(self._parse_item, first['items']))
+
+        limit = first.get('limit') or PAGE_SIZE
+        if first.get('total') is None:
+            # Nessun totale: ripiego sulla paginazione sequenziale con 'next'
+            paginator = first
+            while paginator.get('next'):
+                paginator = self._call('playlist_page', self.sp.next, paginator)
+                yield list(map(self._parse_item, paginator.get('items', [])))
+            return
+
+        offsets = iter(range(limit, first['total'], limit))
+        with ThreadPoolExecutor(max_workers=self.page_workers) as pool:
+            pending = deque()
+            try:
+                for offset in offsets:
+                    pending.append(pool.submit(self._fetch_page, playlist_id, offset, limit))
+                    if len(pending) >= self.page_workers:
+                        break
+                while pending:
+                    data = pending.popleft().result()
+                    # Finestra scorrevole: in memoria al massimo `page_workers` pagine
+                    offset = next(offsets, None)
+                    if offset is not None:
+                        pending.append(pool.submit(self._fetch_page, playlist_id, offset, limit))
+                    yield list(map(self._parse_item, data.get('items', [])))
+            finally:
+                # Client disconnesso o errore: non scarichiamo le pagine rimaste
+                for future in pending:
+                    future.cancel()
+
+    def _stream(self, pages, writer):
+        """
+        Inoltra le pagine al chiamante salvandole nella cache degli snapshot.
+        La voce in cache viene confermata solo se la playlist è stata letta tutta.
+        """
+        total = 0
+        complete = False
+        try:
+            for page in pages:
+                if writer is not None:
+                    writer.write(page)
+                page = [t for t in page if t]
+                total += len(page)
+                yield page
+            complete = True
+        except Exception as e:
+            # La risposta è già partita: ci fermiamo ai brani letti finora
+            print(f"❌ ERRORE PAGINAZIONE: {e}")
+        finally:
+            pages.close()
+            if writer is not None:
+                try:
+                    writer.commit() if complete else writer.abort()
+                except OSError as e:
+                    print(f"⚠️ Cache playlist non salvata: {e}")
+            print(f"✅ Trovati {total} brani totali.")
+
+    # --- Modalità asincrona (ASGI) -----------------------------------------
+
+    @metrics.instrumented('spotify')
+    async def aiter_playlist_pages(self, playlist_id):
+        """
+        Come iter_playlist_pages, ma non blocca l'event loop: restituisce
+        (generatore asincrono di pagine, is_demo). Le richieste vanno direttamente
+        alla Web API con httpx usando il token di spotipy (rinnovato in un thread).
+        """
+        pages, is_demo, _ = await self._aopen_playlist(playlist_id)
+        return pages, is_demo
+
+    @metrics.instrumented('spotify')
+    async def aplaylist_window(self, playlist_id, offset, limit, snapshot_id=None):
+        """Versione asincrona di playlist_window (pagine della finestra in parallelo)."""
+        if snapshot_id and playlist_id != "demo":
+            # Lettura dal disco: fuori dall'event loop
+            window = await asyncio.to_thread(self.snapshots.get_window, playlist_id, snapshot_id, offset, limit)
+            if window is not None:
+                return window[0], window[1], snapshot_id, False
+        if playlist_id == "demo" or not await asyncio.to_thread(self.ensure_client):
+            return (*_window(self._get_backup_data(), offset, limit), None, True)
+
+        try:
+            snapshot = await self._aget(f"/playlists/{playlist_id}", {'fields': 'snapshot_id', 'market': 'IT'})
+            snapshot_id = snapshot.get('snapshot_id')
+            if snapshot_id:
+                window = await asyncio.to_thread(self.snapshots.get_window, playlist_id, snapshot_id, offset, limit)
+                if window is not None:
+                    return window[0], window[1], snapshot_id, False
+
+            first = await self._afetch_page(playlist_id, offset, min(limit, PAGE_SIZE))
+            if not isinstance(first.get('items'), list):
+                print("❌ Errore Struttura: Non trovo 'items'.")
+                return (*_window(self._get_backup_data(), offset, limit), None, True)
+            others = await asyncio.gather(*(self._afetch_page(playlist_id, *req)
+                                            for req in _window_requests(first, offset, limit)))
+        except Exception as e:
+            print(f"❌ ERRORE LETTURA ASGI: {e}")
+            return (*_window(self._get_backup_data(), offset, limit), None, True)
+
+        return (*self._window_tracks(first, others, offset), snapshot_id, False)
+
+    @metrics.instrumented('spotify')
+    async def aplaylist_snapshot(self, playlist_id):
+        """Versione asincrona di playlist_snapshot."""
+        pages, is_demo, snapshot_id = await self._aopen_playlist(playlist_id)
+        return [track async for page in pages for track in page], snapshot_id, is_demo
+
+    async def _aopen_playlist(self, playlist_id):
+        if playlist_id == "demo" or not await asyncio.to_thread(self.ensure_client):
+            return _aiter_pages([self._get_backup_data()]), True, None
+
+        try:
+            snapshot = await self._aget(f"/playlists/{playlist_id}", {'fields': 'snapshot_id', 'market': 'IT'})
+            snapshot_id = snapshot.get('snapshot_id')
+            if snapshot_id:
+                cached = await asyncio.to_thread(self.snapshots.get_pages, playlist_id, snapshot_id)
+                if cached is not None:
+                    print(f"⚡ Playlist {playlist_id} invariata, uso la cache")
+                    return _aread_pages(cached), False, snapshot_id
+
+            print(f"🔄 Scarico playlist ID: {playlist_id}...")
+            first = await self._afetch_page(playlist_id, 0)
+            if not isinstance(first.get('items'), list):
+                print("❌ Errore Struttura: Non trovo 'items'.")
+                return _aiter_pages([self._get_backup_data()]), True, None
+
+        except Exception as e:
+            print(f"❌ ERRORE LETTURA ASGI: {e}")
+            return _aiter_pages([self._get_backup_data()]), True, None
+
+        writer = await asyncio.to_thread(self.snapshots.writer, playlist_id, snapshot_id) if snapshot_id else None
+        return self._astream(self._apages(playlist_id, first), writer), False, snapshot_id
+
+    async def _aget(self, path_or_url, params=None):
+        """GET sulla Web API riprovando sui 429 secondo Retry-After."""
+        url = path_or_url if path_or_url.startswith('http') else self.api_url + path_or_url
+        for attempt in range(MAX_RATE_LIMIT_RETRIES + 1):
+            token = await asyncio.to_thread(self.sp.auth_manager.get_access_token, as_dict=False)
+            call = 'playlist_page' if '/tracks' in url else 'playlist_snapshot'
+            start = time.perf_counter()
+            try:
+                r = await self._http().get(url, params=params, headers={'Authorization': f"Bearer {token}"})
+            except httpx.HTTPError as e:
+                metrics.observe_upstream('spotify', time.perf_counter() - start, call=call,
+                                         error='timeout' if isinstance(e, httpx.TimeoutException) else 'connection')
+                raise
+            metrics.observe_upstream('spotify', time.perf_counter() - start, status=r.status_code,
+                                     size=len(r.content), call=call)
+            if r.status_code != 429 or attempt == MAX_RATE_LIMIT_RETRIES:
+                r.raise_for_status()
+                return r.json()
+            metrics.count_retry('spotify', 429)
+            delay = parse_retry_after(r.headers.get('Retry-After'))
+            delay = delay if delay is not None else 2 ** attempt
+            print(f"⚠️ Spotify 429 ({url}), attendo {delay}s")
+            await asyncio.sleep(delay)
+
+    async def _afetch_page(self, playlist_id, offset, limit=PAGE_SIZE):
+        return await self._aget(f"/playlists/{playlist_id}/tracks", {
+            'fields': PLAYLIST_FIELDS, 'limit': limit, 'offset': offset,
+            'market': 'IT', 'additional_types': 'track',
+        })
+
+    async def _apages(self, playlist_id, first):
+        """Versione asincrona di _pages: al massimo `page_workers` richieste in volo."""
+        yield list(map(self._parse_item, first['items']))
+
+        limit = first.get('limit') or PAGE_SIZE
+        if first.get('total') is None:
+            paginator = first
+            while paginator.get('next'):
+                paginator = await self._aget(paginator['next'])
+                yield list(map(self._parse_item, paginator.get('items', [])))
+            return
+
+        offsets = iter(range(limit, first['total'], limit))
+        pending = deque()
+        try:
+            for offset in offsets:
+                pending.append(asyncio.ensure_future(self._afetch_page(playlist_id, offset, limit)))
+                if len(pending) >= self.page_workers:
+                    break
+            while pending:
+                data = await pending.popleft()
+                offset = next(offsets, None)
+                if offset is not None:
+                    pending.append(asyncio.ensure_future(self._afetch_page(playlist_id, offset, limit)))
+                yield list(map(self._parse_item, data.get('items', [])))
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _astream(self, pages, writer):
+        """Versione asincrona di _stream (stessa logica di conferma della cache)."""
+        total = 0
+        complete = False
+        try:
+            async for page in pages:
+                if writer is not None:
+                    await asyncio.to_thread(writer.write, page)
+                page = [t for t in page if t]
+                total += len(page)
+                yield page
+            complete = True
+        except Exception as e:
+            print(f"❌ ERRORE PAGINAZIONE: {e}")
+        finally:
+            await pages.aclose()
+            if writer is not None:
+                try:
+                    # commit() sposta il file ed esegue l'eviction della cache su disco
+                    await asyncio.to_thread(writer.commit if complete else writer.abort)
+                except OSError as e:
+                    print(f"⚠️ Cache playlist non salvata: {e}")
+            print(f"✅ Trovati {total} brani totali.")
+
+    def _http(self):
+        return self._ahttp.get()
+
+    async def aclose(self):
+        """Chiude il client httpx della modalità ASGI."""
+        await self._ahttp.aclose()
+
+    def _window_tracks(self, first, others, offset):
+        """(brani, totale) dalle pagine di una finestra; senza 'total' si ferma a quelle lette."""
+        pages = [first, *others]
+        tracks = [t for data in pages for t in map(self._parse_item, data.get('items', [])) if t]
+        total = first.get('total')
+        if total is None:
+            total = offset + sum(len(data.get('items', [])) for data in pages)
+        return tracks, total
+
+    def _parse_item(self, item):
+        """Pulizia e Parsing di un singolo elemento della playlist. None se va scartato."""
+        # A volte è dentro 'track', a volte 'item', a volte diretto
+        track = item.get('track')
+        if not track: track = item.get('item')
+        
+        # Filtri di sicurezza:
+        # - Deve avere un ID
+        # - Deve essere di tipo 'track' (no podcast)
+        # - Non deve essere un file locale (is_local=False)
+        if not (track and track.get('id') and track.get('type') == 'track' and not track.get('is_local')):
+            return None
+
+        # Gestione sicura Immagine: la variante più piccola che basta, non sempre la 640px
+        cover = "https://via.placeholder.com/150"
+        try:
+            if track['album']['images']:
+                cover = pick_spotify_image(track['album']['images'], COVER_WIDTH) or cover
+        except: pass
+        
+        # Gestione sicura Artista
+        artist = "Sconosciuto"
+        try:
+            if track['artists']:
+                artist = track['artists'][0]['name']
+        except: pass
+
+        return Track(
+            title=track['name'],
+            artist=artist,
+            album=track['album']['name'],
+            cover=cover,
+            id=track['id']
+        )
 
     def _get_backup_data(self):
-        """Dati di fallback in caso di errore critico."""
-        return [
+        """Dati di fallback in caso di errore critico (o la playlist del dataset offline)."""
+        if self.fixtures is not None:
+            return self.fixtures.playlist_tracks()
+        return [Track.from_dict(t) for t in [
             {
                 "title": "Bohemian Rhapsody", 
                 "artist": "Queen", 
@@ -198,5 +569,36 @@ class SpotifyHandler:
                 "album": "Imagine", 
                 "cover": ""
             }
-        ]     
-        return backup_tracks, True
\ No newline at end of file
+        ]]
+        return backup_tracks, True
+
+
+def _window(tracks, offset, limit):
+    """Brani in [offset, offset + limit) e totale di una playlist già in memoria (demo)."""
+    return tracks[offset:offset + limit], len(tracks)
+
+
+def _window_requests(first, offset, limit):
+    """(offset, limit) delle richieste a Spotify che completano la finestra dopo la prima pagina."""
+    end = offset + limit
+    if first.get('total') is not None:
+        end = min(end, first['total'])
+    elif not first.get('next'):
+        return []
+    return [(start, min(PAGE_SIZE, end - start)) for start in range(offset + PAGE_SIZE, end, PAGE_SIZE)]
+
+
+async def _aiter_pages(pages):
+    """Adatta un iterabile di pagine già in memoria (demo) al protocollo asincrono."""
+    for page in pages:
+        yield page
+
+
+async def _aread_pages(pages):
+    """Come _aiter_pages per le pagine lette dalla cache su disco: ogni pagina si legge in un thread."""
+    pages = iter(pages)
+    while True:
+        page = await asyncio.to_thread(next, pages, None)
+        if page is None:
+            return
+        yield page
@@ -0,0 +1,171 @@
+"""
+Token di Spotify condiviso tra i worker.
+
+Il token vive in un unico posto per tutti i processi: il file .spotify_cache
+(con lock) oppure Redis se REDIS_URL è impostata. Viene rinnovato in anticipo,
+REFRESH_MARGIN secondi prima della scadenza, da un solo chiamante alla volta:
+  - tra i thread dello stesso processo con SingleFlight
+  - tra processi con il lock su file (flock) o il lock Redis di SingleFlight
+così all'avvio di molti worker l'endpoint di autenticazione riceve una sola richiesta.
+
+Modalità (SPOTIFY_AUTH):
+  - user: token utente OAuth (playlist private), ottenuto una volta con
+          `python -m services.spotify_auth login`
+  - app:  client credentials, solo playlist pubbliche, nessun login
+  - auto: user se c'è un token utente in cache, altrimenti app (default)
+"""
+import argparse
+import contextlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+from spotipy.cache_handler import CacheHandler, RedisCacheHandler
+from spotipy.oauth2 import SpotifyClientCredentials, SpotifyOAuth, SpotifyOauthError
+
+from services.singleflight import SingleFlight
+
+try:
+    import fcntl
+except ImportError:  # Windows: resta solo il lock tra thread
+    fcntl = None
+
+# Rinnovo anticipato: mai usare un token a meno di 5 minuti dalla scadenza
+REFRESH_MARGIN = 300
+REDIRECT_URI = "http://127.0.0.1:5000/callback"
+# Credenziali dell'app Spotify (le usano anche i servizi in services/runtime.py)
+SPOTIFY_CLIENT_ID = os.environ.get('SPOTIFY_CLIENT_ID', "aa75bf8321234d9493c0e84adfe3d20e")
+SPOTIFY_CLIENT_SECRET = os.environ.get('SPOTIFY_CLIENT_SECRET', "b3c8ac21c6f944e7975d33275678ab3c")
+SCOPE = "playlist-read-private playlist-read-collaborative"
+
+
+class LockedFileTokenCache(CacheHandler):
+    """
+    Token su file condiviso tra processi. Le scritture sono atomiche (file
+    temporaneo + rename), quindi le letture non hanno bisogno del lock; il lock
+    su `<path>.lock` serializza solo i rinnovi.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def get_cached_token(self):
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def save_token_to_cache(self, token_info):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix='.spotify-token-')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(token_info, f)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            print(f"⚠️ Token Spotify non salvato: {e}")
+            with contextlib.suppress(OSError):
+                os.remove(tmp)
+
+    @contextlib.contextmanager
+    def refresh_lock(self):
+        with self._lock:
+            if fcntl is None:
+                yield
+                return
+            with open(self.path + '.lock', 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+class SharedTokenAuth:
+    """
+    Auth manager per spotipy (espone get_access_token) sopra un auth manager
+    OAuth o client credentials che condivide la cache dei token.
+    """
+
+    def __init__(self, auth, cache, flight, mode, margin=REFRESH_MARGIN):
+        self.auth = auth
+        self.cache = cache
+        self.flight = flight
+        self.mode = mode
+        self.margin = margin
+
+    def get_access_token(self, as_dict=False):
+        token = self._fresh(self.cache.get_cached_token())
+        if token is None:
+            token = self.flight.do(f"spotify_token:{self.mode}", self._refresh,
+                                   lookup=lambda: self._fresh(self.cache.get_cached_token()))
+        return token if as_dict else token['access_token']
+
+    def _fresh(self, token):
+        if token and token.get('access_token') and token.get('expires_at', 0) - time.time() > self.margin:
+            return token
+        return None
+
+    def _refresh(self):
+        lock = getattr(self.cache, 'refresh_lock', contextlib.nullcontext)
+        with lock():
+            # Un altro processo può averlo appena rinnovato mentre aspettavamo il lock
+            current = self.cache.get_cached_token()
+            token = self._fresh(current)
+            if token is not None:
+                return token
+
+            if self.mode == 'user':
+                if not current or not current.get('refresh_token'):
+                    raise SpotifyOauthError("Nessun token utente: esegui `python -m services.spotify_auth login`")
+                print("🔑 Rinnovo del token utente Spotify")
+                return self.auth.refresh_access_token(current['refresh_token'])
+
+            print("🔑 Nuovo token Spotify (client credentials)")
+            self.auth.get_access_token(as_dict=False, check_cache=False)
+            return self.cache.get_cached_token()
+
+
+def token_cache(kind, project_root, redis_client=None):
+    """Dove vive il token `kind` ('user' o 'app'): Redis se disponibile, altrimenti file con lock."""
+    if redis_client is not None:
+        return RedisCacheHandler(redis_client, key=f"spotify:token:{kind}")
+    name = '.spotify_cache' if kind == 'user' else '.spotify_cache_app'
+    return LockedFileTokenCache(os.path.join(project_root, name))
+
+
+def build_auth(client_id, client_secret, project_root, redis_client=None, mode=None):
+    """Auth manager condiviso secondo SPOTIFY_AUTH (user / app / auto). Nessuna chiamata di rete."""
+    mode = mode or os.environ.get('SPOTIFY_AUTH', 'auto')
+    flight = SingleFlight(redis_client=redis_client)
+
+    user_cache = token_cache('user', project_root, redis_client)
+    if mode == 'user' or (mode == 'auto' and (user_cache.get_cached_token() or {}).get('refresh_token')):
+        auth = SpotifyOAuth(client_id=client_id, client_secret=client_secret, redirect_uri=REDIRECT_URI,
+                            scope=SCOPE, cache_handler=user_cache, open_browser=False)
+        return SharedTokenAuth(auth, user_cache, flight, 'user')
+
+    app_cache = token_cache('app', project_root, redis_client)
+    auth = SpotifyClientCredentials(client_id=client_id, client_secret=client_secret, cache_handler=app_cache)
+    return SharedTokenAuth(auth, app_cache, flight, 'app')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Token Spotify condiviso dai worker.")
+    parser.add_argument('command', choices=['login'], help="login: autorizza l'utente e salva il token")
+    parser.parse_args()
+
+    project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    cache = token_cache('user', project_root)
+    auth = SpotifyOAuth(client_id=SPOTIFY_CLIENT_ID, client_secret=SPOTIFY_CLIENT_SECRET,
+                        redirect_uri=REDIRECT_URI, scope=SCOPE, cache_handler=cache, open_browser=False)
+    auth.get_access_token(as_dict=False)
+    print(f"✅ Token utente salvato in {cache.path}")
+
+
+if __name__ == '__main__':
+    main()
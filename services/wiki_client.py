@@ -1,22 +1,681 @@
-import requests
+import asyncio
+import contextvars
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from services.cache import TieredCache
+from services.circuit import CircuitBreakers, CircuitOpenError
+from services.deadline import DeadlineExceeded
+from services.http_client import AsyncSparqlClient, SparqlClient, is_unavailable
+from services.singleflight import AsyncSingleFlight, SingleFlight
+from services.sparql_results import ResultRows
+from services.local_store import LocalBackend, LocalStore
+from services.matcher import MATCH_THRESHOLD, strip_decorations
+from services.metrics import instrumented
+from services.models import ArtistRef, Recommendation, TrackDetails
+
+# TTL (in secondi) per metodo: i collegamenti canzone/artista cambiano di rado,
+# i consigliati sono la parte più "viva" del grafo.
+CACHE_TTLS = {
+    'track_url': 7 * 24 * 3600,
+    'track_details': 24 * 3600,
+    'artist_details': 24 * 3600,
+    'recommendations': 6 * 3600,
+    'track_facts': 24 * 3600,
+    'insights': 24 * 3600,
+}
+# TTL dei risultati "non trovato" (solo da query andate a buon fine): più brevi,
+# così un brano aggiunto a Wikidata compare presto, ma la coda lunga di brani
+# sconosciuti non riparte verso Wikidata a ogni click su /resolve_track.
+NEGATIVE_TTLS = {
+    'track_url': 6 * 3600,
+    'track_details': 3600,
+    'artist_details': 3600,
+    'recommendations': 3600,
+}
+
+# Coppie (titolo, artista) per ogni query batch: oltre, la VALUES con due
+# ricerche mwapi per riga rischia il timeout di 60 s del Query Service.
+BATCH_CHUNK_SIZE = 50
+# Brani per ogni query di get_track_facts: solo lookup diretti sulle entità
+# (niente mwapi), quindi blocchi molto più grandi restano sotto il timeout.
+FACTS_CHUNK_SIZE = 500
+# Query a blocchi in volo insieme nei metodi sincroni (le asincrone usano gather)
+CHUNK_WORKERS = int(os.environ.get('WIKIDATA_CHUNK_WORKERS', 4))
+_ENTITY_URL = re.compile(r'^http://www\.wikidata\.org/entity/Q\d+$')
+
+
+def _sparql_literal(text):
+    """Rende una stringa sicura dentro un letterale SPARQL tra virgolette."""
+    return (text or '').replace('\\', '').replace('"', '').replace('\n', ' ')
+
+
+def _bound(result, row):
+    """Riga come dict delle sole variabili legate, come un binding JSON."""
+    return {name: value for name, value in zip(result.vars, row) if value is not None}
+
+
+def _part_found(value):
+    """Un pezzo del bundle va in cache solo se trovato (scheda, artista) o non vuoto (consigliati)."""
+    if isinstance(value, TrackDetails):
+        return value.found
+    if isinstance(value, dict):
+        return value.get('found')
+    return bool(value)
+
+
+def _copy_part(value):
+    # Copia: la route /track modifica la scheda, la versione in cache resta intatta
+    if isinstance(value, TrackDetails):
+        return value.copy()
+    return dict(value) if isinstance(value, dict) else value
+
+
+def _record_failure(breaker, error):
+    if is_unavailable(error):
+        breaker.record_failure()
+    else:
+        breaker.release()
+
+
+def _log_error(error_msg, error):
+    # Circuito aperto e scadenza superata sono attesi (il breaker stampa già l'apertura): niente log per chiamata
+    if not isinstance(error, (CircuitOpenError, DeadlineExceeded)):
+        print(f"{error_msg}: {error}")
+
+
+def _local_backend_from_env():
+    if os.environ.get('WIKI_BACKEND', 'remote') != 'local':
+        return None
+    path = os.environ.get('WIKI_LOCAL_DB', 'data/wikidata_music.sqlite')
+    if not os.path.exists(path):
+        print(f"⚠️ Indice locale {path} non trovato, uso solo l'endpoint remoto")
+        return None
+    threshold = float(os.environ.get('WIKI_MATCH_THRESHOLD', MATCH_THRESHOLD))
+    return LocalBackend(LocalStore(path), match_threshold=threshold)
+
 
 class WikiAgent:
-    def __init__(self):
-        # Endpoint ufficiale per le query SPARQL di Wikidata
-        self.url = "https://query.wikidata.org/sparql"
+    def __init__(self, cache=None, client=None, local=None, remote_fallback=None, aclient=None):
+        # Endpoint ufficiale per le query SPARQL di Wikidata (WIKIDATA_SPARQL_URL per un mirror/stub)
+        self.url = os.environ.get('WIKIDATA_SPARQL_URL', "https://query.wikidata.org/sparql")
         # User-Agent è obbligatorio per evitare blocchi dalle API di Wikidata
         self.headers = {
             'User-Agent': 'MusicDataBot/1.0 (https://example.com; contact@example.com)',
             'Accept': 'application/sparql-results+json'
         }
+        # Sessione HTTP condivisa (keep-alive, timeout, retry, rate limit)
+        self.client = client if client is not None else SparqlClient.from_env(self.url, self.headers)
+        # Cache LRU locale + Redis (se REDIS_URL è impostata)
+        self.cache = cache if cache is not None else TieredCache.from_env(ttls=CACHE_TTLS)
+        # Chiamate identiche concorrenti condividono una sola query (anche tra processi via Redis)
+        self.flight = SingleFlight(redis_client=self.cache.redis)
+        # Client asincrono per la modalità ASGI, creato al primo uso
+        self._aclient = aclient
+        self.aflight = AsyncSingleFlight()
+        # Un circuit breaker per tipo di query: con Wikidata giù le chiamate falliscono subito
+        self.breakers = CircuitBreakers.from_env()
+        # Backend locale (indice SQLite del sottografo musicale): WIKI_BACKEND=local
+        self.local = local if local is not None else _local_backend_from_env()
+        if remote_fallback is None:
+            remote_fallback = os.environ.get('WIKI_REMOTE_FALLBACK', '1') != '0'
+        # Con il backend locale, i dati mancanti vengono chiesti all'endpoint pubblico
+        self.remote_fallback = remote_fallback or self.local is None
+
+    @property
+    def aclient(self):
+        # Stessa configurazione e stesso rate limiter del client sincrono
+        if self._aclient is None:
+            self._aclient = AsyncSparqlClient.from_sync(self.client)
+        return self._aclient
+
+    async def aclose(self):
+        """Chiude il client httpx della modalità ASGI, se è stato creato."""
+        if self._aclient is not None:
+            await self._aclient.aclose()
+
+    def _local_lookup(self, method, *args):
+        """Interroga il backend locale; None se non configurato o se il dato manca."""
+        if self.local is None:
+            return None
+        try:
+            return getattr(self.local, method)(*args)
+        except Exception as e:
+            print(f"⚠️ Errore backend locale ({method}): {e}")
+            return None
+
+    def _cached(self, method, key, fetch, cache_if, default):
+        """
+        Cache a livelli + single-flight: a ogni miss parte una sola query per chiave.
+        `fetch` solleva in caso di errore: si restituisce `default` senza salvarlo,
+        mentre un "non trovato" vero (query riuscita) va in cache con NEGATIVE_TTLS.
+        """
+        try:
+            return self.cache.get_or_load(
+                method, key,
+                lambda: self.flight.do(key, fetch, lookup=lambda: self.cache.get(key)),
+                cache_if=cache_if, negative_ttl=NEGATIVE_TTLS.get(method))
+        except Exception:
+            return default
+
+    # --- API pubblica (con cache) -------------------------------------------
 
+    @instrumented('wikidata')
     def get_track_url(self, title, artist):
+        local = self._local_lookup('get_track_url', title, artist)
+        if local is not None:
+            return local
+        if not self.remote_fallback:
+            return None, None
+        key = self.cache.make_key('track_url', title, artist)
+        song_url, artist_url = self._cached(
+            'track_url', key,
+            lambda: self._fetch_track_url(title, artist),
+            cache_if=lambda v: v[0] is not None, default=(None, None))
+        return song_url, artist_url
+
+    @instrumented('wikidata')
+    def get_track_details(self, entity_url):
+        local = self._local_lookup('get_track_details', entity_url)
+        if local is not None:
+            return local
+        if not self.remote_fallback:
+            return TrackDetails()
+        key = self.cache.make_key('track_details', entity_url.strip('<>'))
+        # Copia: la route /track aggiunge i consigliati alla scheda restituita
+        return self._cached(
+            'track_details', key,
+            lambda: self._fetch_track_details(entity_url),
+            cache_if=lambda v: v.found, default=TrackDetails()).copy()
+
+    @instrumented('wikidata')
+    def get_artist_details(self, entity_url):
+        local = self._local_lookup('get_artist_details', entity_url)
+        if local is not None:
+            return local
+        if not self.remote_fallback:
+            return {'found': False}
+        key = self.cache.make_key('artist_details', entity_url)
+        return dict(self._cached(
+            'artist_details', key,
+            lambda: self._fetch_artist_details(entity_url),
+            cache_if=lambda v: v.get('found'), default={'found': False}))
+
+    @instrumented('wikidata')
+    def get_recommendations(self, song_url, artist_url):
+        if not song_url or not artist_url: return []
+        local = self._local_lookup('get_recommendations', song_url, artist_url)
+        if local is not None:
+            return local
+        if not self.remote_fallback:
+            return []
+        key = self.cache.make_key('recommendations', song_url, artist_url)
+        return self._cached(
+            'recommendations', key,
+            lambda: self._fetch_recommendations(song_url, artist_url),
+            cache_if=bool, default=[])
+
+    @instrumented('wikidata')
+    def get_track_bundle(self, song_url, artist_url=None):
+        """
+        Tutto ciò che serve alla pagina /track in una sola query: dettagli del brano,
+        consigliati e scheda dell'artista principale (che finisce anche nella cache
+        di get_artist_details, pronta per il click su /artista).
+        Le parti già presenti nell'indice locale o in cache non vengono richieste.
+        Restituisce {'track': ..., 'artist': ... o None, 'recommendations': [...], 'partial': bool}:
+        `partial` è True se la query per le parti mancanti è fallita e alcune sono rimaste ai default.
+        """
+        bundle, missing = self._plan_bundle(song_url, artist_url)
+        if missing:
+            key = self.cache.make_key('track_bundle', song_url.strip('<>'), artist_url, *missing)
+            fetched = self.flight.do(key, lambda: self._fetch_track_bundle(song_url, artist_url, missing))
+            self._apply_bundle(bundle, song_url, artist_url, missing, fetched)
+        return bundle
+
+    @instrumented('wikidata')
+    def resolve_tracks_batch(self, pairs, chunk_size=BATCH_CHUNK_SIZE):
+        """
+        Risolve molte coppie (titolo, artista) in ceil(N/chunk_size) query SPARQL
+        usando una clausola VALUES invece di una query per brano.
+        Restituisce una lista allineata a `pairs`:
+          - (song_url, artist_url) se trovato
+          - (None, None) se Wikidata non ha il brano
+          - None se il blocco è fallito (errore di rete): il chiamante può riprovare
+        """
+        results, pending, chunks = self._plan_batch(pairs, chunk_size)
+        founds = self._map_chunks(
+            lambda chunk: self._fetch_track_urls_chunk([pairs[pending[k][0]] for k in chunk]), chunks)
+        for chunk, found in zip(chunks, founds):
+            self._apply_batch(results, pending, chunk, found)
+        return results
+
+    @instrumented('wikidata')
+    def get_track_facts(self, song_urls, chunk_size=FACTS_CHUNK_SIZE):
+        """
+        Genere (P136), data di pubblicazione (P577) e interpreti (P175) di molti
+        brani in ceil(N/chunk_size) query con una clausola VALUES.
+        Restituisce {song_url: {'date', 'genres', 'performers'}}: ogni brano di un
+        blocco riuscito ha una voce (anche vuota), quelli dei blocchi falliti non compaiono.
+        """
+        facts, chunks = self._plan_facts(song_urls, chunk_size)
+        for chunk, found in zip(chunks, self._map_chunks(self._fetch_track_facts_chunk, chunks)):
+            self._apply_facts(facts, chunk, found)
+        return facts
+
+    def _map_chunks(self, fetch, chunks):
+        """
+        `fetch(chunk)` per ogni blocco, al massimo CHUNK_WORKERS query in volo.
+        Ogni thread gira in una copia del contesto del chiamante, così vale la
+        sua scadenza: i blocchi oltre il budget falliscono (None) invece di partire.
+        """
+        if len(chunks) <= 1:
+            return [fetch(chunk) for chunk in chunks]
+        with ThreadPoolExecutor(max_workers=CHUNK_WORKERS) as pool:
+            futures = [pool.submit(contextvars.copy_context().run, fetch, chunk) for chunk in chunks]
+            return [future.result() for future in futures]
+
+    def _plan_facts(self, song_urls, chunk_size):
+        facts = {}
+        pending = []
+        for url in dict.fromkeys(u for u in song_urls if u):
+            local = self._local_lookup('get_track_facts', url)
+            if local is not None:
+                facts[url] = local
+                continue
+            if not self.remote_fallback or not _ENTITY_URL.match(url):
+                continue
+            cached = self.cache.get(self.cache.make_key('track_facts', url))
+            if cached is not None:
+                facts[url] = cached
+            else:
+                pending.append(url)
+        chunks = [pending[start:start + chunk_size] for start in range(0, len(pending), chunk_size)]
+        return facts, chunks
+
+    def _apply_facts(self, facts, chunk, found):
+        if found is None:
+            return
+        for url in chunk:
+            value = found.get(url)
+            if value is not None:
+                self.cache.set('track_facts', self.cache.make_key('track_facts', url), value)
+                facts[url] = value
+
+    def _plan_batch(self, pairs, chunk_size):
+        results = [None] * len(pairs)
+        pending = {}
+
+        # 1. Prima indice locale e cache, poi deduplica le coppie rimaste
+        for i, (title, artist) in enumerate(pairs):
+            local = self._local_lookup('get_track_url', title, artist)
+            if local is not None:
+                results[i] = local
+                continue
+            if not self.remote_fallback:
+                results[i] = (None, None)
+                continue
+            key = self.cache.make_key('track_url', title, artist)
+            cached = self.cache.get(key)
+            if cached is not None:
+                results[i] = tuple(cached)
+            else:
+                pending.setdefault(key, []).append(i)
+
+        keys = list(pending)
+        chunks = [keys[start:start + chunk_size] for start in range(0, len(keys), chunk_size)]
+        return results, pending, chunks
+
+    def _apply_batch(self, results, pending, chunk, found):
+        if found is None:
+            return
+        for n, key in enumerate(chunk):
+            value = found.get(n, (None, None))
+            # Il blocco è riuscito: un brano assente è un "non trovato" vero
+            self.cache.set('track_url', key, value,
+                           ttl=None if value[0] is not None else NEGATIVE_TTLS['track_url'])
+            for i in pending[key]:
+                results[i] = value
+
+    def _bundle_keys(self, song_url, artist_url):
+        # Stesse chiavi dei singoli metodi, così il bundle e le chiamate separate si riempiono a vicenda
+        keys = {'track': ('track_details', self.cache.make_key('track_details', song_url.strip('<>')))}
+        if artist_url:
+            keys['artist'] = ('artist_details', self.cache.make_key('artist_details', artist_url))
+            keys['recommendations'] = ('recommendations',
+                                       self.cache.make_key('recommendations', song_url, artist_url))
+        return keys
+
+    def _plan_bundle(self, song_url, artist_url):
+        bundle = {'track': TrackDetails(), 'artist': None, 'recommendations': [], 'partial': False}
+        local_args = {
+            'track': ('get_track_details', song_url),
+            'artist': ('get_artist_details', artist_url),
+            'recommendations': ('get_recommendations', song_url, artist_url),
+        }
+        missing = []
+        for part, (method, key) in self._bundle_keys(song_url, artist_url).items():
+            value = self._local_lookup(*local_args[part])
+            if value is None and self.remote_fallback:
+                value = self.cache.get(key)
+                if value is None:
+                    missing.append(part)
+                    continue
+            if value is not None:
+                bundle[part] = _copy_part(value)
+        return bundle, missing
+
+    def _apply_bundle(self, bundle, song_url, artist_url, missing, fetched):
+        keys = self._bundle_keys(song_url, artist_url)
+        for part, value in fetched.items():
+            method, key = keys[part]
+            # Stesse regole dei metodi singoli: i "non trovato" con il TTL breve
+            self.cache.set(method, key, value, ttl=None if _part_found(value) else NEGATIVE_TTLS[method])
+            bundle[part] = _copy_part(value)
+        # Query fallita (_run restituisce {}): le parti non arrivate non sono un "non trovato"
+        bundle['partial'] = any(part not in fetched for part in missing)
+
+    # --- API asincrona (modalità ASGI) --------------------------------------
+    # Stessa logica dei metodi sincroni (indice locale, cache, coalescenza),
+    # ma le query a Wikidata non bloccano l'event loop. Indice SQLite e Redis
+    # sono sincroni: le loro letture e scritture passano da _off_loop.
+
+    async def _off_loop(self, fn, *args):
+        """Esegue `fn` in un thread se tocca I/O bloccante (indice locale o Redis), altrimenti subito."""
+        if self.local is None and self.cache.redis is None:
+            return fn(*args)
+        return await asyncio.to_thread(fn, *args)
+
+    async def _acached(self, method, key, afetch, cache_if, default):
+        try:
+            return await self.cache.aget_or_load(
+                method, key,
+                lambda: self.aflight.do(key, afetch),
+                cache_if=cache_if, negative_ttl=NEGATIVE_TTLS.get(method))
+        except Exception:
+            return default
+
+    @instrumented('wikidata')
+    async def aget_track_url(self, title, artist):
+        local = await self._off_loop(self._local_lookup, 'get_track_url', title, artist)
+        if local is not None:
+            return local
+        if not self.remote_fallback:
+            return None, None
+        key = self.cache.make_key('track_url', title, artist)
+        song_url, artist_url = await self._acached(
+            'track_url', key,
+            lambda: self._afetch_track_url(title, artist),
+            cache_if=lambda v: v[0] is not None, default=(None, None))
+        return song_url, artist_url
+
+    @instrumented('wikidata')
+    async def aget_track_details(self, entity_url):
+        local = await self._off_loop(self._local_lookup, 'get_track_details', entity_url)
+        if local is not None:
+            return local
+        if not self.remote_fallback:
+            return TrackDetails()
+        key = self.cache.make_key('track_details', entity_url.strip('<>'))
+        return (await self._acached(
+            'track_details', key,
+            lambda: self._afetch_track_details(entity_url),
+            cache_if=lambda v: v.found, default=TrackDetails())).copy()
+
+    @instrumented('wikidata')
+    async def aget_artist_details(self, entity_url):
+        local = await self._off_loop(self._local_lookup, 'get_artist_details', entity_url)
+        if local is not None:
+            return local
+        if not self.remote_fallback:
+            return {'found': False}
+        key = self.cache.make_key('artist_details', entity_url)
+        return dict(await self._acached(
+            'artist_details', key,
+            lambda: self._afetch_artist_details(entity_url),
+            cache_if=lambda v: v.get('found'), default={'found': False}))
+
+    @instrumented('wikidata')
+    async def aget_recommendations(self, song_url, artist_url):
+        if not song_url or not artist_url: return []
+        local = await self._off_loop(self._local_lookup, 'get_recommendations', song_url, artist_url)
+        if local is not None:
+            return local
+        if not self.remote_fallback:
+            return []
+        key = self.cache.make_key('recommendations', song_url, artist_url)
+        return await self._acached(
+            'recommendations', key,
+            lambda: self._afetch_recommendations(song_url, artist_url),
+            cache_if=bool, default=[])
+
+    @instrumented('wikidata')
+    async def aget_track_bundle(self, song_url, artist_url=None):
+        bundle, missing = await self._off_loop(self._plan_bundle, song_url, artist_url)
+        if missing:
+            key = self.cache.make_key('track_bundle', song_url.strip('<>'), artist_url, *missing)
+            fetched = await self.aflight.do(key, lambda: self._afetch_track_bundle(song_url, artist_url, missing))
+            await self._off_loop(self._apply_bundle, bundle, song_url, artist_url, missing, fetched)
+        return bundle
+
+    @instrumented('wikidata')
+    async def aresolve_tracks_batch(self, pairs, chunk_size=BATCH_CHUNK_SIZE):
+        """Come resolve_tracks_batch, con i blocchi interrogati in parallelo."""
+        results, pending, chunks = await self._off_loop(self._plan_batch, pairs, chunk_size)
+        founds = await asyncio.gather(*(
+            self._afetch_track_urls_chunk([pairs[pending[k][0]] for k in chunk]) for chunk in chunks))
+        for chunk, found in zip(chunks, founds):
+            await self._off_loop(self._apply_batch, results, pending, chunk, found)
+        return results
+
+    @instrumented('wikidata')
+    async def aget_track_facts(self, song_urls, chunk_size=FACTS_CHUNK_SIZE):
+        """Come get_track_facts, con i blocchi interrogati in parallelo."""
+        facts, chunks = await self._off_loop(self._plan_facts, song_urls, chunk_size)
+        founds = await asyncio.gather(*(self._afetch_track_facts_chunk(chunk) for chunk in chunks))
+        for chunk, found in zip(chunks, founds):
+            await self._off_loop(self._apply_facts, facts, chunk, found)
+        return facts
+
+    # --- Query SPARQL -------------------------------------------------------
+    # Ogni query ha un costruttore (_X_query) e un parser (_parse_X) condivisi
+    # tra la versione sincrona (_fetch_X) e quella asincrona (_afetch_X).
+
+    # Ogni query passa dal circuit breaker del suo tipo (`call`). _load solleva
+    # in caso di errore (per _cached, che non deve salvare il ripiego), _run
+    # restituisce `default` (per batch e bundle, che riconoscono il ripiego).
+    # Con rows=True il parser riceve ResultRows (TSV/CSV in streaming, vedi
+    # services.sparql_results) invece del JSON: lo usano le query a una riga
+    # per valore, che arrivano già separate senza GROUP_CONCAT da spacchettare.
+
+    def _query(self, call, query, rows=False):
+        breaker = self.breakers.get(call)
+        breaker.guard()
+        try:
+            data = self.client.query_rows(query) if rows else self.client.query(query)
+        except Exception as e:
+            _record_failure(breaker, e)
+            raise
+        breaker.record_success()
+        return data
+
+    async def _aquery(self, call, query, rows=False):
+        breaker = self.breakers.get(call)
+        breaker.guard()
+        try:
+            data = await (self.aclient.query_rows(query) if rows else self.aclient.query(query))
+        except BaseException as e:
+            # Anche CancelledError (deadline della route): la prova half-open va rilasciata
+            _record_failure(breaker, e)
+            raise
+        breaker.record_success()
+        return data
+
+    def _load(self, call, query, parse, error_msg, rows=False):
+        try:
+            return parse(self._query(call, query, rows))
+        except Exception as e:
+            _log_error(error_msg, e)
+            raise
+
+    async def _aload(self, call, query, parse, error_msg, rows=False):
+        try:
+            return parse(await self._aquery(call, query, rows))
+        except Exception as e:
+            _log_error(error_msg, e)
+            raise
+
+    def _run(self, call, query, parse, default, error_msg, rows=False):
+        try:
+            return self._load(call, query, parse, error_msg, rows)
+        except Exception:
+            return default
+
+    async def _arun(self, call, query, parse, default, error_msg, rows=False):
+        try:
+            return await self._aload(call, query, parse, error_msg, rows)
+        except Exception:
+            return default
+
+    def _fetch_track_urls_chunk(self, chunk_pairs):
+        return self._run('track_urls_chunk', self._track_urls_chunk_query(chunk_pairs), self._parse_track_urls_chunk,
+                         None, f"Errore nella risoluzione batch ({len(chunk_pairs)} brani)", rows=True)
+
+    async def _afetch_track_urls_chunk(self, chunk_pairs):
+        return await self._arun('track_urls_chunk', self._track_urls_chunk_query(chunk_pairs),
+                                self._parse_track_urls_chunk,
+                                None, f"Errore nella risoluzione batch ({len(chunk_pairs)} brani)", rows=True)
+
+    def _track_urls_chunk_query(self, chunk_pairs):
+        """
+        Una sola query per un blocco di coppie: le ricerche mwapi prendono
+        i termini dalle variabili legate nella VALUES.
+        """
+        rows = "\n            ".join(
+            f'({n} "{_sparql_literal(strip_decorations(title))}" "{_sparql_literal(artist)}")'
+            for n, (title, artist) in enumerate(chunk_pairs)
+        )
+        query = f"""
+        SELECT ?idx ?canzone ?artista WHERE {{
+          VALUES (?idx ?titolo ?nomeArtista) {{
+            {rows}
+          }}
+
+          SERVICE wikibase:mwapi {{
+              bd:serviceParam wikibase:api "EntitySearch" .
+              bd:serviceParam wikibase:endpoint "www.wikidata.org" .
+              bd:serviceParam mwapi:search ?nomeArtista .
+              bd:serviceParam mwapi:language "it" .
+              ?artista wikibase:apiOutputItem mwapi:item .
+          }}
+
+          SERVICE wikibase:mwapi {{
+              bd:serviceParam wikibase:api "EntitySearch" .
+              bd:serviceParam wikibase:endpoint "www.wikidata.org" .
+              bd:serviceParam mwapi:search ?titolo .
+              bd:serviceParam mwapi:language "it" .
+              ?canzone wikibase:apiOutputItem mwapi:item .
+          }}
+
+          ?canzone wdt:P175 ?artista .
+          ?canzone wdt:P31/wdt:P279* wd:Q2188189 .
+        }}
+        """
+        return query
+
+    def _parse_track_urls_chunk(self, result):
+        """Restituisce {indice_nel_blocco: (song_url, artist_url)}."""
+        idx, canzone, artista = (result.column(v) for v in ('idx', 'canzone', 'artista'))
+
+        found = {}
+        for row in result:
+            n = int(row[idx])
+            # Come nella versione singola (LIMIT 1) teniamo il primo risultato
+            if n not in found:
+                found[n] = (row[canzone], row[artista])
+        return found
+
+    def _fetch_track_facts_chunk(self, song_urls):
+        return self._run('track_facts_chunk', self._track_facts_chunk_query(song_urls),
+                         lambda result: self._parse_track_facts_chunk(result, song_urls),
+                         None, f"Errore nel recupero dei dati batch ({len(song_urls)} brani)", rows=True)
+
+    async def _afetch_track_facts_chunk(self, song_urls):
+        return await self._arun('track_facts_chunk', self._track_facts_chunk_query(song_urls),
+                                lambda result: self._parse_track_facts_chunk(result, song_urls),
+                                None, f"Errore nel recupero dei dati batch ({len(song_urls)} brani)", rows=True)
+
+    def _track_facts_chunk_query(self, song_urls):
+        """
+        Data, generi e interpreti di un blocco di brani: una riga per valore
+        (?prop dice quale), così i campi a più valori arrivano già separati,
+        senza GROUP_CONCAT da impacchettare e spacchettare.
+        """
+        values = " ".join(f"<{url}>" for url in song_urls)
+        query = f"""
+        SELECT ?song ?prop ?value ?label WHERE {{
+          VALUES ?song {{ {values} }}
+          {{
+            ?song wdt:P577 ?value .
+            BIND("P577" AS ?prop)
+          }}
+          UNION
+          {{
+            ?song wdt:P136 ?value .
+            BIND("P136" AS ?prop)
+            OPTIONAL {{ ?value rdfs:label ?labelIT . FILTER(LANG(?labelIT) = "it") }}
+            OPTIONAL {{ ?value rdfs:label ?labelEN . FILTER(LANG(?labelEN) = "en") }}
+            BIND(COALESCE(?labelIT, ?labelEN) AS ?label)
+          }}
+          UNION
+          {{
+            ?song wdt:P175 ?value .
+            BIND("P175" AS ?prop)
+            OPTIONAL {{ ?value rdfs:label ?labelIT . FILTER(LANG(?labelIT) = "it") }}
+            OPTIONAL {{ ?value rdfs:label ?labelEN . FILTER(LANG(?labelEN) = "en") }}
+            BIND(COALESCE(?labelIT, ?labelEN, STR(?value)) AS ?label)
+          }}
+        }}
+        """
+        return query
+
+    def _parse_track_facts_chunk(self, result, song_urls):
+        """Restituisce {song_url: {'date', 'genres', 'performers'}} per tutti i brani del blocco."""
+        found = {url: {'date': None, 'genres': [], 'performers': []} for url in song_urls}
+        song, prop, value, label = (result.column(v) for v in ('song', 'prop', 'value', 'label'))
+        for row in result:
+            facts = found.get(row[song])
+            if facts is None or row[value] is None:
+                continue
+            kind = row[prop]
+            if kind == 'P577':
+                # Più date di pubblicazione: vale la prima (come MIN nella vecchia query)
+                date = row[value].split('T')[0]
+                if facts['date'] is None or date < facts['date']:
+                    facts['date'] = date
+            elif kind == 'P136':
+                if row[label] and row[label] not in facts['genres']:
+                    facts['genres'].append(row[label])
+            elif kind == 'P175':
+                if all(url != row[value] for _, url in facts['performers']):
+                    facts['performers'].append([row[label] or row[value], row[value]])
+        return found
+
+    def _fetch_track_url(self, title, artist):
+        return self._load('track_url', self._track_url_query(title, artist), self._parse_track_url,
+                          "Errore nel recupero URL tramite mwapi")
+
+    async def _afetch_track_url(self, title, artist):
+        return await self._aload('track_url', self._track_url_query(title, artist), self._parse_track_url,
+                                 "Errore nel recupero URL tramite mwapi")
+
+    def _track_url_query(self, title, artist):
         """
         Fase 1: Trova l'URL Wikidata della canzone E dell'artista.
         Restituisce una tupla: (track_url, artist_url)
         """
-        # Pulizia per evitare che le virgolette rompano la sintassi SPARQL
-        clean_title = title.replace('"', '')
+        # Pulizia per evitare che le virgolette rompano la sintassi SPARQL; senza gli incisi
+        # tipo "- Remastered 2011" o "(feat. X)" la ricerca trova anche le versioni Spotify
+        clean_title = strip_decorations(title).replace('"', '')
         clean_artist = artist.replace('"', '')
         
         # MODIFICA 1: Aggiunto ?artista alla SELECT
@@ -47,134 +706,128 @@ class WikiAgent:
           ?canzone wdt:P31/wdt:P279* wd:Q2188189 . 
         }} LIMIT 1
         """
-        try:
-            r = requests.get(self.url, params={'query': query, 'format': 'json'}, headers=self.headers)
-            r.raise_for_status()
-            data = r.json()
-            
-            results = data.get('results', {}).get('bindings', [])
-            
-            # MODIFICA 2: Restituiamo entrambi i valori
-            if results:
-                song_url = results[0]['canzone']['value']
-                artist_url = results[0]['artista']['value']
-                return song_url, artist_url
-            
-            return None, None
-            
-        except Exception as e:
-            print(f"Errore nel recupero URL tramite mwapi: {e}")
-            return None, None
+        return query
 
-    def get_track_details(self, entity_url):
+    def _parse_track_url(self, data):
+        results = data.get('results', {}).get('bindings', [])
+        
+        # MODIFICA 2: Restituiamo entrambi i valori
+        if results:
+            song_url = results[0]['canzone']['value']
+            artist_url = results[0]['artista']['value']
+            return song_url, artist_url
+        
+        return None, None
+
+    def _fetch_track_details(self, entity_url):
+        return self._load('track_details', self._track_details_query(entity_url),
+                          lambda result: self._parse_track_details(result, entity_url),
+                          "Errore Get Details", rows=True)
+
+    async def _afetch_track_details(self, entity_url):
+        return await self._aload('track_details', self._track_details_query(entity_url),
+                                 lambda result: self._parse_track_details(result, entity_url),
+                                 "Errore Get Details", rows=True)
+
+    def _track_details_query(self, entity_url):
         """
-        Versione ROBUSTA: Recupera il nome dell'artista in qualsiasi lingua disponibile
-        se mancano IT ed EN.
+        Scheda del brano, una riga per valore come in _track_facts_chunk_query:
+        ?prop dice quale campo ("title" per il titolo), così interpreti, generi,
+        produttori e premi arrivano già separati. Il nome dell'interprete cade
+        su una label in qualsiasi lingua se mancano IT ed EN.
         """
         if not entity_url.startswith('<'):
             entity_url = f"<{entity_url}>"
 
         query = f"""
-        SELECT 
-          ?songLabel
-          (SAMPLE(?img) AS ?immagine)
-          (MIN(?data) AS ?dataUscita) 
-          (GROUP_CONCAT(DISTINCT ?genereLabel; separator=", ") AS ?generi)
-          (GROUP_CONCAT(DISTINCT ?produttoreLabel; separator=", ") AS ?produttori)
-          (GROUP_CONCAT(DISTINCT ?premioLabel; separator=", ") AS ?premi)
-          (GROUP_CONCAT(DISTINCT ?artistPack; separator="||") AS ?artisti)
-        WHERE {{
-          BIND({entity_url} AS ?song) . 
-
-          OPTIONAL {{ ?song wdt:P18 ?img . }}
-          OPTIONAL {{ ?song wdt:P577 ?data . }}
-          OPTIONAL {{ ?song wdt:P136 ?genere . }}
-          OPTIONAL {{ ?song wdt:P162 ?produttore . }}
-          OPTIONAL {{ ?song wdt:P166 ?premio . }}
-
-          # --- RECUPERO ARTISTI (Versione "Prendi Tutto") ---
-          OPTIONAL {{ 
-            ?song wdt:P175 ?artist .
-            
-            # 1. Tentativo IT
-            OPTIONAL {{ ?artist rdfs:label ?labelIT . FILTER(LANG(?labelIT) = "it") }}
-            
-            # 2. Tentativo EN
-            OPTIONAL {{ ?artist rdfs:label ?labelEN . FILTER(LANG(?labelEN) = "en") }}
-            
-            # 3. Tentativo "Qualsiasi Lingua" (Prendiamo una label a caso se esistono)
-            OPTIONAL {{ ?artist rdfs:label ?labelANY . }}
-
-            # COALESCE: Prende il primo valore NON nullo della lista
-            BIND(COALESCE(?labelIT, ?labelEN, ?labelANY, STR(?artist)) AS ?finalName)
-            
-            # Creiamo il pacchetto
-            BIND(CONCAT(?finalName, "::", STR(?artist)) AS ?artistPack)
+        SELECT ?prop ?value ?label WHERE {{
+          {{
+            # Sempre una riga, anche senza label: il brano esiste
+            BIND("title" AS ?prop)
+            OPTIONAL {{ {entity_url} rdfs:label ?labelIT . FILTER(LANG(?labelIT) = "it") }}
+            OPTIONAL {{ {entity_url} rdfs:label ?labelEN . FILTER(LANG(?labelEN) = "en") }}
+            BIND(COALESCE(?labelIT, ?labelEN) AS ?label)
+          }}
+          UNION
+          {{
+            # Immagine, data, generi, produttori e premi
+            VALUES (?prop ?p) {{
+              ("P18" wdt:P18) ("P577" wdt:P577) ("P136" wdt:P136) ("P162" wdt:P162) ("P166" wdt:P166)
+            }}
+            {entity_url} ?p ?value .
+            OPTIONAL {{ ?value rdfs:label ?labelIT . FILTER(LANG(?labelIT) = "it") }}
+            OPTIONAL {{ ?value rdfs:label ?labelEN . FILTER(LANG(?labelEN) = "en") }}
+            BIND(COALESCE(?labelIT, ?labelEN) AS ?label)
           }}
-          # --------------------------------------------------
-
-          SERVICE wikibase:label {{ 
-            bd:serviceParam wikibase:language "it,en". 
-            ?song rdfs:label ?songLabel .
-            ?genere rdfs:label ?genereLabel .
-            ?produttore rdfs:label ?produttoreLabel .
-            ?premio rdfs:label ?premioLabel .
+          UNION
+          {{
+            {entity_url} wdt:P175 ?value .
+            BIND("P175" AS ?prop)
+            OPTIONAL {{ ?value rdfs:label ?labelIT . FILTER(LANG(?labelIT) = "it") }}
+            OPTIONAL {{ ?value rdfs:label ?labelEN . FILTER(LANG(?labelEN) = "en") }}
+            # Qualsiasi lingua solo come ultimo tentativo, altrimenti moltiplicherebbe le righe
+            OPTIONAL {{ ?value rdfs:label ?labelANY . FILTER(!BOUND(?labelIT) && !BOUND(?labelEN)) }}
+            BIND(COALESCE(?labelIT, ?labelEN, ?labelANY, STR(?value)) AS ?label)
           }}
         }}
-        GROUP BY ?songLabel
         """
-        
-        try:
-            r = requests.get(self.url, params={'query': query, 'format': 'json'}, headers=self.headers)
-            r.raise_for_status()
-            results = r.json().get('results', {}).get('bindings', [])
-            
-            if not results:
-                return {'found': False}
+        return query
 
-            res = results[0]
-            
-            # --- Parsing Artisti ---
-            artisti_raw = res.get('artisti', {}).get('value', '')
-            lista_artisti = []
-            
-            if artisti_raw:
-                # Usiamo un set per evitare duplicati se la logica ANY trova più label
-                nomi_visti = set() 
-                
-                for item in artisti_raw.split('||'):
-                    if '::' in item:
-                        parts = item.split('::')
-                        nome = parts[0]
-                        # Ricostruisce URL (gestisce casi con :: nel nome)
-                        url = "::".join(parts[1:])
-                        
-                        # Aggiungiamo solo se non abbiamo già inserito questo URL
-                        if url not in nomi_visti and nome and url:
-                            lista_artisti.append({'name': nome, 'url': url})
-                            nomi_visti.add(url)
-            
-            if not lista_artisti:
-                 lista_artisti.append({'name': 'Artista Sconosciuto', 'url': ''})
+    def _parse_track_details(self, result, entity_url):
+        if not len(result):
+            return TrackDetails()
 
-            return {
-                'found': True,
-                'wikidata_url': entity_url.replace('<','').replace('>',''),
-                'title': res.get('songLabel', {}).get('value', 'Titolo Sconosciuto'),
-                'image': res.get('immagine', {}).get('value', None),
-                'date': res.get('dataUscita', {}).get('value', '').split('T')[0] if 'dataUscita' in res else 'N/D',
-                'genres': res.get('generi', {}).get('value', 'N/D'),
-                'producers': res.get('produttori', {}).get('value', 'N/D'),
-                'awards': res.get('premi', {}).get('value', 'Nessuno'),
-                'artisti_list': lista_artisti
-            }
-            
-        except Exception as e:
-            print(f"Errore Get Details: {e}")
-            return {'found': False}
+        prop, value, label = (result.column(v) for v in ('prop', 'value', 'label'))
+        title = image = date = None
+        labels = {'P136': [], 'P162': [], 'P166': []}
+        lista_artisti = []
+        for row in result:
+            kind = row[prop]
+            if kind == 'title':
+                title = title or row[label]
+            elif row[value] is None:
+                continue
+            elif kind == 'P18':
+                image = image or row[value]
+            elif kind == 'P577':
+                # Più date di pubblicazione: vale la prima
+                day = row[value].split('T')[0]
+                if date is None or day < date:
+                    date = day
+            elif kind in labels:
+                if row[label] and row[label] not in labels[kind]:
+                    labels[kind].append(row[label])
+            elif kind == 'P175':
+                # Un interprete con più label "qualsiasi lingua" arriva su più righe: teniamo la prima
+                if all(a.url != row[value] for a in lista_artisti):
+                    lista_artisti.append(ArtistRef(row[label] or row[value], row[value]))
 
+        if not lista_artisti:
+             lista_artisti.append(ArtistRef('Artista Sconosciuto', ''))
 
-    def get_artist_details(self, entity_url):
+        return TrackDetails(
+            found=True,
+            wikidata_url=entity_url.replace('<','').replace('>',''),
+            title=title or 'Titolo Sconosciuto',
+            image=image,
+            date=date or 'N/D',
+            genres=", ".join(labels['P136']) or 'N/D',
+            producers=", ".join(labels['P162']) or 'N/D',
+            awards=", ".join(labels['P166']) or 'Nessuno',
+            artisti_list=lista_artisti
+        )
+
+    def _fetch_artist_details(self, entity_url):
+        return self._load('artist_details', self._artist_details_query(entity_url),
+                          lambda result: self._parse_artist_details(result, entity_url),
+                          "Errore nel recupero dell'artista", rows=True)
+
+    async def _afetch_artist_details(self, entity_url):
+        return await self._aload('artist_details', self._artist_details_query(entity_url),
+                                 lambda result: self._parse_artist_details(result, entity_url),
+                                 "Errore nel recupero dell'artista", rows=True)
+
+    def _artist_details_query(self, entity_url):
         """
         Estrae i dettagli di un artista partendo dal suo URL Wikidata (QID).
         """
@@ -218,32 +871,35 @@ class WikiAgent:
         }}
         GROUP BY ?nome
         """
-        try:
-            r = requests.get(self.url, params={'query': query, 'format': 'json'}, headers=self.headers)
-            r.raise_for_status()
-            results = r.json().get('results', {}).get('bindings', [])
-            
-            if results:
-                res = results[0]
-                return {
-                    'found': True,
-                    'name': res.get('nome', {}).get('value', 'Sconosciuto'),
-                    'image': res.get('img', {}).get('value'),
-                    'description': res.get('desc', {}).get('value', 'Nessuna biografia disponibile su Wikidata.'),
-                    'birth': res.get('dataNascita', {}).get('value', '').split('T')[0] if 'dataNascita' in res else None,
-                    'death': res.get('dataMorte', {}).get('value', '').split('T')[0] if 'dataMorte' in res else None,
-                    'origin': res.get('luogo', {}).get('value', 'Non specificato'),
-                    'genres': res.get('generi', {}).get('value', 'Non specificato'),
-                    'url': entity_url
-                }
-            return {'found': False}
-        except Exception as e:
-            print(f"Errore nel recupero dell'artista: {e}")
-            return {'found': False}
+        return query
 
-    def get_recommendations(self, song_url, artist_url):
-        if not song_url or not artist_url: return []
+    def _parse_artist_details(self, result, entity_url):
+        if len(result):
+            res = _bound(result, result.rows[0])
+            return {
+                'found': True,
+                'name': res.get('nome', 'Sconosciuto'),
+                'image': res.get('img'),
+                'description': res.get('desc', 'Nessuna biografia disponibile su Wikidata.'),
+                'birth': res['dataNascita'].split('T')[0] if 'dataNascita' in res else None,
+                'death': res['dataMorte'].split('T')[0] if 'dataMorte' in res else None,
+                'origin': res.get('luogo', 'Non specificato'),
+                'genres': res.get('generi', 'Non specificato'),
+                'url': entity_url
+            }
+        return {'found': False}
+
+    def _fetch_recommendations(self, song_url, artist_url):
+        return self._load('recommendations', self._recommendations_query(song_url, artist_url),
+                          lambda result: self._parse_recommendations(result, artist_url),
+                          "❌ Errore Recs", rows=True)
 
+    async def _afetch_recommendations(self, song_url, artist_url):
+        return await self._aload('recommendations', self._recommendations_query(song_url, artist_url),
+                                 lambda result: self._parse_recommendations(result, artist_url),
+                                 "❌ Errore Recs", rows=True)
+
+    def _recommendations_query(self, song_url, artist_url):
         song_id = song_url.split('/')[-1]
         artist_id = artist_url.split('/')[-1]
         
@@ -302,40 +958,82 @@ class WikiAgent:
           SERVICE wikibase:label {{ bd:serviceParam wikibase:language "[AUTO_LANGUAGE],en,it". }}
         }}
         """
-        
-        try:
-            r = requests.get(self.url, params={'query': query, 'format': 'json'}, headers=self.headers)
-            results = r.json().get('results', {}).get('bindings', [])
-            recs = []
-            seen = set()
-
-            for res in results:
-                title = res.get("songLabel", {}).get("value", "Titolo Sconosciuto")
-                if title in seen: continue
-                seen.add(title)
-                
-                rec_type = res["type"]["value"]
-                
-                # Gestione URL Artista:
-                # Se è Fan Choice, usiamo l'URL originale (artist_url).
-                # Se è Discovery, usiamo quello trovato nella query (?artist).
-                if rec_type == "Fan Choice":
-                    current_artist_url = artist_url # Quello che abbiamo passato alla funzione
-                    artist_name = "Stesso Artista"
-                else:
-                    current_artist_url = res.get("artist", {}).get("value")
-                    artist_name = res.get("artistLabel", {}).get("value", "Artista Simile")
-
-                recs.append({
-                    "title": title, 
-                    "artist": artist_name, 
-                    "type": rec_type,
-                    "image": res.get("image", {}).get("value", "https://via.placeholder.com/150"),
-                    # DATI FONDAMENTALI PER IL LINK DIRETTO:
-                    "url": res["song"]["value"],       # ID Canzone (url wikidata)
-                    "artist_url": current_artist_url   # ID Artista
-                })
-            return recs
-        except Exception as e:
-            print(f"❌ Errore Recs: {e}")
-            return []
\ No newline at end of file
+        return query
+
+    def _parse_recommendations(self, result, artist_url):
+        recs = []
+        seen = set()
+
+        for row in result:
+            res = _bound(result, row)
+            title = res.get("songLabel", "Titolo Sconosciuto")
+            if title in seen: continue
+            seen.add(title)
+            
+            rec_type = res["type"]
+            
+            # Gestione URL Artista:
+            # Se è Fan Choice, usiamo l'URL originale (artist_url).
+            # Se è Discovery, usiamo quello trovato nella query (?artist).
+            if rec_type == "Fan Choice":
+                current_artist_url = artist_url # Quello che abbiamo passato alla funzione
+                artist_name = "Stesso Artista"
+            else:
+                current_artist_url = res.get("artist")
+                artist_name = res.get("artistLabel", "Artista Simile")
+
+            recs.append(Recommendation(
+                title=title, 
+                artist=artist_name, 
+                type=rec_type,
+                image=res.get("image", "https://via.placeholder.com/150"),
+                # DATI FONDAMENTALI PER IL LINK DIRETTO:
+                url=res["song"],                # ID Canzone (url wikidata)
+                artist_url=current_artist_url   # ID Artista
+            ))
+        return recs
+
+    def _fetch_track_bundle(self, song_url, artist_url, parts):
+        return self._run('track_bundle', self._track_bundle_query(song_url, artist_url, parts),
+                         lambda result: self._parse_track_bundle(result, song_url, artist_url, parts),
+                         {}, "Errore Get Bundle", rows=True)
+
+    async def _afetch_track_bundle(self, song_url, artist_url, parts):
+        return await self._arun('track_bundle', self._track_bundle_query(song_url, artist_url, parts),
+                                lambda result: self._parse_track_bundle(result, song_url, artist_url, parts),
+                                {}, "Errore Get Bundle", rows=True)
+
+    def _track_bundle_query(self, song_url, artist_url, parts):
+        """
+        Le query dei singoli metodi diventano sotto-query in UNION: ogni riga
+        porta in ?part il blocco da cui proviene, così i parser restano gli stessi.
+        """
+        subqueries = {
+            'track': lambda: self._track_details_query(song_url),
+            'artist': lambda: self._artist_details_query(artist_url),
+            'recommendations': lambda: self._recommendations_query(song_url, artist_url),
+        }
+        blocks = "\n          UNION\n".join(
+            f'{{ {{ {subqueries[part]()} }}\n            BIND("{part}" AS ?part) }}'
+            for part in parts
+        )
+        query = f"""
+        SELECT * WHERE {{
+          {blocks}
+        }}
+        """
+        return query
+
+    def _parse_track_bundle(self, result, song_url, artist_url, parts):
+        rows = {part: [] for part in parts}
+        column = result.column('part')
+        for row in result:
+            if row[column] in rows:
+                rows[row[column]].append(row)
+
+        parsers = {
+            'track': lambda d: self._parse_track_details(d, song_url),
+            'artist': lambda d: self._parse_artist_details(d, artist_url),
+            'recommendations': lambda d: self._parse_recommendations(d, artist_url),
+        }
+        return {part: parsers[part](ResultRows(result.vars, rows[part])) for part in parts}
@@ -0,0 +1,129 @@
+import threading
+import time
+
+import pytest
+
+from services import cache as cache_module
+from services.cache import InMemoryRedis, TieredCache
+
+
+class Clock:
+    """Sostituisce il modulo time in services.cache: il tempo avanza solo a comando."""
+
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache_module, 'time', clock)
+    return clock
+
+
+class Loader:
+    def __init__(self, *values):
+        self.values = list(values)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return self.values.pop(0)
+
+
+def test_fresh_entry_is_served_until_ttl(clock):
+    cache = TieredCache(ttls={'m': 10}, stale_ttl=0)
+    load = Loader('v1', 'v2')
+
+    assert cache.get_or_load('m', 'k', load) == 'v1'
+    clock.now += 9
+    assert cache.get_or_load('m', 'k', load) == 'v1'
+    clock.now += 2
+    assert cache.get_or_load('m', 'k', load) == 'v2'
+
+    assert load.calls == 2
+    assert cache.stats()['hits'] == 1
+
+
+def test_stale_entry_is_served_while_refreshing(clock):
+    cache = TieredCache(ttls={'m': 10}, stale_ttl=60)
+    refreshed = threading.Event()
+    cache.get_or_load('m', 'k', Loader('v1'))
+    clock.now += 30
+
+    def reload():
+        refreshed.set()
+        return 'v2'
+
+    assert cache.get_or_load('m', 'k', reload) == 'v1'
+    assert refreshed.wait(5)
+    _wait_for(lambda: cache.stats()['refreshes'] == 1)
+    assert cache.get('k') == 'v2'
+    assert cache.stats()['stale_hits'] == 1
+
+
+def test_negative_results_use_negative_ttl(clock):
+    cache = TieredCache(ttls={'m': 3600}, stale_ttl=0)
+    load = Loader(None, None)
+
+    cache.get_or_load('m', 'k', load, cache_if=lambda v: v is not None, negative_ttl=5)
+    cache.get_or_load('m', 'k', load, cache_if=lambda v: v is not None, negative_ttl=5)
+    assert load.calls == 1
+    clock.now += 6
+    cache.get_or_load('m', 'k', load, cache_if=lambda v: v is not None, negative_ttl=5)
+
+    assert load.calls == 2
+    assert cache.stats()['negative_stores'] == 2
+
+
+def test_rejected_results_without_negative_ttl_are_not_stored(clock):
+    cache = TieredCache()
+
+    cache.get_or_load('m', 'k', Loader(None), cache_if=lambda v: v is not None)
+
+    assert cache.get('k') is None
+
+
+def test_lru_evicts_least_recently_used(clock):
+    cache = TieredCache(max_entries=2)
+    cache.set('m', 'a', 1)
+    cache.set('m', 'b', 2)
+    cache.get('a')
+
+    cache.set('m', 'c', 3)
+
+    assert (cache.get('a'), cache.get('b'), cache.get('c')) == (1, None, 3)
+    assert cache.stats()['evictions'] == 1
+
+
+def test_redis_entry_is_promoted_to_local_tier(clock):
+    redis = InMemoryRedis()
+    TieredCache(redis_client=redis).set('m', 'k', {'title': 'Imagine'})
+    other = TieredCache(redis_client=redis)
+
+    assert other.get('k') == {'title': 'Imagine'}
+    redis.delete('k')
+    assert other.get('k') == {'title': 'Imagine'}
+    assert other.stats()['redis_hits'] == 1
+
+
+def test_unreadable_redis_entry_is_a_miss(clock):
+    redis = InMemoryRedis()
+    redis.set('k', '{"v": 1')
+    redis.set('j', '{"v": 1}')
+    cache = TieredCache(redis_client=redis)
+
+    assert cache.get('k') is None
+    assert cache.get('j') is None
+    assert cache.stats()['redis_errors'] == 2
+
+
+def _wait_for(condition, timeout=5):
+    for _ in range(int(timeout / 0.01)):
+        if condition():
+            return
+        time.sleep(0.01)
+    raise AssertionError("condizione non raggiunta")
@@ -0,0 +1,166 @@
+import asyncio
+
+import pytest
+import requests
+
+from services import circuit
+from services.circuit import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitBreakers, CircuitOpenError
+from services.deadline import DeadlineExceeded
+from services.wiki_client import WikiAgent
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(circuit.time, 'monotonic', clock)
+    return clock
+
+
+def open_breaker(clock, threshold=3, reset=30.0):
+    breaker = CircuitBreaker('test', failure_threshold=threshold, reset_timeout=reset)
+    for _ in range(threshold):
+        assert breaker.allow()
+        breaker.record_failure()
+    return breaker
+
+
+def test_opens_after_consecutive_failures(clock):
+    breaker = open_breaker(clock)
+    assert breaker.state == OPEN
+    assert not breaker.allow()
+    with pytest.raises(CircuitOpenError):
+        breaker.guard()
+    stats = breaker.stats()
+    assert stats['failures'] == 3 and stats['opened'] == 1 and stats['rejected'] == 2
+    assert stats['state'] == 2
+
+
+def test_success_resets_the_failure_count(clock):
+    breaker = CircuitBreaker('test', failure_threshold=3)
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == CLOSED
+
+
+def test_half_open_lets_a_single_probe_through(clock):
+    breaker = open_breaker(clock)
+    clock.now += 30
+    assert breaker.allow()
+    assert breaker.state == HALF_OPEN
+    assert not breaker.allow()
+
+
+def test_probe_success_closes_and_failure_reopens(clock):
+    breaker = open_breaker(clock)
+    clock.now += 30
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CLOSED and breaker.allow()
+
+    breaker = open_breaker(clock)
+    clock.now += 30
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == OPEN and breaker.stats()['opened'] == 2
+    assert not breaker.allow()
+    clock.now += 29
+    assert not breaker.allow()
+
+
+def test_release_frees_the_probe_without_changing_state(clock):
+    breaker = open_breaker(clock)
+    clock.now += 30
+    assert breaker.allow()
+    breaker.release()
+    assert breaker.state == HALF_OPEN
+    assert breaker.allow()
+
+
+def test_zero_threshold_disables_the_breaker(clock):
+    breaker = CircuitBreaker('test', failure_threshold=0)
+    for _ in range(10):
+        breaker.record_failure()
+    assert breaker.allow()
+
+
+def test_registry_creates_one_breaker_per_name():
+    breakers = CircuitBreakers(failure_threshold=2, reset_timeout=5)
+    assert breakers.get('a') is breakers.get('a')
+    assert breakers.get('a') is not breakers.get('b')
+    assert breakers.get('b').failure_threshold == 2
+    assert set(breakers.stats()) == {'a', 'b'}
+
+
+# --- WikiAgent: la prova half-open si chiude su ogni percorso -----------------
+
+class FailingClient:
+    def __init__(self, error):
+        self.error = error
+
+    def query(self, query):
+        if self.error is not None:
+            raise self.error
+        return {'head': {'vars': []}, 'results': {'bindings': []}}
+
+
+class AsyncFailingClient(FailingClient):
+    async def query(self, query):
+        if self.error is not None:
+            raise self.error
+        await asyncio.sleep(0)
+        return {'head': {'vars': []}, 'results': {'bindings': []}}
+
+
+def half_open_agent(clock, client=None, aclient=None):
+    agent = WikiAgent(client=client or FailingClient(None), aclient=aclient, local=None)
+    agent.breakers = CircuitBreakers(failure_threshold=1, reset_timeout=30)
+    breaker = agent.breakers.get('track_details')
+    breaker.record_failure()
+    clock.now += 30
+    return agent, breaker
+
+
+def _http_error(status):
+    response = requests.Response()
+    response.status_code = status
+    return requests.HTTPError(f"{status}", response=response)
+
+
+@pytest.mark.parametrize('error, state, allowed', [
+    (None, CLOSED, True),
+    (requests.ConnectionError('giù'), OPEN, False),
+    (_http_error(503), OPEN, False),
+    (_http_error(400), HALF_OPEN, True),
+    (DeadlineExceeded('scaduta'), HALF_OPEN, True),
+])
+def test_query_settles_the_probe(clock, error, state, allowed):
+    agent, breaker = half_open_agent(clock, client=FailingClient(error))
+    try:
+        agent._query('track_details', 'SELECT')
+    except Exception:
+        pass
+    assert breaker.state == state
+    assert breaker.allow() is allowed
+
+
+def test_cancelled_async_query_releases_the_probe(clock):
+    agent, breaker = half_open_agent(clock, aclient=AsyncFailingClient(asyncio.CancelledError()))
+
+    async def run():
+        with pytest.raises(asyncio.CancelledError):
+            await agent._aquery('track_details', 'SELECT')
+
+    asyncio.run(run())
+    assert breaker.state == HALF_OPEN
+    assert breaker.allow()
@@ -0,0 +1,93 @@
+import asyncio
+import time
+
+import pytest
+
+from services import deadline
+from services.deadline import DeadlineExceeded
+
+
+@pytest.fixture(autouse=True)
+def no_deadline():
+    deadline.clear()
+    yield
+    deadline.clear()
+
+
+def test_no_deadline_by_default():
+    assert deadline.remaining() is None
+    assert deadline.check() is None
+    assert deadline.fits(1e9)
+    assert not deadline.expired()
+
+
+@pytest.mark.parametrize('seconds', [None, 0, -1])
+def test_start_without_budget_clears_the_deadline(seconds):
+    deadline.start(5)
+    deadline.start(seconds)
+    assert deadline.remaining() is None
+
+
+def test_start_and_check():
+    deadline.start(5)
+    left = deadline.check()
+    assert 4.5 < left <= 5
+    assert deadline.fits(1) and not deadline.fits(10)
+
+
+def test_expired_deadline_raises_timeout_error():
+    deadline.start(0.001)
+    time.sleep(0.01)
+    assert deadline.expired()
+    assert not deadline.fits(0)
+    with pytest.raises(TimeoutError):
+        deadline.check('query')
+    with pytest.raises(DeadlineExceeded, match='query'):
+        deadline.check('query')
+
+
+def test_budget_sets_and_restores_the_deadline():
+    with deadline.budget(5):
+        assert 4.5 < deadline.remaining() <= 5
+    assert deadline.remaining() is None
+
+
+def test_nested_budget_keeps_the_tighter_deadline():
+    deadline.start(2)
+    with deadline.budget(10):
+        assert deadline.remaining() <= 2
+        with deadline.budget(0.5):
+            assert deadline.remaining() <= 0.5
+        assert 1.5 < deadline.remaining() <= 2
+    assert 1.5 < deadline.remaining() <= 2
+
+
+def test_zero_budget_leaves_the_deadline_unchanged():
+    deadline.start(3)
+    with deadline.budget(0):
+        assert 2.5 < deadline.remaining() <= 3
+    with deadline.budget(None):
+        assert 2.5 < deadline.remaining() <= 3
+
+
+def test_budget_is_restored_after_an_exception():
+    with pytest.raises(ValueError):
+        with deadline.budget(1):
+            raise ValueError
+    assert deadline.remaining() is None
+
+
+def test_deadline_follows_threads_and_tasks_but_not_siblings():
+    async def child():
+        return deadline.remaining()
+
+    async def run():
+        deadline.start(5)
+        in_thread = await asyncio.to_thread(deadline.remaining)
+        in_task = await asyncio.create_task(child())
+        return in_thread, in_task
+
+    in_thread, in_task = asyncio.run(run())
+    assert in_thread is not None and in_task is not None
+    # asyncio.run ha il suo contesto: la scadenza non resta impostata qui
+    assert deadline.remaining() is None
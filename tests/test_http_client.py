@@ -0,0 +1,42 @@
+import asyncio
+import threading
+
+import httpx
+
+from services.http_client import LoopClient
+
+
+def test_client_is_closed_when_loop_changes():
+    holder = LoopClient(httpx.AsyncClient)
+    other = asyncio.new_event_loop()
+    thread = threading.Thread(target=other.run_forever, daemon=True)
+    thread.start()
+    try:
+        # Client nato nel loop di un altro thread, ancora in esecuzione
+        old = asyncio.run_coroutine_threadsafe(_get(holder), other).result(timeout=5)
+
+        new = asyncio.run(_get(holder))
+
+        assert new is not old
+        asyncio.run_coroutine_threadsafe(asyncio.sleep(0), other).result(timeout=5)
+        assert old.is_closed
+    finally:
+        other.call_soon_threadsafe(other.stop)
+        thread.join(timeout=5)
+        other.close()
+
+
+def test_aclose_closes_the_current_client():
+    holder = LoopClient(httpx.AsyncClient)
+
+    async def scenario():
+        client = holder.get()
+        assert holder.get() is client
+        await holder.aclose()
+        return client
+
+    assert asyncio.run(scenario()).is_closed
+
+
+async def _get(holder):
+    return holder.get()
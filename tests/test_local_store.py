@@ -0,0 +1,56 @@
+import json
+
+import pytest
+
+from services.local_store import LocalStore
+
+
+def entity(qid, label, *performers):
+    claims = {'P175': [{'rank': 'normal', 'mainsnak': {'snaktype': 'value',
+                                                      'datavalue': {'value': {'id': p}}}}
+                       for p in performers]}
+    return {'type': 'item', 'id': qid, 'labels': {'it': {'value': label}}, 'claims': claims}
+
+
+def write_dump(path, entities):
+    lines = ['['] + [json.dumps(e) + ',' for e in entities] + [']']
+    path.write_text('\n'.join(lines), encoding='utf-8')
+    return str(path)
+
+
+@pytest.fixture
+def store(tmp_path):
+    return LocalStore(str(tmp_path / 'music.sqlite'))
+
+
+def rows(store, table, column, qid):
+    return store.conn.execute(f"SELECT COUNT(*) FROM {table} WHERE {column} = ?", (qid,)).fetchone()[0]
+
+
+def test_duplicate_entity_in_batch_is_stored_once(store, tmp_path):
+    dump = write_dump(tmp_path / 'dump.json', [
+        entity('Q1', 'Bohemian Rhapsody', 'Q15862'),
+        entity('Q2', 'Imagine', 'Q1203'),
+        entity('Q1', 'Bohemian Rhapsody', 'Q15862'),
+    ])
+
+    store.import_dump(dump, batch_size=10)
+
+    assert rows(store, 'names', 'qid', 'Q1') == 1
+    assert rows(store, 'links', 'subject', 'Q1') == 1
+
+
+def test_reimport_replaces_linked_rows(store, tmp_path):
+    store.import_dump(write_dump(tmp_path / 'old.json', [entity('Q1', 'Vecchio titolo', 'Q15862')]))
+    store.import_dump(write_dump(tmp_path / 'new.json', [entity('Q1', 'Nuovo titolo', 'Q15862', 'Q15869')]))
+
+    names = [r[0] for r in store.conn.execute("SELECT norm FROM names WHERE qid = 'Q1'")]
+    assert names == ['nuovo titolo']
+    assert rows(store, 'links', 'subject', 'Q1') == 2
+
+
+def test_names_are_indexed_by_qid(store, tmp_path):
+    store.import_dump(write_dump(tmp_path / 'dump.json', [entity('Q1', 'Imagine')]))
+
+    plan = ' '.join(r[-1] for r in store.conn.execute("EXPLAIN QUERY PLAN DELETE FROM names WHERE qid = 'Q1'"))
+    assert 'idx_names_qid' in plan
@@ -0,0 +1,66 @@
+import pytest
+
+from services.matcher import MATCH_THRESHOLD, TrackMatcher, clean_artist, clean_title, strip_decorations
+
+QUEEN = 'Q15862'
+BOWIE = 'Q5383'
+
+
+@pytest.mark.parametrize('title, expected', [
+    ('Bohemian Rhapsody - Remastered 2011', 'Bohemian Rhapsody'),
+    ('Under Pressure (feat. David Bowie) [Live]', 'Under Pressure'),
+    ('Heroes - Single Version', 'Heroes'),
+    ('Song 2 feat. Someone', 'Song 2'),
+    # Nessun inciso decorativo: il titolo resta intero
+    ('Hey Jude - Part 2', 'Hey Jude - Part 2'),
+    ('(Remastered)', '(Remastered)'),
+])
+def test_strip_decorations(title, expected):
+    assert strip_decorations(title) == expected
+
+
+def test_clean_title_and_artist():
+    assert clean_title("Déjà Vu (Live)") == 'deja vu'
+    assert clean_artist('Queen feat. David Bowie') == 'queen'
+
+
+@pytest.fixture
+def matcher():
+    matcher = TrackMatcher()
+    for qid, title, performer in [('Q1', 'Bohemian Rhapsody', QUEEN),
+                                  ('Q2', 'Under Pressure', QUEEN),
+                                  ('Q3', 'Under Pressure', BOWIE),
+                                  ('Q4', 'Heroes', BOWIE)]:
+        matcher.add_title(qid, title)
+        matcher.performers.setdefault(qid, []).append(performer)
+    matcher.add_artist_name(QUEEN, 'Queen')
+    matcher.add_artist_name(BOWIE, 'David Bowie')
+    return matcher
+
+
+def test_exact_match(matcher):
+    assert matcher.match('Bohemian Rhapsody', 'Queen') == ('Q1', QUEEN, 1.0)
+
+
+def test_spotify_decorations_are_ignored(matcher):
+    song, performer, score = matcher.match('Bohemian Rhapsody - Remastered 2011', 'Queen')
+
+    assert (song, performer) == ('Q1', QUEEN)
+    assert score >= MATCH_THRESHOLD
+
+
+def test_artist_picks_between_same_titles(matcher):
+    assert matcher.match('Under Pressure', 'David Bowie')[:2] == ('Q3', BOWIE)
+    assert matcher.match('Under Pressure', 'Queen')[:2] == ('Q2', QUEEN)
+
+
+def test_wrong_artist_scores_below_threshold(matcher):
+    song, _, score = matcher.match('Heroes', 'Motörhead')
+
+    assert song == 'Q4'
+    assert score < MATCH_THRESHOLD
+
+
+def test_unrelated_title_has_no_match(matcher):
+    assert matcher.match('Smells Like Teen Spirit', 'Nirvana') is None
+    assert matcher.match('', 'Queen') is None
@@ -0,0 +1,83 @@
+import os
+import time
+
+import pytest
+
+from services.models import Track
+from services.playlist_cache import PlaylistSnapshotCache
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return PlaylistSnapshotCache(str(tmp_path), page_size=3)
+
+
+def save(cache, pages, playlist_id='p', snapshot_id='s1'):
+    writer = cache.writer(playlist_id, snapshot_id)
+    for page in pages:
+        writer.write(page)
+    writer.commit()
+
+
+def tracks(*titles):
+    return [Track(title, 'artista', 'album') if title else None for title in titles]
+
+
+def test_window_uses_spotify_positions(cache):
+    # None: voce scartata da Spotify (file locale, podcast), conta come posizione
+    save(cache, [tracks('a', None, 'b'), tracks('c', None)])
+
+    window, total = cache.get_window('p', 's1', 1, 3)
+
+    assert [t.title for t in window] == ['b', 'c']
+    assert total == 5
+
+
+def test_pages_skip_placeholders(cache):
+    save(cache, [tracks('a', None, 'b', 'c', 'd')])
+
+    pages = list(cache.get_pages('p', 's1'))
+
+    assert [[t.title for t in page] for page in pages] == [['a', 'b', 'c'], ['d']]
+
+
+def test_unknown_snapshot_is_a_miss(cache):
+    save(cache, [tracks('a')])
+
+    assert cache.get_window('p', 's2', 0, 10) is None
+    assert cache.get_pages('p', 's2') is None
+    assert cache.stats()['misses'] == 2
+
+
+def age(path, seconds):
+    past = time.time() - seconds
+    os.utime(path, (past, past))
+
+
+def test_orphan_tmp_files_are_evicted(tmp_path):
+    cache = PlaylistSnapshotCache(str(tmp_path), tmp_grace=60)
+    orphan = tmp_path / 'q_abc.v2.jsonl.1.2.tmp'
+    orphan.write_text('[]\n')
+    age(orphan, 120)
+    writing = tmp_path / 'r_abc.v2.jsonl.3.4.tmp'
+    writing.write_text('[]\n')
+
+    save(cache, [tracks('a')])
+
+    assert not orphan.exists()
+    assert writing.exists()
+
+
+def test_tmp_files_count_toward_byte_budget(tmp_path):
+    cache = PlaylistSnapshotCache(str(tmp_path), max_bytes=1000)
+    save(cache, [tracks('a')], playlist_id='old')
+    old = cache.path_for('old', 's1')
+    age(old, 10)
+    # Spazio per un solo snapshot accanto al .tmp
+    (tmp_path / 'w_abc.v2.jsonl.1.2.tmp').write_text('x' * (1000 - os.path.getsize(old)))
+
+    save(cache, [tracks('b')], playlist_id='new')
+
+    # Il .tmp recente resta e occupa il budget: esce lo snapshot meno recente
+    assert cache.get_window('old', 's1', 0, 1) is None
+    assert cache.get_window('new', 's1', 0, 1) is not None
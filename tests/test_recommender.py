@@ -0,0 +1,81 @@
+import pytest
+
+from services.recommender import PLACEHOLDER_IMAGE, RecommendationIndex, entity_url
+
+QUEEN = 'Q15862'
+BOWIE = 'Q5383'
+ELO = 'Q207406'
+ROCK = 'Q11399'
+POP = 'Q37073'
+
+
+@pytest.fixture
+def index():
+    index = RecommendationIndex()
+    index.artist_labels = {BOWIE: 'David Bowie', ELO: 'Electric Light Orchestra'}
+    index.upsert('Q1', 'Bohemian Rhapsody', None, 1975, [QUEEN], [ROCK])
+    index.upsert('Q2', 'We Will Rock You', 'cover.jpg', 1977, [QUEEN], [ROCK])
+    index.upsert('Q3', 'Fame', None, 1979, [BOWIE], [ROCK])
+    index.upsert('Q4', 'Evil Woman', None, 1976, [ELO], [ROCK])
+    index.upsert('Q5', "Let's Dance", None, 1983, [BOWIE], [ROCK])
+    index.upsert('Q6', 'Starman', None, None, [BOWIE], [ROCK, POP])
+    return index
+
+
+def titles(recs, rec_type):
+    return [r.title for r in recs if r.type == rec_type]
+
+
+def test_fan_choice_and_discovery(index):
+    recs = index.recommend('Q1', QUEEN, entity_url(QUEEN))
+
+    assert titles(recs, 'Fan Choice') == ['We Will Rock You']
+    # Stesso genere entro ±4 anni, dal più vicino; poi i brani senza data
+    assert titles(recs, 'Discovery') == ['Evil Woman', 'Fame', 'Starman']
+    fan, discovery = recs[0], recs[1]
+    assert (fan.artist, fan.image, fan.artist_url) == ('Stesso Artista', 'cover.jpg', entity_url(QUEEN))
+    assert (discovery.artist, discovery.image, discovery.artist_url) == \
+        ('Electric Light Orchestra', PLACEHOLDER_IMAGE, entity_url(ELO))
+
+
+def test_unknown_song_is_not_indexed(index):
+    assert index.recommend('Q999', QUEEN, entity_url(QUEEN)) is None
+
+
+def test_duplicate_titles_are_recommended_once(index):
+    index.upsert('Q7', 'Fame', None, 1975, [ELO], [ROCK])
+
+    recs = index.recommend('Q1', QUEEN, entity_url(QUEEN))
+
+    assert titles(recs, 'Discovery').count('Fame') == 1
+
+
+def test_upsert_moves_song_between_buckets(index):
+    index.upsert('Q4', 'Evil Woman', None, 1999, [ELO], [POP])
+
+    assert 'Evil Woman' not in titles(index.recommend('Q1', QUEEN, entity_url(QUEEN)), 'Discovery')
+    assert index.by_genre[ROCK].dated == [(1975, 'Q1'), (1977, 'Q2'), (1979, 'Q3'), (1983, 'Q5')]
+
+
+class FakeStore:
+    def __init__(self, records):
+        self.records = records
+
+    def artist_labels(self):
+        return {BOWIE: 'Bowie'}
+
+    def song_records(self, qids=None):
+        return [r for r in self.records if qids is None or r[0] in qids]
+
+
+def test_refresh_updates_and_removes_songs(index):
+    store = FakeStore([('Q3', 'Fame (remaster)', None, 1979, [BOWIE], [ROCK])])
+
+    index.refresh(store, ['Q3', 'Q4'])
+
+    assert index.songs['Q3'][0] == 'Fame (remaster)'
+    assert 'Q4' not in index.songs
+    assert 'Q4' not in index.by_performer[ELO]
+    discovery = [r for r in index.recommend('Q1', QUEEN, entity_url(QUEEN)) if r.type == 'Discovery']
+    assert discovery[0].title == 'Fame (remaster)'
+    assert discovery[0].artist == 'Bowie'
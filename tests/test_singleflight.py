@@ -0,0 +1,127 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from services import deadline
+from services.cache import InMemoryRedis
+from services.deadline import DeadlineExceeded
+from services.singleflight import AsyncSingleFlight, SingleFlight
+
+
+@pytest.fixture(autouse=True)
+def no_deadline():
+    deadline.clear()
+    yield
+    deadline.clear()
+
+
+class SlowCall:
+    """Funzione a monte che resta in corso finché il test non la sblocca."""
+
+    def __init__(self, result='risultato', error=None):
+        self.result = result
+        self.error = error
+        self.calls = 0
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def __call__(self):
+        self.calls += 1
+        self.started.set()
+        self.release.wait(5)
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+def run_concurrently(flight, fn, callers=5):
+    with ThreadPoolExecutor(callers) as pool:
+        futures = [pool.submit(flight.do, 'k', fn) for _ in range(callers)]
+        assert fn.started.wait(5)
+        _wait_for(lambda: flight.stats()['shared'] == callers - 1)
+        fn.release.set()
+        return [f.exception() or f.result() for f in futures]
+
+
+def test_concurrent_calls_share_one_upstream_call():
+    flight = SingleFlight()
+    fn = SlowCall()
+
+    results = run_concurrently(flight, fn)
+
+    assert results == ['risultato'] * 5
+    assert fn.calls == 1
+    assert flight.stats() == {'leaders': 1, 'shared': 4, 'remote_waits': 0, 'in_flight': 0}
+
+
+def test_error_reaches_every_waiter():
+    flight = SingleFlight()
+    error = ValueError("Wikidata giù")
+
+    results = run_concurrently(flight, SlowCall(error=error), callers=3)
+
+    assert results == [error] * 3
+
+
+def test_waiter_gives_up_at_deadline():
+    flight = SingleFlight()
+    fn = SlowCall()
+    with ThreadPoolExecutor(1) as pool:
+        leader = pool.submit(flight.do, 'k', fn)
+        assert fn.started.wait(5)
+        deadline.start(0.05)
+        with pytest.raises(DeadlineExceeded):
+            flight.do('k', fn)
+        fn.release.set()
+        assert leader.result() == 'risultato'
+
+
+def test_other_process_result_is_read_from_cache():
+    redis = InMemoryRedis()
+    flight = SingleFlight(redis_client=redis, poll_interval=0.01)
+    # Lock preso da un altro processo, che poi salva il risultato in cache
+    redis.set('lock:k', 'altro-processo', nx=True, px=5000)
+    cached = []
+    threading.Timer(0.05, cached.append, ['dalla cache']).start()
+
+    result = flight.do('k', lambda: 'query locale', lookup=lambda: cached[0] if cached else None)
+
+    assert result == 'dalla cache'
+    assert flight.stats()['remote_waits'] == 1
+
+
+def test_lock_is_released_after_the_call():
+    redis = InMemoryRedis()
+    flight = SingleFlight(redis_client=redis)
+
+    assert flight.do('k', lambda: 42) == 42
+    assert redis.get('lock:k') is None
+
+
+def test_async_calls_share_one_task():
+    flight = AsyncSingleFlight()
+    calls = 0
+
+    async def fetch():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return 'risultato'
+
+    async def scenario():
+        return await asyncio.gather(*(flight.do('k', fetch) for _ in range(5)))
+
+    assert asyncio.run(scenario()) == ['risultato'] * 5
+    assert calls == 1
+    assert flight.stats() == {'leaders': 1, 'shared': 4, 'in_flight': 0}
+
+
+def _wait_for(condition, timeout=5):
+    for _ in range(int(timeout / 0.01)):
+        if condition():
+            return
+        time.sleep(0.01)
+    raise AssertionError("condizione non raggiunta")
@@ -0,0 +1,124 @@
+import asyncio
+
+import pytest
+
+from services.sparql_results import (CsvParser, LineSplitter, ResultRows, TsvParser, aparse_stream,
+                                     decode_tsv_term, parse_stream, rows_from_json)
+
+
+def chunked(text, size):
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+@pytest.mark.parametrize('field, value', [
+    ('<http://www.wikidata.org/entity/Q42>', 'http://www.wikidata.org/entity/Q42'),
+    ('"Queen"', 'Queen'),
+    ('"Queen"@it', 'Queen'),
+    ('"1975-10-31T00:00:00Z"^^<http://www.w3.org/2001/XMLSchema#dateTime>', '1975-10-31T00:00:00Z'),
+    ('"3"^^<http://www.w3.org/2001/XMLSchema#integer>', '3'),
+    ('"a \\"b\\" c"@en', 'a "b" c'),
+    ('"tab\\there\\nnew\\rline\\\\"', 'tab\there\nnew\rline\\'),
+    ('"\\u00e8 \\U0001F3B8"', 'è 🎸'),
+    ('"\\\\u00e8"', '\\u00e8'),
+    ('42', '42'),
+    ('true', 'true'),
+    ('_:b0', '_:b0'),
+    ('', None),
+])
+def test_decode_tsv_term(field, value):
+    assert decode_tsv_term(field) == value
+
+
+TSV = ('?song\t?label\t?year\r\n'
+       '<http://www.wikidata.org/entity/Q1>\t"Uno"@it\t"1975"^^<http://www.w3.org/2001/XMLSchema#gYear>\r\n'
+       '<http://www.wikidata.org/entity/Q2>\t\t\r\n'
+       '<http://www.wikidata.org/entity/Q3>\t"Tre\\tcon tab"\n'
+       '<http://www.wikidata.org/entity/Q4>\t"Quattro   sep"\t1999\n')
+TSV_ROWS = [
+    ('http://www.wikidata.org/entity/Q1', 'Uno', '1975'),
+    ('http://www.wikidata.org/entity/Q2', None, None),
+    # Colonne finali non legate omesse: la riga viene completata con None
+    ('http://www.wikidata.org/entity/Q3', 'Tre\tcon tab', None),
+    ('http://www.wikidata.org/entity/Q4', 'Quattro   sep', '1999'),
+]
+
+
+@pytest.mark.parametrize('size', [1, 2, 7, 64, 10_000])
+def test_tsv_stream_any_chunking(size):
+    result = parse_stream('tsv', chunked(TSV, size))
+    assert result.vars == ['song', 'label', 'year']
+    assert result.rows == TSV_ROWS
+
+
+CSV = ('song,label,note\r\n'
+       'http://www.wikidata.org/entity/Q1,Uno,\r\n'
+       'http://www.wikidata.org/entity/Q2,"Due, con virgola","riga\r\nCRLF"\r\n'
+       'http://www.wikidata.org/entity/Q3,"Tre ""quoted""","riga\nLF"\r\n'
+       'http://www.wikidata.org/entity/Q4\r\n')
+CSV_ROWS = [
+    ('http://www.wikidata.org/entity/Q1', 'Uno', None),
+    ('http://www.wikidata.org/entity/Q2', 'Due, con virgola', 'riga\r\nCRLF'),
+    ('http://www.wikidata.org/entity/Q3', 'Tre "quoted"', 'riga\nLF'),
+    ('http://www.wikidata.org/entity/Q4', None, None),
+]
+
+
+@pytest.mark.parametrize('size', [1, 3, 16, 10_000])
+def test_csv_stream_any_chunking(size):
+    result = parse_stream('csv', chunked(CSV, size))
+    assert result.vars == ['song', 'label', 'note']
+    assert result.rows == CSV_ROWS
+
+
+def test_csv_without_final_newline():
+    assert parse_stream('csv', ['a,b\r\n1,"x\r\ny"']).rows == [('1', 'x\r\ny')]
+
+
+def test_async_stream_matches_sync():
+    async def chunks():
+        for chunk in chunked(TSV, 5):
+            yield chunk
+
+    result = asyncio.run(aparse_stream('tsv', chunks()))
+    assert result.rows == TSV_ROWS
+
+
+@pytest.mark.parametrize('parser', [TsvParser, CsvParser])
+def test_empty_results(parser):
+    assert parse_stream('tsv' if parser is TsvParser else 'csv', []).rows == []
+    p = parser()
+    p.feed('?a\t?b' if parser is TsvParser else 'a,b')
+    result = p.result()
+    assert result.vars == ['a', 'b'] and len(result) == 0
+
+
+def test_line_splitter_keeps_carriage_returns():
+    splitter = LineSplitter()
+    assert splitter.feed('a\r\nb') == ['a\r']
+    assert splitter.feed('c\n\nd') == ['bc', '']
+    assert splitter.close() == ['d']
+    assert splitter.close() == []
+
+
+def test_rows_from_json_matches_tsv():
+    data = {
+        'head': {'vars': ['song', 'label', 'year']},
+        'results': {'bindings': [
+            {'song': {'type': 'uri', 'value': 'http://www.wikidata.org/entity/Q1'},
+             'label': {'type': 'literal', 'xml:lang': 'it', 'value': 'Uno'},
+             'year': {'type': 'literal', 'value': '1975'}},
+            {'song': {'type': 'uri', 'value': 'http://www.wikidata.org/entity/Q2'}},
+        ]},
+    }
+    result = rows_from_json(data)
+    assert result.rows == [TSV_ROWS[0], TSV_ROWS[1]]
+    assert rows_from_json({}).rows == []
+
+
+def test_result_rows_column():
+    result = ResultRows(['a', 'b'], [(1, 2), (3, 4)])
+    assert result.column('b') == 1
+    assert [row[result.column('a')] for row in result] == [1, 3]
+    assert len(result) == 2
+    with pytest.raises(ValueError):
+        result.column('c')
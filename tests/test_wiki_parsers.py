@@ -0,0 +1,109 @@
+import pytest
+import requests
+
+from services.cache import TieredCache
+from services.models import ArtistRef, TrackDetails
+from services.sparql_results import ResultRows
+from services.wiki_client import WikiAgent
+
+SONG = 'http://www.wikidata.org/entity/Q187745'
+QUEEN = 'http://www.wikidata.org/entity/Q15862'
+MERCURY = 'http://www.wikidata.org/entity/Q15869'
+
+
+@pytest.fixture
+def agent():
+    return WikiAgent(client=object(), local=None)
+
+
+def details_rows(*rows):
+    return ResultRows(['prop', 'value', 'label'], list(rows))
+
+
+def test_track_details_from_rows(agent):
+    result = details_rows(
+        ('title', None, 'Bohemian Rhapsody'),
+        ('P577', '1976-01-01T00:00:00Z', None),
+        ('P577', '1975-10-31T00:00:00Z', None),
+        ('P136', 'http://www.wikidata.org/entity/Q1', 'rock progressivo'),
+        ('P136', 'http://www.wikidata.org/entity/Q2', 'hard rock'),
+        ('P162', 'http://www.wikidata.org/entity/Q3', 'Roy Thomas Baker'),
+        # Nome con '::' e '||': nessun separatore da spacchettare
+        ('P175', QUEEN, 'Queen :: Live || 1975'),
+        ('P175', MERCURY, 'Freddie Mercury'),
+        # Stesso interprete con un'altra label "qualsiasi lingua"
+        ('P175', MERCURY, 'Фредди Меркьюри'),
+    )
+    details = agent._parse_track_details(result, f"<{SONG}>")
+
+    assert details.found
+    assert details.wikidata_url == SONG
+    assert details.title == 'Bohemian Rhapsody'
+    assert details.date == '1975-10-31'
+    assert details.genres == 'rock progressivo, hard rock'
+    assert details.producers == 'Roy Thomas Baker'
+    assert details.awards == 'Nessuno'
+    assert details.image is None
+    assert details.artisti_list == [ArtistRef('Queen :: Live || 1975', QUEEN), ArtistRef('Freddie Mercury', MERCURY)]
+
+
+def test_track_details_defaults(agent):
+    details = agent._parse_track_details(details_rows(('title', None, None)), SONG)
+
+    assert details.found
+    assert details.title == 'Titolo Sconosciuto'
+    assert (details.date, details.genres, details.producers) == ('N/D', 'N/D', 'N/D')
+    assert details.artisti_list == [ArtistRef('Artista Sconosciuto', '')]
+
+
+def test_track_details_without_rows(agent):
+    assert not agent._parse_track_details(details_rows(), SONG).found
+
+
+def test_bundle_splits_rows_by_part(agent):
+    vars = ['part', 'prop', 'value', 'label', 'nome', 'generi', 'song', 'songLabel', 'artist', 'artistLabel',
+            'image', 'type']
+    result = ResultRows(vars, [
+        ('track', 'title', None, 'Bohemian Rhapsody') + (None,) * 8,
+        ('track', 'P175', QUEEN, 'Queen') + (None,) * 8,
+        ('artist', None, None, None, 'Queen', '') + (None,) * 6,
+        ('recommendations',) + (None,) * 5 + ('http://www.wikidata.org/entity/Q207014', 'We Will Rock You',
+                                               None, 'Stesso Artista', None, 'Fan Choice'),
+    ])
+    bundle = agent._parse_track_bundle(result, SONG, QUEEN, ('track', 'artist', 'recommendations'))
+
+    assert bundle['track'].title == 'Bohemian Rhapsody'
+    assert bundle['track'].artisti_list == [ArtistRef('Queen', QUEEN)]
+    # Le variabili non legate mancano come nei binding JSON; il GROUP_CONCAT vuoto resta ''
+    assert bundle['artist']['name'] == 'Queen'
+    assert bundle['artist']['genres'] == ''
+    assert bundle['artist']['description'] == 'Nessuna biografia disponibile su Wikidata.'
+    [rec] = bundle['recommendations']
+    assert (rec.title, rec.artist_url, rec.image) == ('We Will Rock You', QUEEN, 'https://via.placeholder.com/150')
+
+
+class DownClient:
+    def query_rows(self, query):
+        raise requests.ConnectionError("Wikidata giù")
+
+
+def test_bundle_failure_is_partial():
+    agent = WikiAgent(cache=TieredCache(), client=DownClient(), local=None)
+    details = TrackDetails(found=True, wikidata_url=SONG, title='Bohemian Rhapsody')
+    agent.cache.set('track_details', agent.cache.make_key('track_details', SONG), details)
+
+    bundle = agent.get_track_bundle(SONG, QUEEN)
+
+    # Dettagli dalla cache, consigliati mancanti per errore: non è un "nessun consigliato"
+    assert bundle['track'].found
+    assert bundle['recommendations'] == []
+    assert bundle['partial']
+
+
+def test_bundle_from_cache_is_complete(agent):
+    agent.cache = TieredCache()
+    agent.cache.set('track_details', agent.cache.make_key('track_details', SONG), TrackDetails(found=True))
+    agent.cache.set('artist_details', agent.cache.make_key('artist_details', QUEEN), {'found': True})
+    agent.cache.set('recommendations', agent.cache.make_key('recommendations', SONG, QUEEN), [])
+
+    assert agent.get_track_bundle(SONG, QUEEN)['partial'] is False